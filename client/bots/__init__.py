@@ -1 +1 @@
-__all__ = ["dummybot", "pipebot"]
\ No newline at end of file
+__all__ = ["alphabetabot", "dummybot", "mctsbot", "pipebot"]
\ No newline at end of file
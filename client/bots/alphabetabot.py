@@ -0,0 +1,24 @@
+# vim: ts=4 et sw=4 sts=4
+
+from common.bot import SimpleStatusHandler,BookBot,DeterministicSearch,Bot
+
+"""
+Plays the move found by paranoid alpha-beta with iterative deepening. Only
+the 10 best ordered moves are searched at each node, which takes a search
+on the standard board to 4 plies midgame in the default second.
+"""
+class AlphaBetaBot(SimpleStatusHandler, DeterministicSearch, Bot):
+    search_width = 10
+
+"""Plays the move found by max-n search with iterative deepening"""
+class MaxNBot(SimpleStatusHandler, DeterministicSearch, Bot):
+    search_mode = 'maxn'
+    search_width = 10
+
+"""
+Plays from the opening book in opening.book while it can, then like
+AlphaBetaBot. Books are built with python -m common.book.
+"""
+class BookAlphaBetaBot(SimpleStatusHandler, BookBot, DeterministicSearch, Bot):
+    book_path = 'opening.book'
+    search_width = 10
@@ -12,7 +12,7 @@ class HumanBot(SimpleStatusHandler, PlayOnReport, Bot):
         self.move_queue = move_queue
         super(HumanBot, self).__init__(**kwds)
 
-    def get_move(self):
+    def get_move(self, deadline=None):
         return self.move_queue.get()
 
     def report_move(self, move):
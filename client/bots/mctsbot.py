@@ -0,0 +1,12 @@
+# vim: ts=4 et sw=4 sts=4
+
+from common.bot import SimpleStatusHandler,PonderingBot,MonteCarloTreeSearch,Bot
+
+"""Plays the move most explored by Monte Carlo tree search"""
+class MCTSBot(SimpleStatusHandler, MonteCarloTreeSearch, Bot):
+    pass
+
+"""MCTSBot which keeps searching during the other players' turns"""
+class PonderingMCTSBot(SimpleStatusHandler, PonderingBot, MonteCarloTreeSearch,
+        Bot):
+    pass
@@ -1,21 +1,238 @@
-﻿from common import *
-
-"""Pipes game events between the server and bots implemented outside of the
-   python client application using stdio"""
-class PipeBot(Bot):
-    """Initializes the bot for a new game"""
-    def init(self, player_id, board):
-        raise NotImplementedError()
-    
+﻿# vim: ts=4 et sw=4 sts=4
+
+import os
+import select
+import subprocess
+import time
+import weakref
+
+from common.bot import Bot,PlayOnReport
+from common.data import Move
+
+"""
+A bot engine running as a separate process, spoken to over its stdin and
+stdout a line at a time. The process is started once and kept until close().
+"""
+class Engine(object):
+    def __init__(self, command):
+        self.command = command
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE, close_fds=True)
+        self.buffer = ''
+        # Numbers go requests, so late replies are never taken for new ones
+        self.requests = 0
+        # A weak reference to the PipeBot using the engine, if any
+        self.owner = None
+        # Set once the pipes have failed, which may be before the process
+        # has been seen to exit
+        self.broken = False
+
+    """Returns whether the engine is free for another PipeBot"""
+    def idle(self):
+        return self.owner is None or self.owner() is None
+
+    def alive(self):
+        return not self.broken and self.process.poll() is None
+
+    """Sends a line, raising IOError if the engine has gone away"""
+    def send(self, line):
+        try:
+            self.process.stdin.write(line + '\n')
+            self.process.stdin.flush()
+        except (IOError, OSError, ValueError) as e:
+            self.broken = True
+            raise IOError, "Engine %s is gone: %s" % (self.command, e)
+
+    """
+    Returns the next line from the engine, or None if none came before the
+    deadline (a time.time() value, None to wait forever). Raises IOError if
+    the engine has exited.
+    """
+    def read_line(self, deadline=None):
+        fd = self.process.stdout.fileno()
+        while '\n' not in self.buffer:
+            timeout = None
+            if deadline is not None:
+                timeout = max(0.0, deadline - time.time())
+            ready, _, _ = select.select([fd], [], [], timeout)
+            if not ready:
+                return None
+            data = os.read(fd, 4096)
+            if not data:
+                self.broken = True
+                raise IOError, "Engine %s exited" % (self.command,)
+            self.buffer += data
+        line, self.buffer = self.buffer.split('\n', 1)
+        return line.strip()
+
+    """Asks the engine to quit, killing it if it has not after timeout"""
+    def close(self, timeout=1.0):
+        if self.process.poll() is None:
+            try:
+                self.send('quit')
+            except IOError:
+                pass
+            deadline = time.time() + timeout
+            while self.process.poll() is None and time.time() < deadline:
+                time.sleep(0.01)
+            if self.process.poll() is None:
+                self.process.kill()
+        self.process.wait()
+
+"""
+Pipes game events between the server and a bot engine implemented outside
+of the python client, e.g. a compiled binary, over stdio. The engine is
+started the first time a PipeBot needs it and then kept for the next
+PipeBot with the same engine_command, so it lives on across the games of
+Client.go. Bots playing at once (e.g. in the arena) each get an engine of
+their own; a bot hands its engine back once its game ends, on close() or
+once it is gone. Moves are sent as six decimal numbers, <move> below being
+"<player> <piece> <rotation> <mirror> <x> <y>" (see Move.as_tuple), one
+line per event. Engines must flush their output after every line.
+
+Lines sent to the engine:
+
+    game <player_id> <player_count> <rows> <cols> <library>
+                            A new game starts, playing as player_id
+    move <move>             A move was made (by any player, skips included)
+    go <request> <ms>       Reply with a move for request within ms
+    status <code> <message> A Bot.STATUS_* message from the server
+    quit                    The engine should exit
+
+Lines read from the engine:
+
+    play <request> <move>   The move for go request
+    info <text>             Printed, e.g. for search statistics
+
+Other lines, and replies to earlier requests which came too late, are
+ignored. An engine missing the deadline of a go gets this bot's turn
+timed out (Move.timeout); an engine which has died gets it dropped
+(Move.dropped_skip) and is restarted for the next game.
+
+engine_command -- The engine's argv, must be set by subclasses
+move_time      -- Seconds the engine gets to answer each go, at most the
+                  bot's share of the game clock (see Bot.move_deadline)
+pipe_margin    -- Seconds kept back from the ms of each go for the round
+                  trip through the pipes, so an engine using all of its
+                  time still answers before this bot stops waiting
+"""
+class PipeBot(PlayOnReport):
+    engine_command = None
+    move_time = 5.0
+    pipe_margin = 0.05
+
+    # tuple(engine_command) -> [Engine, ...]
+    _engines = {}
+
+    def __init__(self, **kwds):
+        super(PipeBot, self).__init__(**kwds)
+        self.engine = self.get_engine()
+        self.request = None
+
+        board = self.board
+        self.send("game %d %d %d %d %s" % (self.player_id, board.player_count,
+            board.rows, board.cols, board.library))
+        for entry in board.journal:
+            self.send_move(entry[0])
+
+    """Takes an idle running engine for this bot, starting one if needed"""
+    def get_engine(self):
+        if not self.engine_command:
+            raise ValueError, "PipeBot subclasses must set engine_command"
+        engines = self._engines.setdefault(tuple(self.engine_command), [])
+        for engine in [e for e in engines if not e.alive()]:
+            engines.remove(engine)
+            engine.close()
+
+        for engine in engines:
+            if engine.idle():
+                break
+        else:
+            engine = Engine(list(self.engine_command))
+            engines.append(engine)
+        engine.owner = weakref.ref(self)
+        engine.buffer = ''
+        return engine
+
+    def owns_engine(self):
+        return self.engine.owner is not None and self.engine.owner() is self
+
+    """Hands the engine back for the next PipeBot, leaving it running"""
+    def close(self):
+        if self.owns_engine():
+            self.engine.owner = None
+
+    """Stops every engine started so far"""
+    @classmethod
+    def close_engines(cls):
+        for engines in cls._engines.values():
+            for engine in engines:
+                engine.close()
+        cls._engines.clear()
+
+    def send_move(self, move):
+        return self.send("move %d %d %d %d %d %d" % tuple(
+            int(v) for v in move.as_tuple()))
+
+    """Sends a line to the engine unless it has been handed back, returning
+    whether it went"""
+    def send(self, line):
+        if not self.owns_engine():
+            return False
+        try:
+            self.engine.send(line)
+            return True
+        except IOError as e:
+            print str(e)
+            return False
+
     """Must return a Move object"""
-    def get_move(self):
-        raise NotImplementedError()
-    
-    """Reports a move made by another player to this bot"""
+    def get_move(self, deadline=None):
+        self.engine.requests += 1
+        self.request = self.engine.requests
+        deadline = self.move_deadline(self.move_time, deadline)
+        ms = max(0, int((deadline - time.time() - self.pipe_margin) * 1000))
+        if not self.send("go %d %d" % (self.request, ms)):
+            return Move.dropped_skip(self.player_id)
+
+        while True:
+            try:
+                line = self.engine.read_line(deadline)
+            except IOError as e:
+                print str(e)
+                return Move.dropped_skip(self.player_id)
+            if line is None:
+                print "Engine took over %dms to move" % (ms,)
+                return Move.timeout(self.player_id)
+
+            words = line.split(None, 1)
+            if not words:
+                continue
+            if words[0] == 'info':
+                print line
+            elif words[0] == 'play':
+                try:
+                    values = [int(w) for w in words[1].split()]
+                    request = values[0]
+                    move = Move.from_tuple(values[1:])
+                except (ValueError, IndexError):
+                    print "Bad reply from engine: " + line
+                    continue
+                if request == self.request:
+                    move.mirror = bool(move.mirror)
+                    return move
+
+    """Reports every move made to this bot, handing the engine back once
+    the game is over"""
     def report_move(self, move):
-        raise NotImplementedError()
-    
+        super(PipeBot, self).report_move(move)
+        self.send_move(move)
+        if self.board.turn < 0:
+            self.close()
+
     """Reports a status message from the server to this bot
        (e.g. 'You took too long! Your turn has been skipped.')"""
     def report_status(self, status_code, message):
-        raise NotImplementedError()
\ No newline at end of file
+        self.send("status %d %s" % (status_code, message))
+        if status_code == Bot.STATUS_GAME_OVER:
+            self.close()
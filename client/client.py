@@ -4,6 +4,7 @@ import sys
 import ConfigParser
 
 from comm import GameServer
+from common.data import new_board
 from bots.dummybot import DummyBot as MyBot
 
 #from SSL_client import SSL_Connection as Connection
@@ -27,10 +28,15 @@ class Client(object):
         self.build_server()
 
     def play_game(self):
-        player_id, board = self.server.join_game()
+        player_id, board = self.server.join_game(board_constructor=new_board)
         self.bot = MyBot(player_id=player_id, board=board)
-        while (self.server.game_loop(self.bot)):
-            pass
+        try:
+            while (self.server.game_loop(self.bot)):
+                pass
+        finally:
+            # Bots may hold worker processes or engines until closed
+            if hasattr(self.bot, 'close'):
+                self.bot.close()
 
     def go(self):
         while True:
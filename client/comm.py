@@ -1,5 +1,7 @@
 # vim: ts=4 et sw=4 sts=4
 
+import time
+
 from common.communication import Message
 from common.data import Board,PieceLibrary
 # temp, I don't like this much cross-ref..
@@ -35,6 +37,12 @@ class GameServer(object):
         if m.message_type is Message.TYPE_CONTROL:
             if m.message_object == 'TURN':
                 Message.serialized(self.sock, Message.TYPE_MOVE, bot.get_move())
+            elif isinstance(m.message_object, list) and\
+                    m.message_object[0] == 'TURN':
+                # ["TURN", seconds left on our clock]
+                deadline = time.time() + m.message_object[1]
+                Message.serialized(self.sock, Message.TYPE_MOVE,
+                        bot.get_move(deadline))
             elif m.message_object == 'END':
                 return False
             else:
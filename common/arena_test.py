@@ -0,0 +1,58 @@
+# vim: ts=4 et sw=4 sts=4
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'server'))
+
+from arena import EloRatings
+
+class EloRatingsTests(unittest.TestCase):
+    def test_win(self):
+        ratings = EloRatings(k=16)
+        ratings.add_game(('a', 'b'), [10, -5])
+        self.assertAlmostEqual(ratings.ratings['a'], 1508.0)
+        self.assertAlmostEqual(ratings.ratings['b'], 1492.0)
+        self.assertEqual(ratings.stats['a'], [1, 1.0, 10, 1])
+        self.assertEqual(ratings.stats['b'], [1, 0.0, -5, 1])
+
+        # The favourite gains less for beating the same bot again
+        ratings.add_game(('a', 'b'), [10, -5])
+        self.assertTrue(1508.0 < ratings.ratings['a'] < 1516.0)
+        self.assertAlmostEqual(ratings.ratings['a'] + ratings.ratings['b'],
+                3000.0)
+
+    def test_tie(self):
+        ratings = EloRatings(k=16)
+        ratings.add_game(('a', 'b', 'c'), [3, 3, 1])
+        self.assertAlmostEqual(ratings.ratings['a'], ratings.ratings['b'])
+        # Each pair shares k between the game's other players
+        self.assertAlmostEqual(ratings.ratings['a'], 1504.0)
+        self.assertAlmostEqual(ratings.ratings['c'], 1492.0)
+        self.assertEqual(ratings.stats['a'][1], 0.5)
+
+    def test_seats_of_one_bot(self):
+        ratings = EloRatings(k=16)
+        ratings.add_game(('a', 'a', 'a', 'b'), [5, -2, 0, 1])
+        self.assertEqual(ratings.stats['a'], [1, 1.0, 3, 3])
+        self.assertEqual(ratings.stats['b'], [1, 0.0, 1, 1])
+        # Every seat of a is rated against b, but not against each other
+        self.assertAlmostEqual(ratings.ratings['a'] - 1500,
+                16.0 / 3 * ((1 - 0.5) + 2 * (0 - 0.5)))
+        table = dict((line.split()[0], line.split()[2:])
+                for line in str(ratings).splitlines()[1:])
+        self.assertEqual(table['a'], ['1', '1.0', '1.00'])
+        self.assertEqual(table['b'], ['1', '0.0', '1.00'])
+
+        # Self-play counts each game once
+        ratings = EloRatings()
+        for i in xrange(5):
+            ratings.add_game(('a',) * 4, [1, 2, 3, 3])
+        self.assertEqual(ratings.stats['a'][0], 5)
+        self.assertAlmostEqual(ratings.stats['a'][1], 5.0)
+        self.assertEqual(ratings.ratings['a'], 1500.0)
+
+if __name__ == '__main__':
+    unittest.main()
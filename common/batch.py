@@ -0,0 +1,301 @@
+# vim: ts=4 et sw=4 sts=4
+
+import numpy
+
+from common.data import Board,Move
+from common.data import DEFAULT_BOARD_SHAPE,DEFAULT_PLAYER_COUNT
+
+_ALL = numpy.uint64(0xFFFFFFFFFFFFFFFF)
+_M1 = numpy.uint64(0x5555555555555555)
+_M2 = numpy.uint64(0x3333333333333333)
+_M4 = numpy.uint64(0x0F0F0F0F0F0F0F0F)
+_H01 = numpy.uint64(0x0101010101010101)
+
+"""Returns the set bits of every uint64 in a, summed over the last axis"""
+def _popcount(a):
+    a = a - ((a >> numpy.uint64(1)) & _M1)
+    a = (a & _M2) + ((a >> numpy.uint64(2)) & _M2)
+    a = (a + (a >> numpy.uint64(4))) & _M4
+    return ((a * _H01) >> numpy.uint64(56)).astype(numpy.int64).sum(axis=-1)
+
+"""Shifts the bits of a so bit i + shift lands on bit i"""
+def _shift(a, shift):
+    if shift >= 0:
+        return a >> numpy.uint64(shift)
+    return a << numpy.uint64(-shift)
+
+"""
+A move choice policy for BatchSimulator.step preferring big pieces: each
+legal placement is drawn with a weight of its piece's size to the power
+"""
+def size_policy(power=1):
+    def policy(sim):
+        return sim.sizes[sim.orientation_piece].astype(float) ** power
+    return policy
+
+"""
+Plays many independent games at once, one ply of every game per step(),
+with NumPy doing the work of every game together.
+
+Each player's occupancy is kept as one uint64 per board row with bit
+y + pad_y set for column y, so boards may be at most 64 - 2 * pad_y
+columns wide. occupancy() unpacks it into a (games, players, rows, cols)
+boolean tensor. Legal placements of the player to move in every game are
+found for every piece orientation at once from shifted rows of the cells
+they may not cover and of the anchors one of which they must cover, the
+same rules as Board.is_valid_move and is_valid_first_move.
+
+Players move in turn, those who cannot place a piece skip and are out of
+the game, and a game ends once every player is out, as with Board.do_move.
+Finished games can be exported as Move lists with game_moves().
+"""
+class BatchSimulator(object):
+    def __init__(self, library, games, shape=DEFAULT_BOARD_SHAPE,
+            player_count=DEFAULT_PLAYER_COUNT, restrict_piece_ids_to=None,
+            seed=None):
+        self.library = library
+        self.games = games
+        self.shape = tuple(shape)
+        self.rows, self.cols = self.shape
+        self.player_count = player_count
+        self.rng = numpy.random.RandomState(seed)
+
+        board = Board(library, restrict_piece_ids_to, shape, player_count)
+        catalog = board.piece_library[0].catalog
+        self.piece_ids = catalog.ordered_ids
+        self.sizes = numpy.array(catalog.get_sizes(), dtype=numpy.int32)
+
+        # Every orientation of every piece, with its piece index, transform
+        # and cells relative to the move's position
+        orientations = []
+        for n, pc_id in enumerate(self.piece_ids):
+            piece = catalog[pc_id]
+            for rotation, mirror, key in piece.unique_orientations():
+                cells = [(c.x, c.y) for c in piece.get_transform_coords(
+                    rotation=rotation, mirror=mirror)]
+                orientations.append((n, rotation, mirror, cells))
+        self.orientation_piece = numpy.array([o[0] for o in orientations],
+                dtype=numpy.int32)
+        self.orientation_transform = [(o[1], o[2]) for o in orientations]
+        self.orientation_cells = [o[3] for o in orientations]
+
+        self.pad_x = max(abs(x) for o in orientations for x, y in o[3])
+        self.pad_y = max(abs(y) for o in orientations for x, y in o[3])
+        if self.cols + 2 * self.pad_y > 64:
+            raise ValueError, "Boards of %d columns are too wide to simulate" %\
+                    (self.cols,)
+
+        # Cells of each orientation as padded arrays, for placing pieces
+        width = max(len(cells) for cells in self.orientation_cells)
+        self.cell_dx = numpy.zeros((len(orientations), width), dtype=numpy.int64)
+        self.cell_dy = numpy.zeros((len(orientations), width), dtype=numpy.int64)
+        self.cell_valid = numpy.zeros((len(orientations), width), dtype=bool)
+        for o, cells in enumerate(self.orientation_cells):
+            for j, (x, y) in enumerate(cells):
+                self.cell_dx[o, j] = x
+                self.cell_dy[o, j] = y
+                self.cell_valid[o, j] = True
+
+        self.row_mask = numpy.uint64(((1 << self.cols) - 1) << self.pad_y)
+        self.start_rows = numpy.zeros(self.rows, dtype=numpy.uint64)
+        for c in board.corners:
+            self.start_rows[c.x] |= numpy.uint64(1 << (c.y + self.pad_y))
+
+        self.reset()
+
+    """Starts every game over from an empty board"""
+    def reset(self):
+        k, p = self.games, self.player_count
+        self.occupied = numpy.zeros((k, p, self.rows), dtype=numpy.uint64)
+        self.used = numpy.zeros((k, p, len(self.piece_ids)), dtype=bool)
+        self.placed = numpy.zeros((k, p), dtype=numpy.int32)
+        self.last_sizes = numpy.zeros((k, p), dtype=numpy.int32)
+        self.skips = numpy.zeros((k, p), dtype=bool)
+        self.turn = numpy.zeros(k, dtype=numpy.int64)
+        self.done = numpy.zeros(k, dtype=bool)
+        # Per ply, (player, orientation, x, y) arrays over the games: player
+        # -1 for games already over, orientation -1 for skips
+        self.history = []
+
+    """Returns the (games, players, rows, cols) boolean occupancy tensor"""
+    def occupancy(self):
+        bits = numpy.arange(self.pad_y, self.pad_y + self.cols,
+                dtype=numpy.uint64)
+        return (self.occupied[..., None] >> bits) & numpy.uint64(1) != 0
+
+    """
+    Returns an (orientations, rows, games) array of the rows of legal
+    positions of each orientation for the player to move in each of the
+    given games (by default all of them), bit y + pad_y for column y. Rows
+    are empty for pieces the player has used and for games which are over.
+    Games are the last axis so each row offset of a piece is one contiguous
+    slice.
+    """
+    def legal_rows(self, games=None):
+        if games is None:
+            games = numpy.arange(self.games)
+        turn = numpy.maximum(self.turn[games], 0)
+        own = self.occupied[games, turn].T
+        occupied = numpy.bitwise_or.reduce(self.occupied[games], axis=1).T
+        one = numpy.uint64(1)
+
+        edges = (own << one) | (own >> one)
+        edges[1:] |= own[:-1]
+        edges[:-1] |= own[1:]
+        touch = numpy.zeros_like(own)
+        touch[1:] |= (own[:-1] << one) | (own[:-1] >> one)
+        touch[:-1] |= (own[1:] << one) | (own[1:] >> one)
+        first = self.placed[games, turn] == 0
+        touch[:, first] = self.start_rows[:, None]
+
+        px, rows = self.pad_x, self.rows
+        blocked = numpy.empty((rows + 2 * px, len(games)), dtype=numpy.uint64)
+        blocked.fill(_ALL)
+        blocked[px:px + rows] = occupied | edges | ~self.row_mask
+        anchors = numpy.zeros(blocked.shape, dtype=numpy.uint64)
+        anchors[px:px + rows] = touch & ~occupied & ~edges & self.row_mask
+
+        # Both planes shifted once per column offset, sliced per row offset
+        shifts = xrange(-self.pad_y, self.pad_y + 1)
+        blocked = dict((y, _shift(blocked, y)) for y in shifts)
+        anchors = dict((y, _shift(anchors, y)) for y in shifts)
+
+        legal = numpy.empty((len(self.orientation_cells), rows, len(games)),
+                dtype=numpy.uint64)
+        bad = numpy.empty((rows, len(games)), dtype=numpy.uint64)
+        for o, cells in enumerate(self.orientation_cells):
+            good = legal[o]
+            x, y = cells[0]
+            bad[:] = blocked[y][px + x:px + x + rows]
+            good[:] = anchors[y][px + x:px + x + rows]
+            for x, y in cells[1:]:
+                bad |= blocked[y][px + x:px + x + rows]
+                good |= anchors[y][px + x:px + x + rows]
+            good &= ~bad
+        legal &= self.row_mask
+
+        unused = ~self.used[games, turn][:, self.orientation_piece].T
+        unused &= ~self.done[games]
+        legal *= unused[:, None, :]
+        return legal
+
+    """
+    Plays one ply of every game still running: the player to move places a
+    piece drawn among their legal placements, or skips if they have none.
+    By default every legal placement is equally likely. A policy is a
+    function of the simulator returning weights per orientation, either
+    (orientations,) or (games, orientations); a placement is drawn with its
+    orientation's weight. Returns the number of games still running.
+    """
+    def step(self, policy=None):
+        if self.done.all():
+            return 0
+
+        games = numpy.arange(self.games)
+        active = ~self.done
+        running = games[active]
+
+        # Only the running games are worked on, indexed by position in running
+        legal = self.legal_rows(running)
+        # Most rows are empty, so only the others are counted
+        size = len(running)
+        nonzero = numpy.flatnonzero(legal)
+        bins = nonzero // (self.rows * size) * size + nonzero % size
+        counts = numpy.bincount(bins, _popcount(legal.ravel()[nonzero, None]),
+                minlength=legal.shape[0] * size).reshape(-1, size).T
+        counts = counts.astype(float)
+        if policy is not None:
+            weights = numpy.asarray(policy(self))
+            if weights.ndim == 2:
+                weights = weights[running]
+            weighted = counts * weights
+            # Games where the policy rules out every legal move still move
+            ruled_out = weighted.sum(axis=1) <= 0
+            weighted[ruled_out] = counts[ruled_out]
+            counts = weighted
+        total = counts.sum(axis=1)
+
+        moving = numpy.zeros(self.games, dtype=bool)
+        moving[running] = total > 0
+        player = numpy.where(active, self.turn, -1)
+        orientation = numpy.empty(self.games, dtype=numpy.int64)
+        orientation.fill(-1)
+        x = numpy.zeros(self.games, dtype=numpy.int64)
+        y = numpy.zeros(self.games, dtype=numpy.int64)
+
+        if moving.any():
+            i = numpy.flatnonzero(total > 0)
+            k = running[i]
+            p = self.turn[k]
+            cumulative = counts[i].cumsum(axis=1)
+            draw = self.rng.random_sample(len(k)) * total[i]
+            o = (cumulative > draw[:, None]).argmax(axis=1)
+
+            # A uniform pick among the set bits of the orientation's rows:
+            # first the row, then the bit in it
+            chosen = legal[o, :, i]
+            per_row = _popcount(chosen[..., None]).cumsum(axis=1)
+            nth = (self.rng.random_sample(len(k)) * per_row[:, -1]).\
+                    astype(numpy.int64)
+            mx = (per_row > nth[:, None]).argmax(axis=1)
+            picked = numpy.arange(len(k))
+            row = chosen[picked, mx]
+            nth -= per_row[picked, mx] - _popcount(row[:, None])
+            bits = ((row[:, None] >> numpy.arange(64, dtype=numpy.uint64)) &
+                    numpy.uint64(1)).astype(numpy.int64).cumsum(axis=1)
+            my = (bits > nth[:, None]).argmax(axis=1) - self.pad_y
+
+            n = self.orientation_piece[o]
+            self.used[k, p, n] = True
+            self.placed[k, p] += 1
+            self.last_sizes[k, p] = self.sizes[n]
+            for j in xrange(self.cell_dx.shape[1]):
+                valid = self.cell_valid[o, j]
+                shift = (my + self.cell_dy[o, j] + self.pad_y)[valid]
+                numpy.bitwise_or.at(self.occupied,
+                        (k[valid], p[valid], (mx + self.cell_dx[o, j])[valid]),
+                        numpy.uint64(1) << shift.astype(numpy.uint64))
+
+            orientation[k], x[k], y[k] = o, mx, my
+
+        skipping = active & ~moving
+        self.skips[games[skipping], self.turn[skipping]] = True
+        self.history.append((player, orientation, x, y))
+
+        # The next player still in the game, if any
+        turn = self.turn.copy()
+        found = self.done.copy()
+        for offset in xrange(1, self.player_count + 1):
+            candidate = (self.turn + offset) % self.player_count
+            take = ~found & ~self.skips[games, candidate]
+            turn[take] = candidate[take]
+            found |= take
+        self.done |= ~found
+        turn[self.done] = -1
+        self.turn = turn
+        return int((~self.done).sum())
+
+    """Plays every game to the end, see step()"""
+    def run(self, policy=None):
+        while self.step(policy):
+            pass
+
+    """Returns a (games, players) array of scores as Board.get_score gives"""
+    def scores(self):
+        return Board.score_batch(self.used, self.sizes, self.last_sizes)
+
+    """Returns the moves of a game so far, in the order they were played"""
+    def game_moves(self, game):
+        moves = []
+        for player, orientation, x, y in self.history:
+            p = int(player[game])
+            if p < 0:
+                continue
+            o = int(orientation[game])
+            if o < 0:
+                moves.append(Move.skip(p))
+                continue
+            rotation, mirror = self.orientation_transform[o]
+            moves.append(Move(p, self.piece_ids[self.orientation_piece[o]],
+                rotation, mirror, (int(x[game]), int(y[game]))))
+        return moves
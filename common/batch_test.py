@@ -0,0 +1,55 @@
+# vim: ts=4 et sw=4 sts=4
+
+import unittest
+
+from common.batch import *
+from common.data import *
+
+class BatchSimulatorTests(unittest.TestCase):
+    """Replays every game on a Board, which must agree with each move"""
+    def assertMatchesBoard(self, sim):
+        scores = sim.scores()
+        occupancy = sim.occupancy()
+        for g in xrange(sim.games):
+            board = Board(sim.library, shape=sim.shape,
+                    player_count=sim.player_count)
+            for move in sim.game_moves(g):
+                self.assertEqual(board.turn, move.player_id)
+                if move.is_skip():
+                    self.assertEqual([m for m in board.legal_moves(move.player_id)
+                        if board.is_valid_move(m)], [])
+                else:
+                    self.assertTrue(board.is_valid_move(move))
+                board.play_move(move)
+            self.assertEqual(board.turn, -1)
+            self.assertEqual(list(scores[g]),
+                    [board.get_score(p) for p in xrange(board.player_count)])
+            owner = board.owner_plane()
+            for p in xrange(board.player_count):
+                self.assertTrue((occupancy[g, p] == (owner == p)).all())
+
+    def test_random_games(self):
+        for library, shape, player_count in (('tiny', (6,6), 4),
+                ('original', (14,20), 2), ('original', (20,20), 6)):
+            sim = BatchSimulator(library, 5, shape, player_count, seed=1)
+            sim.run()
+            self.assertTrue(sim.done.all())
+            self.assertMatchesBoard(sim)
+
+    def test_policy(self):
+        sim = BatchSimulator('original', 5, seed=2)
+        self.assertEqual(sim.occupancy().shape, (5, 4, 20, 20))
+        # Only the biggest pieces get played while they can be
+        sim.step(size_policy(50))
+        board = Board('original')
+        sizes = [len(board.move_coords(sim.game_moves(g)[0]))
+                for g in xrange(sim.games)]
+        self.assertEqual(sizes, [5] * sim.games)
+        sim.run(size_policy(2))
+        self.assertMatchesBoard(sim)
+
+    def test_too_wide(self):
+        self.assertRaises(ValueError, BatchSimulator, 'original', 1, (20,60))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,272 @@
+# vim: ts=4 et sw=4 sts=4
+
+"""Builds opening books from game logs.
+
+Usage: python -m common.book book_file game.log [game.log ...]
+
+Every game is replayed and its opening moves are counted, together with
+how often the player making them went on to win. Positions are stored under
+board symmetry, so openings mirrored into another corner count as one."""
+
+import mmap
+import struct
+import sys
+
+from common.data import Board,Move,Point
+from common.game_logger import GameParser
+
+"""
+The symmetries of a rows x cols board as functions of (x, y, rows, cols).
+The first four are symmetries of every board, the last four only of square
+boards. INVERSES[i] is the index of the symmetry undoing symmetry i.
+"""
+SYMMETRIES = (
+    lambda x, y, r, c: (x, y),
+    lambda x, y, r, c: (x, c - 1 - y),
+    lambda x, y, r, c: (r - 1 - x, y),
+    lambda x, y, r, c: (r - 1 - x, c - 1 - y),
+    lambda x, y, r, c: (y, x),
+    lambda x, y, r, c: (y, r - 1 - x),
+    lambda x, y, r, c: (c - 1 - y, x),
+    lambda x, y, r, c: (c - 1 - y, r - 1 - x),
+)
+INVERSES = (0, 1, 2, 3, 4, 6, 5, 7)
+
+def board_symmetries(board):
+    if board.rows == board.cols:
+        return len(SYMMETRIES)
+    return 4
+
+"""
+Returns (key, symmetry) for a position: the smallest of the position's
+Zobrist hashes over every symmetry of the board, and the first symmetry
+giving it. Any player may start from any corner, so the players stay who
+they are and only their cells move.
+"""
+def canonical_key(board):
+    keys = board.zobrist_keys
+    rows, cols = board.rows, board.cols
+    count = board_symmetries(board)
+    cells = [0] * count
+    for player_id in xrange(board.player_count):
+        for move in board.moves[player_id]:
+            if move.is_skip():
+                continue
+            for c in board.move_coords(move):
+                for s in xrange(count):
+                    x, y = SYMMETRIES[s](c.x, c.y, rows, cols)
+                    cells[s] ^= keys.cell(player_id, x, y)
+
+    # Everything but the cells is the same under every symmetry
+    rest = board.zobrist ^ cells[0]
+    return min((rest ^ cells[s], s) for s in xrange(count))
+
+"""Returns the move covering the cells move covers, moved by a symmetry"""
+def transform_move(board, move, symmetry):
+    if move.is_skip():
+        return move
+
+    transform = SYMMETRIES[symmetry]
+    cells = set(transform(c.x, c.y, board.rows, board.cols)
+            for c in board.move_coords(move))
+    first = min(cells)
+    piece = board.piece_library[move.player_id][move.piece_id]
+    for rotation, mirror, key in piece.unique_orientations():
+        coords = [(c.x, c.y) for c in
+                piece.get_transform_coords(rotation=rotation, mirror=mirror)]
+        low = min(coords)
+        x, y = first[0] - low[0], first[1] - low[1]
+        if set((cx + x, cy + y) for cx, cy in coords) == cells:
+            return Move(move.player_id, move.piece_id, rotation, mirror, (x, y))
+    raise ValueError, "No orientation of piece %d covers %s" % (
+            move.piece_id, sorted(cells))
+
+"""
+Opening moves by position, built from games with add_game() and saved to a
+file which lookup() reads in place.
+
+The file is a header, then the library name, then a hash table of (key,
+first record, record count) slots probed linearly from key % slots, then per
+position its records of (move code, games, wins), most played first. Keys
+and moves are in the frame of canonical_key()'s symmetry.
+"""
+class OpeningBook(object):
+    """Network order: magic, version, rows, cols, players, plies, library
+    name length, slot count"""
+    header_format = "!4sHHHHHHI"
+    slot_format = "!QII"
+    record_format = "!QIf"
+    magic = "BKOB"
+    version = 3
+
+    _books = {}
+
+    """Returns the book at path, loaded once per process"""
+    @classmethod
+    def get(cls, path):
+        try:
+            return cls._books[path]
+        except KeyError:
+            book = cls.load(path)
+            cls._books[path] = book
+            return book
+
+    """
+    An empty book for games of the given library, shape and player count,
+    counting the first plies moves of each game (by default four per player)
+    """
+    def __init__(self, library, shape, player_count, plies=None):
+        self.library = library
+        self.shape = tuple(shape)
+        self.player_count = player_count
+        if plies is None:
+            plies = 4 * player_count
+        self.plies = plies
+        # key -> {move code: [games, wins]}
+        self.positions = {}
+        self.games = 0
+        self.data = None
+
+    def matches(self, library, shape, player_count):
+        return (library, tuple(shape), player_count) ==\
+                (self.library, self.shape, self.player_count)
+
+    def new_board(self):
+        return Board(self.library, shape=self.shape,
+                player_count=self.player_count)
+
+    """
+    Counts the opening of a game, given as every move played in order. The
+    players' wins are shared as in MonteCarloTreeSearch.rewards.
+    """
+    def add_game(self, moves):
+        board = self.new_board()
+        for move in moves:
+            board.play_move(move)
+        scores = [s.score for s in board.standings()]
+        best = max(scores)
+        winners = scores.count(best)
+        rewards = [1.0 / winners if s == best else 0.0 for s in scores]
+
+        board = self.new_board()
+        for move in moves[:self.plies]:
+            if not move.is_skip():
+                key, symmetry = canonical_key(board)
+                code = transform_move(board, move, symmetry).encode()
+                stats = self.positions.setdefault(key, {}).setdefault(code,
+                        [0, 0.0])
+                stats[0] += 1
+                stats[1] += rewards[move.player_id]
+            board.play_move(move)
+        self.games += 1
+
+    """Counts the game in a game.log, which must be of this book's kind"""
+    def add_log(self, path):
+        parser = GameParser(path)
+        if not self.matches(parser.library, parser.shape, parser.num_players):
+            raise ValueError, "%s is not a %s game of %d players on %s" % (
+                    path, self.library, self.player_count, self.shape)
+        self.add_game(list(parser))
+
+    def save(self, path):
+        if len(self.library) >= 1 << 16:
+            raise ValueError, "Library name too long for a book: " +\
+                    self.library[:32] + "..."
+        slots = 1
+        while slots < 2 * len(self.positions):
+            slots *= 2
+
+        table = [(0, 0, 0)] * slots
+        records = []
+        for key in sorted(self.positions):
+            moves = self.positions[key]
+            order = sorted(moves, key=lambda code: (-moves[code][0],
+                    -moves[code][1], code))
+            i = key % slots
+            while table[i][2]:
+                i = (i + 1) % slots
+            table[i] = (key, len(records), len(order))
+            records.extend((code,) + tuple(moves[code]) for code in order)
+
+        with open(path, 'wb') as o:
+            o.write(struct.pack(self.header_format, self.magic, self.version,
+                self.shape[0], self.shape[1], self.player_count, self.plies,
+                len(self.library), slots))
+            o.write(self.library)
+            for slot in table:
+                o.write(struct.pack(self.slot_format, *slot))
+            for record in records:
+                o.write(struct.pack(self.record_format, *record))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, rows, cols, player_count, plies, length, slots =\
+                struct.unpack_from(cls.header_format, data, 0)
+        if magic != cls.magic or version != cls.version:
+            raise IOError, "Not an opening book: " + path
+
+        at = struct.calcsize(cls.header_format)
+        book = cls(data[at:at + length], (rows, cols), player_count, plies)
+        book.data = data
+        book.slots = slots
+        book.slots_at = at + length
+        book.records_at = book.slots_at +\
+                slots * struct.calcsize(cls.slot_format)
+        return book
+
+    """Returns the (move code, games, wins) records of a key in a loaded
+    book, most played first"""
+    def records(self, key):
+        slot_size = struct.calcsize(self.slot_format)
+        record_size = struct.calcsize(self.record_format)
+        i = key % self.slots
+        while True:
+            k, first, count = struct.unpack_from(self.slot_format, self.data,
+                    self.slots_at + i * slot_size)
+            if not count:
+                return []
+            if k == key:
+                return [struct.unpack_from(self.record_format, self.data,
+                    self.records_at + (first + n) * record_size)
+                    for n in xrange(count)]
+            i = (i + 1) % self.slots
+
+    """
+    Returns the most played book move of the player to move on board, or
+    None if the position is not in the (loaded) book or its move was
+    played in fewer than min_games games
+    """
+    def lookup(self, board, min_games=1):
+        if board.turn < 0 or\
+                not self.matches(board.library, board.shape, board.player_count):
+            return None
+        if sum(len(m) for m in board.moves) >= self.plies:
+            return None
+
+        key, symmetry = canonical_key(board)
+        for code, games, wins in self.records(key)[:1]:
+            if games >= min_games:
+                return transform_move(board, Move.decode(code),
+                        INVERSES[symmetry])
+        return None
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print "Usage: python -m common.book book_file game.log [game.log ...]"
+        sys.exit(1)
+
+    book = None
+    for path in sys.argv[2:]:
+        if book is None:
+            parser = GameParser(path)
+            book = OpeningBook(parser.library, parser.shape, parser.num_players)
+        try:
+            book.add_log(path)
+        except ValueError as e:
+            print "Skipping " + str(e)
+    book.save(sys.argv[1])
+    print "%s: %d games, %d positions" % (sys.argv[1], book.games,
+            len(book.positions))
@@ -0,0 +1,93 @@
+# vim: ts=4 et sw=4 sts=4
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from common.book import *
+from common.data import *
+
+class OpeningBookTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    """Plays the first legal move of each player until the game ends"""
+    def play_game(self, first_moves):
+        board = Board('tiny', shape=(6,6))
+        moves = []
+        while board.turn >= 0:
+            if len(moves) < len(first_moves):
+                move = first_moves[len(moves)]
+            else:
+                move = next(board.legal_moves(board.turn),
+                        Move.skip(board.turn))
+            board.play_move(move)
+            moves.append(move)
+        return moves
+
+    def test_canonical_key(self):
+        a = Board('tiny', shape=(6,6))
+        b = Board('tiny', shape=(6,6))
+        a.play_move(Move(0, 2, 0, False, (0,0)))
+        for s in xrange(len(SYMMETRIES)):
+            b.play_move(transform_move(a, a.moves[0][0], s))
+            self.assertEqual(canonical_key(a)[0], canonical_key(b)[0])
+            self.assertNotEqual(canonical_key(a)[0],
+                    canonical_key(Board('tiny', shape=(6,6)))[0])
+            b.unplay_move(b.moves[0][0])
+
+    def test_save_and_lookup(self):
+        opening = [Move(0, 2, 0, False, (0,0)), Move(1, 0, 0, False, (5,4))]
+        book = OpeningBook('tiny', (6,6), 4)
+        for i in xrange(3):
+            book.add_game(self.play_game(opening))
+
+        # Writing the game out as a game.log counts the same
+        path = os.path.join(self.dir, 'game.log')
+        with open(path, 'w') as o:
+            o.write('#Version=0.12\n#num_players=4,rows=6,cols=6,library=tiny\n')
+            for m in self.play_game(opening):
+                o.write("%d,%d,%d,%d,%d,%d\n" % (m.player_id, m.piece_id,
+                    m.rotation, int(m.mirror), m.position.x, m.position.y))
+        book.add_log(path)
+        self.assertEqual(book.games, 4)
+
+        book.save(os.path.join(self.dir, 'opening.book'))
+        loaded = OpeningBook.load(os.path.join(self.dir, 'opening.book'))
+        board = Board('tiny', shape=(6,6))
+        self.assertEqual(loaded.lookup(board, min_games=5), None)
+        for m in opening:
+            move = loaded.lookup(board, min_games=4)
+            self.assertTrue(board.is_valid_move(move))
+            self.assertEqual(board.move_coords(move), board.move_coords(m))
+            board.play_move(move)
+
+        # The same opening played in another corner
+        board = Board('tiny', shape=(6,6))
+        board.play_move(transform_move(board, opening[0], 5))
+        move = loaded.lookup(board)
+        self.assertEqual(set(board.move_coords(move)),
+                set(board.move_coords(transform_move(board, opening[1], 5))))
+
+        # Past the opening the book has nothing to say
+        board.play_move(move)
+        for move in self.play_game(opening)[2:loaded.plies]:
+            board.play_move(transform_move(board, move, 5))
+        self.assertEqual(loaded.lookup(board), None)
+
+    def test_library_name(self):
+        path = os.path.join(self.dir, 'opening.book')
+        for library in ('corner_contiguous', '/usr/share/blokus/pieces/tiny'):
+            OpeningBook(library, (6,6), 2).save(path)
+            loaded = OpeningBook.load(path)
+            self.assertEqual(loaded.library, library)
+            self.assertTrue(loaded.matches(library, (6,6), 2))
+        self.assertRaises(ValueError,
+                OpeningBook('x' * (1 << 16), (6,6), 2).save, path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,28 @@
 ﻿# vim: ts=4 et sw=4 sts=4
 
+import math
+import multiprocessing
+import random
+import threading
+import time
 from copy import copy
-from common.data import Move
+from common.book import OpeningBook
+from common.data import Board,Move
+from common.search import AlphaBetaSearch,EndgameSolver,SearchTimeout,\
+        TranspositionTable,evaluate_standings
 
 """Abstract AI Bot class to be overridden by players"""
 class Bot(object):
     STATUS_SKIPPED = 1      # Your turn was skipped, message explains why
     STATUS_GAME_OVER = 2    # This game has ended
 
+    # Seconds of the game clock never spent on thinking, left for the
+    # network and the server (see move_deadline)
+    clock_margin = 0.5
+
+    # Whether searching bots print their statistics after every move
+    verbose = False
+
     """Initializes the bot for a new game. Subclasses *must* be of the form
 
     def __init__(self, [args_to_consume,...], **kwds):
@@ -20,11 +35,31 @@ class Bot(object):
         self.board = board
         self.player_id = player_id
 
-    """Must return a Move object"""
-    def get_move(self):
+    """Must return a Move object. When the game has clocks, deadline is the
+    time.time() at which this player's clock runs out, otherwise None."""
+    def get_move(self, deadline=None):
         assert not hasattr(super(Bot), 'get_move')
         return Move.skip(self.player_id)
 
+    """
+    Returns the time.time() by which a search for this move should end:
+    seconds from now (None for no limit), cut to a fair share of the clock
+    when there is a deadline. The clock left, less clock_margin, is shared
+    between the pieces this player has left, so what an increment adds to
+    the clock is spent on later moves.
+    """
+    def move_deadline(self, seconds, deadline=None):
+        now = time.time()
+        end = None
+        if seconds is not None:
+            end = now + seconds
+        if deadline is not None:
+            moves = max(1, len(self.board.get_remaining_piece_ids(self.player_id)))
+            share = now + max(0.0, deadline - now - self.clock_margin) / moves
+            if end is None or share < end:
+                end = share
+        return end
+
     """Reports every move made to this bot"""
     def report_move(self, move):
         assert not hasattr(super(Bot), 'report_move')
@@ -44,46 +79,592 @@ class PlayOnReport(Bot):
         super(PlayOnReport, self).report_move(move)
 
 class CornerLogger(PlayOnReport):
+    """The cells this bot's next piece may cover to touch its own pieces
+    diagonally, as kept by the board (see Board.get_anchors)"""
+    @property
+    def corner_set(self):
+        return self.board.get_anchors(self.player_id)
+
+## GET_MOVE EXTENDERS ##
+
+class ExhaustiveSearchBot(PlayOnReport):
+    def get_move(self, deadline=None):
+        for move in self.board.legal_moves(self.player_id):
+            if self.board.is_valid_move(move):
+                return move
+
+        return super(ExhaustiveSearchBot, self).get_move(deadline)
+
+"""
+Internal - The board a ParallelRootSearch worker process last built, reused
+while the position it is asked about stays the same
+"""
+_worker_board = (None, None)
+
+"""
+Internal - Runs in a ParallelRootSearch worker: scores a share of the root
+moves, given as Move.as_tuple() tuples, returning a list of (score, tuple)
+"""
+def _search_root_share(args):
+    global _worker_board
+    bot_class, compact, keys, depth, deadline = args
+
+    if _worker_board[0] != compact:
+        _worker_board = (compact, Board.from_compact(compact))
+    board = _worker_board[1]
+
+    return bot_class.search_root_moves(board,
+            [Move.from_tuple(k) for k in keys], depth, deadline)
+
+class ParallelRootSearch(PlayOnReport):
+    """
+    Searches every legal move of this bot's with a pool of worker processes.
+    The root moves are dealt out to the workers, which each rebuild the
+    position from Board.compact() and score their share with search(), a
+    max-n search: every player picks the move best for them by evaluate().
+    The best scored move is played.
+
+    search_depth   -- Plies searched, counting the root move
+    search_time    -- Seconds to search for, or None to always finish
+                      (unless the game clock says otherwise)
+    search_workers -- Worker processes, by default one per core. With a
+                      single worker the search runs in this process.
+
+    The pool is started on the first search and stopped by close() or once
+    the game ends.
+    """
+    search_depth = 1
+    search_time = None
+    search_workers = None
+
+    # Root moves are dealt out in a few shares per worker, so workers which
+    # finish early pick up more
+    shares_per_worker = 4
+
     def __init__(self, **kwds):
-        super(CornerLoggingBot, self).__init__(**kwds)
-        self.corner_set = set()
+        super(ParallelRootSearch, self).__init__(**kwds)
+        self.pool = None
+
+    """
+    Returns a value per player for a position, higher being better for them.
+    By default their score plus the number of anchors they have.
+    """
+    @classmethod
+    def evaluate(cls, board):
+        return evaluate_standings(board)
+
+    """
+    Returns the values (see evaluate) the board reaches in depth plies when
+    every player to move picks the best move for themselves. Raises
+    SearchTimeout if the deadline passes first, leaving the board as it
+    found it.
+    """
+    @classmethod
+    def search(cls, board, depth, deadline=None):
+        if depth <= 0 or board.turn < 0:
+            return cls.evaluate(board)
+        if deadline is not None and time.time() > deadline:
+            raise SearchTimeout
+
+        player_id = board.turn
+        best = None
+        for move in list(board.legal_moves(player_id)) or [Move.skip(player_id)]:
+            board.play_move(move)
+            try:
+                value = cls.search(board, depth - 1, deadline)
+            finally:
+                board.unplay_move(move)
+            if best is None or value[player_id] > best[player_id]:
+                best = value
+            if deadline is not None and time.time() > deadline:
+                raise SearchTimeout
+        return best
+
+    """
+    Returns (score, Move.as_tuple()) for each of the given root moves
+    searched to the full depth before the deadline; a root move whose
+    search was cut off is left out. Leaves the board as it found it.
+    """
+    @classmethod
+    def search_root_moves(cls, board, moves, depth, deadline=None):
+        scored = []
+        for move in moves:
+            board.play_move(move)
+            try:
+                value = cls.search(board, depth - 1, deadline)
+            except SearchTimeout:
+                break
+            finally:
+                board.unplay_move(move)
+            scored.append((value[move.player_id], move.as_tuple()))
+            if deadline is not None and time.time() > deadline:
+                break
+        return scored
+
+    def get_pool(self):
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.search_workers)
+        return self.pool
+
+    """Stops the worker processes, if any were started"""
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
 
-    """Bots which define their own report_move should call
-    super(NewBotClass, self).report_move(move)"""
     def report_move(self, move):
-        if not move.is_skip():
-            if move.player_id == self.player_id:
-                for c in self.board.move_coords(move):
-                    for neigh in ((-1, -1), (-1, 1), (1, 1), (1, -1)):
-                        pot = c + neigh
-                        try:
-                            if self.board[pot].move is None:
-                                self.corner_set.add(pot)
-                        except (IndexError):
-                            pass
-
-            for c in self.board.move_coords(move):
-                try:
-                    self.corner_set.remove(c)
-                except KeyError:
-                    pass
-
-        super(CornerLoggingBot, self).report_move(move)
+        super(ParallelRootSearch, self).report_move(move)
+        if self.board.turn < 0:
+            self.close()
 
-## GET_MOVE EXTENDERS ##
+    def get_move(self, deadline=None):
+        moves = list(self.board.legal_moves(self.player_id))
+        moves = [m for m in moves if self.board.is_valid_move(m)]
+        if len(moves) < 2:
+            if moves:
+                return moves[0]
+            return super(ParallelRootSearch, self).get_move(deadline)
 
-class ExhaustiveSearchBot(PlayOnReport):
-    def get_move(self):
-        for piece in self.board.get_remaining_piece_ids(self.player_id):
-            for rotation in xrange(4):
-                for mirror in (False, True):
-                    for x in xrange(self.board.cols):
-                        for y in xrange(self.board.rows):
-                            move = Move(self.player_id, piece, rotation, mirror, (x,y))
-                            if self.board.is_valid_move(move):
-                                return move
-
-        return super(ExhaustiveSearchBot, self).get_move()
+        deadline = self.move_deadline(self.search_time, deadline)
+
+        if self.search_workers == 1:
+            scored = self.search_root_moves(self.board, moves,
+                    self.search_depth, deadline)
+        else:
+            pool = self.get_pool()
+            count = (self.search_workers or multiprocessing.cpu_count()) *\
+                    self.shares_per_worker
+            keys = [m.as_tuple() for m in moves]
+            compact = self.board.compact()
+            shares = [(self.__class__, compact, keys[i::count],
+                self.search_depth, deadline) for i in xrange(count)]
+            shares = [s for s in shares if s[2]]
+            scored = []
+            for result in pool.imap_unordered(_search_root_share, shares):
+                scored.extend(result)
+
+        if not scored:
+            return moves[0]
+        # Ties go to the move listed first
+        order = dict((m.as_tuple(), i) for i, m in enumerate(moves))
+        score, key = max(scored, key=lambda s: (s[0], -order[s[1]]))
+        return moves[order[key]]
+
+class BookBot(PlayOnReport):
+    """
+    Plays the most played move of an OpeningBook (see common.book) while the
+    position is in it, and otherwise leaves the move to the next get_move(),
+    so it goes before the search in a bot's bases. A book lookup is a hash
+    of the few cells played so far and a probe of the mapped book file.
+
+    book_path      -- The book file, or None to play without one
+    book_min_games -- Book moves played in fewer games are ignored
+
+    The number of moves taken from the book is kept in book_moves.
+    """
+    book_path = None
+    book_min_games = 1
+
+    def __init__(self, **kwds):
+        super(BookBot, self).__init__(**kwds)
+        self.book = None
+        self.book_moves = 0
+        if self.book_path is not None:
+            try:
+                self.book = OpeningBook.get(self.book_path)
+            except (OSError, IOError) as e:
+                print "No opening book: " + str(e)
+
+    def get_move(self, deadline=None):
+        if self.book is not None:
+            move = self.book.lookup(self.board, self.book_min_games)
+            if move is not None and move.player_id == self.player_id and\
+                    self.board.is_valid_move(move):
+                self.book_moves += 1
+                return move
+        return super(BookBot, self).get_move(deadline)
+
+class DeterministicSearch(PlayOnReport):
+    """
+    Picks moves with AlphaBetaSearch (see common.search), deepening one ply
+    at a time while there is time left. Moves are ordered by the transposition
+    table, then by how many of the other players' anchors they cover, then
+    by piece size, so the same position always gets the same move. The table
+    is kept between moves.
+
+    search_mode  -- 'paranoid' (alpha-beta against a coalition of the
+                    others) or 'maxn' (every player for themselves)
+    search_time  -- Seconds to search for each move, or None to search to
+                    search_depth. Either way the search stops at the bot's
+                    share of the game clock (see Bot.move_deadline).
+    search_depth -- The most plies to search, or None for no limit
+    search_width -- If set, only the best search_width ordered moves are
+                    searched at each node
+    table_size   -- Slots in the transposition table
+    endgame_placements -- Once the players still playing have this many
+                    legal placements or fewer between them, the game is
+                    solved to the end with EndgameSolver instead, for exact
+                    final scores. None never solves.
+
+    The depth reached and nodes searched by each move are kept in
+    search_stats as (depth, nodes, seconds) per move, the depth
+    being None for moves of a solved endgame, and printed if verbose is
+    set. Should the endgame not be solved in time the move is left to a
+    depth 1 search.
+    """
+    search_mode = AlphaBetaSearch.PARANOID
+    search_time = 1.0
+    search_depth = None
+    search_width = None
+    table_size = 1 << 16
+    endgame_placements = 12
+
+    def __init__(self, **kwds):
+        super(DeterministicSearch, self).__init__(**kwds)
+        self.searcher = AlphaBetaSearch(self.search_mode,
+                evaluate=self.evaluate,
+                table=TranspositionTable(self.table_size),
+                width=self.search_width)
+        self.solver = EndgameSolver(self.search_mode)
+        self.search_stats = []
+
+    """Returns a value per player for a position, see evaluate_standings"""
+    def evaluate(self, board):
+        return evaluate_standings(board)
+
+    def get_move(self, deadline=None):
+        if self.search_time is None and self.search_depth is None and\
+                deadline is None:
+            raise ValueError, "search_time or search_depth must be set"
+
+        start = time.time()
+        clock = deadline
+        deadline = self.move_deadline(self.search_time, clock)
+
+        limit = self.endgame_placements
+        if limit is not None and\
+                EndgameSolver.remaining_placements(self.board, limit) <= limit:
+            solved = self.solver.solve(self.board, deadline)
+            if solved is not None:
+                move, value = solved
+                elapsed = time.time() - start
+                self.search_stats.append((None, self.solver.nodes, elapsed))
+                if self.verbose:
+                    print "Endgame: solved, %d nodes in %.2fs, value %s" % (
+                            self.solver.nodes, elapsed, value)
+                if move.is_skip():
+                    return super(DeterministicSearch, self).get_move(clock)
+                return move
+
+        move, value, depth = self.searcher.search(self.board,
+                max_depth=self.search_depth, deadline=deadline)
+        elapsed = time.time() - start
+
+        self.search_stats.append((depth, self.searcher.nodes, elapsed))
+        if self.verbose:
+            print "Search: depth %d, %d nodes in %.2fs, value %s" % (
+                    depth, self.searcher.nodes, elapsed, value)
+
+        if move is None or move.is_skip():
+            return super(DeterministicSearch, self).get_move(clock)
+        return move
+
+"""A position in a MonteCarloTreeSearch tree, reached by playing move"""
+class MCTSNode(object):
+    __slots__ = ('move', 'parent', 'children', 'untried', 'visits', 'reward')
+
+    def __init__(self, move=None, parent=None):
+        self.move = move
+        self.parent = parent
+        # move_key(move) -> MCTSNode
+        self.children = {}
+        # Moves not expanded yet, None until the node is first expanded
+        self.untried = None
+        self.visits = 0
+        # Sum of the playout rewards of the player who made move
+        self.reward = 0.0
+
+    @staticmethod
+    def move_key(move):
+        return (move.player_id, move.piece_id, move.rotation, bool(move.mirror),
+                move.position.x, move.position.y)
+
+class MonteCarloTreeSearch(PlayOnReport):
+    """
+    Picks moves with UCT. Every iteration walks down the tree, expands one
+    new move and plays the game out with random moves sampled around the
+    players' anchors, then rolls the board back (see Board.checkpoint). The
+    tree follows the moves reported to the bot, so the part under the moves
+    actually played is kept between turns.
+
+    mcts_time       -- Seconds to search for each move, at most the bot's
+                       share of the game clock (see Bot.move_deadline)
+    mcts_iterations -- Optionally, the most iterations to run per move
+    mcts_seed       -- Seed of the playouts, random by default
+    uct_c           -- Exploration constant, rewards being in [0, 1]
+    playout_tries   -- Random placements tried per playout move before
+                       falling back to picking from all legal moves
+
+    The number of playouts of each move is kept in mcts_stats as (playouts,
+    seconds), and printed with the playouts per second if verbose is set.
+    """
+    mcts_time = 1.0
+    mcts_iterations = None
+    mcts_seed = None
+    uct_c = 1.0
+    playout_tries = 10
+
+    def __init__(self, **kwds):
+        super(MonteCarloTreeSearch, self).__init__(**kwds)
+        self.rng = random.Random(self.mcts_seed)
+        self.root = None
+        self.root_kept = 0.0
+        self.mcts_stats = []
+
+    """Returns the total playouts per second over every move so far"""
+    @property
+    def playouts_per_second(self):
+        playouts = sum(p for p, s in self.mcts_stats)
+        seconds = sum(s for p, s in self.mcts_stats)
+        if not seconds:
+            return 0.0
+        return playouts / seconds
+
+    """
+    Returns a random legal move for whoever's turn it is: a remaining piece
+    placed over one of their anchors, or a skip if they have none
+    """
+    def playout_move(self, board):
+        rng = self.rng
+        player_id = board.turn
+        library = board.piece_library[player_id]
+        anchors = list(board.get_anchors(player_id))
+        pieces = list(library.get_remaining_piece_ids())
+        if not anchors or not pieces:
+            return Move.skip(player_id)
+
+        for attempt in xrange(self.playout_tries):
+            anchor = rng.choice(anchors)
+            piece = library[rng.choice(pieces)]
+            rotation, mirror, key = rng.choice(piece.unique_orientations())
+            block = rng.choice(piece.get_transform_coords(rotation, mirror))
+            move = Move(player_id, piece.piece_id, rotation, mirror,
+                    (anchor.x - block.x, anchor.y - block.y))
+            if board.is_legal_placement(move):
+                return move
+
+        # Take the first legal move around the anchors in a random order,
+        # only proving there is none takes a full scan
+        rng.shuffle(anchors)
+        for anchor in anchors:
+            for move in board.legal_moves(player_id, [anchor]):
+                return move
+        return Move.skip(player_id)
+
+    """
+    Returns the reward of every player for a finished game: the winners
+    share 1, everyone else gets 0
+    """
+    def rewards(self, board):
+        scores = [s.score for s in board.standings()]
+        best = max(scores)
+        winners = scores.count(best)
+        return [1.0 / winners if s == best else 0.0 for s in scores]
+
+    def expand(self, node):
+        board = self.board
+        node.untried = list(board.legal_moves(board.turn)) or\
+                [Move.skip(board.turn)]
+        self.rng.shuffle(node.untried)
+
+    def select(self, node):
+        log_visits = math.log(node.visits)
+        c = self.uct_c
+        return max(node.children.itervalues(), key=lambda child:
+                child.reward / child.visits +
+                c * math.sqrt(log_visits / child.visits))
+
+    """Runs one select, expand, playout and update iteration"""
+    def iterate(self):
+        board = self.board
+        checkpoint = board.checkpoint()
+
+        node = self.root
+        while node.untried == [] and node.children:
+            node = self.select(node)
+            board.play_move(node.move)
+
+        if board.turn >= 0:
+            if node.untried is None:
+                self.expand(node)
+            if node.untried:
+                move = node.untried.pop()
+                board.play_move(move)
+                child = MCTSNode(move, node)
+                node.children[MCTSNode.move_key(move)] = child
+                node = child
+
+        while board.turn >= 0:
+            board.play_move(self.playout_move(board))
+        rewards = self.rewards(board)
+        board.rollback_to(checkpoint)
+
+        while node is not None:
+            node.visits += 1
+            if node.move is not None:
+                node.reward += rewards[node.move.player_id]
+            node = node.parent
+
+    """Returns the seconds get_move searches for"""
+    def think_time(self):
+        return self.mcts_time
+
+    """Runs one iteration from the current position, see PonderingBot"""
+    def ponder_step(self):
+        if self.root is None:
+            self.root = MCTSNode()
+        self.iterate()
+
+    def get_move(self, deadline=None):
+        if self.root is None:
+            self.root = MCTSNode()
+
+        start = time.time()
+        end = self.move_deadline(self.think_time(), deadline)
+        playouts = 0
+        # At least one playout, so there is a move to pick from
+        while playouts == 0 or time.time() < end:
+            if self.mcts_iterations is not None and playouts >= self.mcts_iterations:
+                break
+            self.iterate()
+            playouts += 1
+        elapsed = time.time() - start
+
+        self.mcts_stats.append((playouts, elapsed))
+        if self.verbose:
+            print "MCTS: %d playouts in %.2fs (%.0f/s), root visited %d times" % (
+                    playouts, elapsed, playouts / elapsed if elapsed else 0.0,
+                    self.root.visits)
+
+        if not self.root.children:
+            return super(MonteCarloTreeSearch, self).get_move(deadline)
+        return max(self.root.children.itervalues(),
+                key=lambda child: child.visits).move
+
+    """Returns the share of the tree the last report_move kept, by visits"""
+    def ponder_kept(self):
+        return self.root_kept
+
+    def report_move(self, move):
+        super(MonteCarloTreeSearch, self).report_move(move)
+        self.root_kept = 0.0
+        if self.root is not None:
+            visits = self.root.visits
+            self.root = self.root.children.get(MCTSNode.move_key(move))
+            if self.root is not None:
+                self.root.parent = None
+                self.root_kept = float(self.root.visits) / visits
+
+class PonderingBot(PlayOnReport):
+    """
+    Keeps searching while the other players think. A background thread
+    calls ponder_step(), which a later base class provides (e.g.
+    MonteCarloTreeSearch.ponder_step), over and over until the game ends,
+    taking a lock around each step which get_move and report_move take too,
+    so the board only changes between steps. Whatever the search keeps for
+    the move actually played (e.g. the MCTS subtree) carries over; the rest
+    is dropped by report_move as usual.
+
+    The seconds spent pondering since this bot's last move count towards
+    the next one: think_time() is cut by them, down to ponder_min_time, so
+    a bot which pondered long enough answers a TURN straight away. Only
+    the time spent on what the search keeps counts: after each reported
+    move the seconds pondered are scaled by ponder_kept(), the share of
+    the search kept, which the same base class provides (e.g.
+    MonteCarloTreeSearch.ponder_kept).
+
+    ponder          -- Whether to ponder at all
+    ponder_min_time -- Seconds still thought for on a TURN however long
+                       the bot pondered
+
+    The number of steps pondered is kept in ponder_steps.
+    """
+    ponder = True
+    ponder_min_time = 0.0
+
+    def __init__(self, **kwds):
+        super(PonderingBot, self).__init__(**kwds)
+        self.lock = threading.Lock()
+        # Set while a server event waits for the lock, so the pondering
+        # thread steps aside instead of taking it straight back
+        self.lock_wanted = False
+        self.ponder_thread = None
+        self.ponder_stop = False
+        self.pondered = 0.0
+        self.ponder_steps = 0
+
+    def start_pondering(self):
+        if self.ponder and self.ponder_thread is None:
+            self.ponder_stop = False
+            self.ponder_thread = threading.Thread(target=self.ponder_loop)
+            self.ponder_thread.daemon = True
+            self.ponder_thread.start()
+
+    """Stops the pondering thread, waiting for its current step"""
+    def stop_pondering(self):
+        self.ponder_stop = True
+        if self.ponder_thread is not None and\
+                self.ponder_thread is not threading.current_thread():
+            self.ponder_thread.join()
+        self.ponder_thread = None
+
+    def ponder_loop(self):
+        while not self.ponder_stop:
+            if self.lock_wanted:
+                time.sleep(0.001)
+                continue
+            with self.lock:
+                if self.board.turn < 0:
+                    break
+                start = time.time()
+                self.ponder_step()
+                self.pondered += time.time() - start
+                self.ponder_steps += 1
+        self.ponder_thread = None
+
+    def acquire(self):
+        self.lock_wanted = True
+        self.lock.acquire()
+        self.lock_wanted = False
+
+    def think_time(self):
+        return max(self.ponder_min_time,
+                super(PonderingBot, self).think_time() - self.pondered)
+
+    def close(self):
+        self.stop_pondering()
+        if hasattr(super(PonderingBot, self), 'close'):
+            super(PonderingBot, self).close()
+
+    def get_move(self, deadline=None):
+        self.start_pondering()
+        self.acquire()
+        try:
+            move = super(PonderingBot, self).get_move(deadline)
+            self.pondered = 0.0
+        finally:
+            self.lock.release()
+        return move
+
+    def report_move(self, move):
+        self.acquire()
+        try:
+            super(PonderingBot, self).report_move(move)
+            self.pondered *= self.ponder_kept()
+        finally:
+            self.lock.release()
+        self.start_pondering()
 
 ## REPORT_STATUS EXTENDERS ##
 
@@ -0,0 +1,197 @@
+# vim: ts=4 et sw=4 sts=4
+
+import time
+import unittest
+
+from common.bot import *
+from common.data import *
+
+class TestMCTS(MonteCarloTreeSearch, Bot):
+    mcts_time = 60.0
+    mcts_iterations = 200
+    mcts_seed = 3
+
+class TestPondering(PonderingBot, MonteCarloTreeSearch, Bot):
+    mcts_time = 0.3
+    mcts_seed = 3
+    ponder_min_time = 0.01
+
+class BotTests(unittest.TestCase):
+    def setUp(self):
+        board = new_board('tiny', shape=(6,6), player_count=2)
+        self.bot = Bot(player_id=0, board=board)
+        self.pieces = len(board.get_remaining_piece_ids(0))
+
+    def test_move_deadline_without_clock(self):
+        self.assertIsNone(self.bot.move_deadline(None))
+        now = time.time()
+        end = self.bot.move_deadline(2.0)
+        self.assertTrue(now + 2.0 <= end <= time.time() + 2.0)
+
+    def test_move_deadline_share(self):
+        # The clock, less the margin, is shared between the pieces left
+        clock = 0.5 + 10.0 * self.pieces
+        now = time.time()
+        end = self.bot.move_deadline(None, now + clock)
+        self.assertAlmostEqual(end - now, 10.0, places=2)
+        end = self.bot.move_deadline(60.0, now + clock)
+        self.assertAlmostEqual(end - now, 10.0, places=2)
+
+        # Unless the bot thinks for less anyway
+        now = time.time()
+        end = self.bot.move_deadline(1.0, now + clock)
+        self.assertAlmostEqual(end - now, 1.0, places=2)
+
+    def test_move_deadline_past(self):
+        now = time.time()
+        end = self.bot.move_deadline(1.0, now + 0.1)
+        self.assertTrue(now <= end <= time.time())
+        end = self.bot.move_deadline(1.0, now - 5.0)
+        self.assertTrue(now <= end <= time.time())
+
+class TestRootSearch(ParallelRootSearch, Bot):
+    search_depth = 2
+
+class ParallelRootSearchTests(unittest.TestCase):
+    def new_bot(self, workers):
+        board = new_board('tiny', shape=(6,6), player_count=2)
+        bot = TestRootSearch(player_id=0, board=board)
+        bot.search_workers = workers
+        return bot
+
+    def test_pool(self):
+        bot = self.new_bot(2)
+        try:
+            move = bot.get_move()
+            self.assertIsNotNone(bot.pool)
+            self.assertEqual(move.as_tuple(),
+                    self.new_bot(1).get_move().as_tuple())
+
+            # The workers are stopped once the game is over
+            bot.report_move(move)
+            bot.report_move(Move.skip(1))
+            self.assertIsNotNone(bot.pool)
+            bot.report_move(Move.skip(0))
+            self.assertEqual(bot.board.turn, -1)
+            self.assertIsNone(bot.pool)
+        finally:
+            bot.close()
+
+    def test_cut_off_moves_dropped(self):
+        board = new_board('tiny', shape=(6,6), player_count=2)
+        moves = list(board.legal_moves(0))
+        compact = board.compact()
+
+        # Past the deadline only the moves searched to full depth are kept
+        scored = TestRootSearch.search_root_moves(board, moves, 2,
+                time.time() - 1.0)
+        self.assertEqual(scored, [])
+        self.assertEqual(board.compact(), compact)
+        scored = TestRootSearch.search_root_moves(board, moves, 1,
+                time.time() - 1.0)
+        self.assertEqual([key for score, key in scored], [moves[0].as_tuple()])
+
+        scored = TestRootSearch.search_root_moves(board, moves, 2)
+        self.assertEqual(len(scored), len(moves))
+        self.assertEqual(board.compact(), compact)
+
+class MonteCarloTreeSearchTests(unittest.TestCase):
+    def new_bot(self, cls, player_id=0):
+        board = new_board('tiny', shape=(6,6), player_count=2)
+        return cls(player_id=player_id, board=board)
+
+    def test_get_move(self):
+        bot = self.new_bot(TestMCTS)
+        move = bot.get_move()
+        self.assertEqual(move.player_id, 0)
+        self.assertTrue(bot.board.is_valid_move(move))
+        self.assertEqual(bot.mcts_stats[0][0], 200)
+
+        # The same seed picks the same move
+        again = self.new_bot(TestMCTS).get_move()
+        self.assertEqual(MCTSNode.move_key(again), MCTSNode.move_key(move))
+
+    def test_subtree_kept(self):
+        bot = self.new_bot(TestMCTS)
+        move = bot.get_move()
+        child = bot.root.children[MCTSNode.move_key(move)]
+        bot.report_move(move)
+        self.assertIs(bot.root, child)
+        self.assertIsNone(child.parent)
+
+        key, grandchild = sorted(child.children.items())[0]
+        bot.report_move(Move.from_tuple(key))
+        self.assertIs(bot.root, grandchild)
+        visits = grandchild.visits
+        self.assertTrue(visits > 0)
+
+        move = bot.get_move()
+        self.assertTrue(bot.board.is_valid_move(move))
+        self.assertEqual(bot.root.visits, visits + 200)
+
+class PonderingBotTests(unittest.TestCase):
+    def setUp(self):
+        board = new_board('tiny', shape=(6,6), player_count=2)
+        self.bot = TestPondering(player_id=1, board=board)
+
+    def tearDown(self):
+        self.bot.close()
+
+    def wait_for(self, condition):
+        end = time.time() + 10.0
+        while not condition():
+            self.assertTrue(time.time() < end)
+            time.sleep(0.01)
+
+    def test_report_while_pondering(self):
+        bot = self.bot
+        bot.start_pondering()
+        self.wait_for(lambda: bot.ponder_steps >= 20)
+
+        with bot.lock:
+            key, child = max(bot.root.children.items(),
+                    key=lambda item: item[1].visits)
+        bot.report_move(Move.from_tuple(key))
+        self.assertIs(bot.root, child)
+        self.assertEqual(bot.board.turn, 1)
+        self.assertTrue(0.0 < bot.root_kept < 1.0)
+
+        # Pondering past mcts_time leaves only ponder_min_time to think
+        self.wait_for(lambda: bot.pondered >= bot.mcts_time)
+        self.assertEqual(bot.think_time(), bot.ponder_min_time)
+        move = bot.get_move()
+        with bot.lock:
+            self.assertTrue(bot.board.is_valid_move(move))
+        self.assertTrue(bot.mcts_stats[-1][1] < bot.mcts_time / 2)
+
+    def test_report_outside_tree(self):
+        # A few steps as ponder_loop takes them, expanding few moves
+        bot = self.bot
+        bot.ponder = False
+        for i in xrange(3):
+            bot.ponder_step()
+        bot.pondered = bot.mcts_time
+
+        expanded = bot.root.children
+        move = [m for m in bot.board.legal_moves(0)
+                if MCTSNode.move_key(m) not in expanded][0]
+        bot.report_move(move)
+        self.assertIsNone(bot.root)
+
+        # Time spent on the tree thrown away does not cut the next move
+        self.assertEqual(bot.pondered, 0.0)
+        self.assertEqual(bot.think_time(), bot.mcts_time)
+
+    def test_restart(self):
+        bot = self.bot
+        bot.start_pondering()
+        self.wait_for(lambda: bot.ponder_steps > 0)
+        bot.stop_pondering()
+        self.assertIsNone(bot.ponder_thread)
+
+        steps = bot.ponder_steps
+        bot.start_pondering()
+        self.wait_for(lambda: bot.ponder_steps > steps)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,7 @@ import socket
 import errno
 import json
 import struct
+import time
 
 from common.data import Board,Move,PieceLibrary,Point
 
@@ -83,15 +84,36 @@ class Message():
     def __repr__(self):
         return self.printer(True)
 
+    """Internal - Reads exactly size bytes, raising socket.timeout if the
+    deadline (a time.time() value, None to wait forever) passes first"""
+    @staticmethod
+    def _recv(sock, size, deadline):
+        data = ''
+        while len(data) < size:
+            if deadline is not None:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    raise socket.timeout, "Message took too long"
+                sock.settimeout(timeout)
+            try:
+                chunk = sock.recv(size - len(data), socket.MSG_WAITALL)
+            finally:
+                if deadline is not None:
+                    sock.settimeout(None)
+            if len(chunk) == 0:
+                raise IOError, "Socket Closed"
+            data += chunk
+        return data
+
     """Takes a socket and blocks until it has read exactly enough
-    bytes to parse out one message"""
-    def __init__(self, sock, message_type=None, object_constructor=None):
-        i = sock.recv(4, socket.MSG_WAITALL)
-        if len(i) == 0:
-            raise IOError, "Socket Closed"
+    bytes to parse out one message, or until the deadline (a time.time()
+    value) passes, raising socket.timeout"""
+    def __init__(self, sock, message_type=None, object_constructor=None,
+            deadline=None):
+        i = self._recv(sock, 4, deadline)
         i = struct.unpack(">I", i)[0]
 
-        msg = sock.recv(i, socket.MSG_WAITALL)
+        msg = self._recv(sock, i, deadline)
         self.message_type, self.message_object = json.loads(msg)
 
         if message_type and message_type != self.message_type:
@@ -0,0 +1,49 @@
+# vim: ts=4 et sw=4 sts=4
+
+import socket
+import struct
+import time
+import unittest
+
+from common.communication import Message
+from common.data import Move
+
+class MessageTests(unittest.TestCase):
+    def setUp(self):
+        self.ours, self.theirs = socket.socketpair()
+
+    def tearDown(self):
+        self.ours.close()
+        self.theirs.close()
+
+    def test_message(self):
+        Message.serialized(self.theirs, Message.TYPE_MOVE,
+                Move(1, 5, 3, True, (3, 4)))
+        m = Message(self.ours, Message.TYPE_MOVE, deadline=time.time() + 5.0)
+        move = m.message_object
+        self.assertEqual((move.player_id, move.piece_id, move.rotation,
+                move.mirror, move.position.x, move.position.y),
+                (1, 5, 3, True, 3, 4))
+        self.assertIsNone(self.ours.gettimeout())
+
+    def test_partial_frame(self):
+        self.theirs.send(struct.pack(">I", 100) + '[4, ')
+        start = time.time()
+        self.assertRaises(socket.timeout, Message, self.ours,
+                deadline=start + 0.1)
+        self.assertTrue(time.time() - start < 1.0)
+        self.assertIsNone(self.ours.gettimeout())
+
+    def test_expired_deadline(self):
+        Message.serialized(self.theirs, Message.TYPE_CONTROL, "TURN")
+        self.assertRaises(socket.timeout, Message, self.ours,
+                deadline=time.time() - 1.0)
+
+    def test_closed(self):
+        self.theirs.send(struct.pack(">I", 100))
+        self.theirs.close()
+        self.assertRaises(IOError, Message, self.ours,
+                deadline=time.time() + 5.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+# vim: ts=4 et sw=4 sts=4
+
+"""Compiles piece libraries into the binary format loaded by PieceCatalog.
+
+Usage: python -m common.compile_pieces [library ...]
+
+With no arguments every library in common/resources/pieces is compiled. The
+compiled files are written next to their source and picked up automatically
+as long as they are newer than it."""
+
+import os
+import sys
+
+from common.data import PieceCatalog
+
+PIECES_DIR = os.path.join(os.path.dirname(__file__), 'resources', 'pieces')
+
+def libraries():
+    for name in sorted(os.listdir(PIECES_DIR)):
+        path = os.path.join(PIECES_DIR, name)
+        if os.path.isfile(path) and '.' not in name:
+            yield path
+
+if __name__ == '__main__':
+    for library in sys.argv[1:] or libraries():
+        catalog = PieceCatalog(library, use_compiled=False)
+        print "%s: %d pieces -> %s" % (
+                library, len(catalog.piece_ids), catalog.compile())
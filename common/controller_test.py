@@ -0,0 +1,52 @@
+# vim: ts=4 et sw=4 sts=4
+
+import os
+import socket
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'server'))
+
+from controller import BasicGame
+from common.communication import Message
+from common.data import Move
+
+class ClockTests(unittest.TestCase):
+    def setUp(self):
+        # Only the clocks of a game, without its server
+        self.game = object.__new__(BasicGame)
+        self.game.time_control = (10.0, 2.0)
+        self.game.clocks = [10.0, 10.0]
+        self.server, self.player = socket.socketpair()
+
+    def tearDown(self):
+        self.server.close()
+        self.player.close()
+
+    def test_move_in_time(self):
+        Message.serialized(self.player, Message.TYPE_MOVE,
+                Move(1, 3, 0, False, (0, 0)))
+        move = self.game.request_move(self.server, 1)
+        self.assertEqual((move.player_id, move.piece_id), (1, 3))
+        self.assertEqual(Message(self.player).message_object, ["TURN", 10.0])
+
+        # The time taken comes off the clock, then the increment is added
+        self.assertTrue(11.0 < self.game.clocks[1] <= 12.0)
+        self.assertEqual(self.game.clocks[0], 10.0)
+
+    def test_timeout(self):
+        self.game.clocks[1] = 0.1
+        self.assertRaises(socket.timeout, self.game.request_move,
+                self.server, 1)
+        self.assertEqual(Message(self.player).message_object, ["TURN", 0.1])
+        self.assertEqual(self.game.clocks[1], 0.0)
+
+    def test_no_clocks(self):
+        self.game.clocks = None
+        Message.serialized(self.player, Message.TYPE_MOVE, Move.skip(1))
+        self.assertTrue(self.game.request_move(self.server, 1).is_skip())
+        self.assertEqual(Message(self.player).message_object, "TURN")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,16 +1,29 @@
 # vim: ts=4 et sw=4 sts=4
 
 import os
+import collections
+import copy
+import hashlib
+import itertools
 import math
+import random
+import mmap
 import string
 import unittest
 import struct
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 EMPTY_PIECE_ID = 0xFFFF
 EMPTY_PLAYER_ID = 0xFF
 
 DEFAULT_BOARD_SHAPE = (20,20)
 DEFAULT_PLAYER_COUNT = 4
+# Boards with at least this many cells are built as SparseBoards by new_board
+SPARSE_BOARD_CELLS = 100 * 100
 
 class Move(object):
     SKIP=-1
@@ -18,7 +31,22 @@ class Move(object):
     ILLEGAL=-3
     TIMEOUT=-4
 
-    move_id = 0
+    __slots__ = ('player_id', 'piece_id', 'rotation', 'mirror', 'position', 'move_id')
+
+    # next() on a count is atomic, unlike incrementing a class attribute
+    _move_ids = itertools.count()
+
+    """
+    Bit layout of encode(), lowest bits first: y (16), x (16), mirror (1),
+    rotation (2), piece (16), player (8). Skips and other negative piece ids
+    are stored in the top values of the piece field.
+    """
+    CODE_FIELDS = (('y', 16), ('x', 16), ('mirror', 1), ('rotation', 2),
+            ('piece_id', 16), ('player_id', 8))
+    MAX_PIECE_ID = (1 << 16) + TIMEOUT - 1
+
+    """Network order (big-endian), encoded move (unsigned long long)"""
+    move_format = "!Q"
 
     def __init__(self,
             player_id,
@@ -33,8 +61,69 @@ class Move(object):
         self.mirror = mirror
         self.position = Point(position)
 
-        self.move_id = Move.move_id
-        Move.move_id += 1
+        self.move_id = next(Move._move_ids)
+
+    def __reduce__(self):
+        return (Move, (self.player_id, self.piece_id, self.rotation,
+            self.mirror, (self.position.x, self.position.y)))
+
+    """
+    Returns this move as a 64-bit integer (see CODE_FIELDS). Raises
+    ValueError for moves which do not fit, e.g. off the board's top or left.
+    """
+    def encode(self):
+        if self.piece_id > Move.MAX_PIECE_ID or self.piece_id < Move.TIMEOUT:
+            raise ValueError, "Piece id %d can not be encoded" % (self.piece_id)
+        values = {
+                'y' : self.position.y,
+                'x' : self.position.x,
+                'mirror' : int(bool(self.mirror)),
+                'rotation' : self.rotation % 4,
+                'piece_id' : self.piece_id % (1 << 16),
+                'player_id' : self.player_id,
+                }
+        code = 0
+        shift = 0
+        for name, bits in Move.CODE_FIELDS:
+            v = values[name]
+            if not 0 <= v < (1 << bits):
+                raise ValueError, "%s %d of %s can not be encoded" % (
+                        name, v, str(self))
+            code |= v << shift
+            shift += bits
+        return code
+
+    @staticmethod
+    def decode(code):
+        values = {}
+        for name, bits in Move.CODE_FIELDS:
+            values[name] = code & ((1 << bits) - 1)
+            code >>= bits
+        piece_id = values['piece_id']
+        if piece_id > Move.MAX_PIECE_ID:
+            piece_id -= 1 << 16
+        return Move(values['player_id'], piece_id, values['rotation'],
+                bool(values['mirror']), (values['x'], values['y']))
+
+    def pack(self):
+        return struct.pack(Move.move_format, self.encode())
+
+    @staticmethod
+    def unpack(s):
+        return Move.decode(struct.unpack(Move.move_format, s)[0])
+
+    """
+    Returns this move as a tuple (player, piece, rotation, mirror, x, y),
+    which unlike encode() holds any move, even one off the board
+    """
+    def as_tuple(self):
+        return (self.player_id, self.piece_id, self.rotation,
+                bool(self.mirror), self.position.x, self.position.y)
+
+    @staticmethod
+    def from_tuple(t):
+        player_id, piece_id, rotation, mirror, x, y = t
+        return Move(player_id, piece_id, rotation, mirror, (x, y))
 
     @staticmethod
     def skip(player_id):
@@ -80,6 +169,8 @@ class Move(object):
         return "Move #" + str(self.move_id) + ": " + str(self)
 
 class Point(object):
+    __slots__ = ('x', 'y')
+
     def __init__(self, coords, coords_as_two_args=None):
         if coords_as_two_args is not None:
             self.x = coords
@@ -91,11 +182,14 @@ class Point(object):
     def __repr__(self):
         return "(%d, %d)" % (self.x, self.y)
 
+    def __reduce__(self):
+        return (Point, (self.x, self.y))
+
     def __neg__(self):
-        return Point((-self.x, -self.y))
+        return Point(-self.x, -self.y)
 
     def __add__(self, other):
-        return Point((self.x + other[0], self.y + other[1]))
+        return Point(self.x + other[0], self.y + other[1])
 
     def __sub__(self, other):
         return self + -other
@@ -232,6 +326,8 @@ class Piece(object):
         self.rot = {}
         self.edges = {}
         self.corners = {}
+        self.bounds = {}
+        self.orientations = None
 
     def _gen_repr_keys(self):
         return "piece_id=%d, from_coords=%s," % (self.piece_id, str(self.coords))
@@ -325,6 +421,58 @@ class Piece(object):
             self.rot[(rotation,mirror)] = rcoords
             return rcoords
 
+    """Returns (min_x, min_y, max_x, max_y) of this piece, optionally transformed"""
+    def get_bounds(self, rotation=0, mirror=False):
+        rotation %= 4
+
+        try:
+            return self.bounds[(rotation,mirror)]
+        except KeyError:
+            coords = self.get_transform_coords(rotation=rotation, mirror=mirror)
+            bounds = (min(c.x for c in coords), min(c.y for c in coords),
+                    max(c.x for c in coords), max(c.y for c in coords))
+            self.bounds[(rotation,mirror)] = bounds
+            return bounds
+
+    """
+    Returns a key identifying the shape of this piece when transformed, equal
+    for any two transforms which cover the same cells up to translation
+    """
+    def shape_key(self, rotation=0, mirror=False):
+        coords = self.get_transform_coords(rotation=rotation, mirror=mirror)
+        min_x, min_y, max_x, max_y = self.get_bounds(rotation, mirror)
+        return tuple(sorted((c.x - min_x, c.y - min_y) for c in coords))
+
+    """
+    Returns the distinct orientations of this piece as a list of
+    (rotation, mirror, shape_key) tuples. Symmetric pieces have fewer than 8,
+    e.g. the monomino has only one, and searching only these covers every
+    placement of the piece exactly once.
+    """
+    def unique_orientations(self):
+        if self.orientations is None:
+            orientations = []
+            index = {}
+            seen = {}
+            for rotation in xrange(4):
+                for mirror in (False, True):
+                    key = self.shape_key(rotation, mirror)
+                    if key not in seen:
+                        seen[key] = len(orientations)
+                        orientations.append((rotation, mirror, key))
+                    index[(rotation, mirror)] = seen[key]
+            self._orientation_index = index
+            self.orientations = orientations
+        return self.orientations
+
+    """
+    Returns the position in unique_orientations() of the orientation which
+    covers the same shape as the given transform
+    """
+    def orientation_index(self, rotation=0, mirror=False):
+        self.unique_orientations()
+        return self._orientation_index[(rotation % 4, bool(mirror))]
+
     """Returns the edges of this piece, optionally transformed"""
     def get_edges(self, rotation=0, mirror=False):
         rotation %= 4
@@ -334,10 +482,12 @@ class Piece(object):
         except KeyError:
             edges = set()
 
-            for pt in self.get_transform_coords(rotation=rotation,mirror=mirror):
+            coords = self.get_transform_coords(rotation=rotation,mirror=mirror)
+            blocks = set(coords)
+            for pt in coords:
                 for e in Piece.EDGE_COORDS:
                     t = pt + e
-                    if t not in self.coords:
+                    if t not in blocks:
                         edges.add(t)
 
             self.edges[(rotation,mirror)] = list(edges)
@@ -352,72 +502,429 @@ class Piece(object):
         except KeyError:
             corners = set()
 
-            for pt in self.get_transform_coords(rotation=rotation,mirror=mirror):
+            coords = self.get_transform_coords(rotation=rotation,mirror=mirror)
+            blocks = set(coords)
+            edges = set(self.get_edges(rotation=rotation,mirror=mirror))
+            for pt in coords:
                 for c in Piece.CORNER_COORDS:
                     t = pt + c
-                    if t not in self.coords and t not in self.get_edges(rotation=rotation,mirror=mirror):
+                    if t not in blocks and t not in edges:
                         corners.add(t)
 
             self.corners[(rotation,mirror)] = list(corners)
             return self.corners[(rotation,mirror)]
 
-class PieceLibrary(object):
-    PieceClass = Piece
-    PieceClassKwds = {}
+"""
+A Piece stored in a compiled library (see PieceCatalog.compile). Every
+orientation's blocks, edges, corners and bounds are read from the (usually
+memory-mapped) compiled data the first time they are asked for.
+"""
+class CompiledPiece(Piece):
+    """Network order: block count, then per orientation:"""
+    header_format = "!B"
+    """min_x, min_y, max_x, max_y, edge count, corner count"""
+    orientation_format = "!bbbbBB"
 
-    def __init__(self, library, restrict_piece_ids_to=None):
-        self.library = library
-        self.pieces = {}
+    """Decoded from the first orientation when first used"""
+    _lazy_attrs = ('coords', 'min_x', 'min_y', 'max_x', 'max_y', 'shape')
 
-        l = None
-        for f in (
-                library,\
-                os.path.join('resources',library),\
-                os.path.join('resources','pieces',library),\
-                os.path.join('common','resources','pieces',library),\
-                ):
-            try:
-                l = open(f, 'r')
-                break
-            except IOError:
-                pass
-        if l is None:
-            raise IOError, "Failed to find piece library"
+    def __init__(self, piece_id, data, offset):
+        if piece_id < 0:
+            raise TypeError, "Piece IDs must be >= 0"
+        self.piece_id = piece_id
+        self._data = data
+        self._offset = offset
+        self._sections = None
 
-        while True:
-            meta = l.readline()
-            if meta == '':
-                break
+        self.rot = {}
+        self.edges = {}
+        self.corners = {}
+        self.bounds = {}
+        self.orientations = None
+
+    def __getattr__(self, name):
+        if name not in self._lazy_attrs:
+            raise AttributeError, name
+        coords = self.get_transform_coords(0, False)
+        self.min_x, self.min_y, self.max_x, self.max_y = self.get_bounds(0, False)
+        self.shape = (self.max_x - self.min_x + 1, self.max_y - self.min_y + 1)
+        self.coords = list(coords)
+        return getattr(self, name)
+
+    def _find_sections(self):
+        data = self._data
+        blocks = struct.unpack_from(self.header_format, data, self._offset)[0]
+        at = self._offset + struct.calcsize(self.header_format)
+        size = struct.calcsize(self.orientation_format)
+        self._sections = []
+        for o in xrange(8):
+            self._sections.append(at)
+            header = struct.unpack_from(self.orientation_format, data, at)
+            at += size + 2 * (blocks + header[4] + header[5])
+        self._blocks = blocks
+
+    def _read(self, rotation, mirror):
+        if self._sections is None:
+            self._find_sections()
+        at = self._sections[rotation * 2 + int(bool(mirror))]
+        min_x, min_y, max_x, max_y, edges, corners = struct.unpack_from(
+                self.orientation_format, self._data, at)
+        at += struct.calcsize(self.orientation_format)
+        values = struct.unpack_from("!%db" % (2 * (self._blocks + edges + corners)),
+                self._data, at)
+        points = [Point(values[i], values[i+1]) for i in xrange(0, len(values), 2)]
+        return (points[:self._blocks], points[self._blocks:self._blocks+edges],
+                points[self._blocks+edges:], (min_x, min_y, max_x, max_y))
+
+    def _load(self, rotation, mirror):
+        key = (rotation % 4, mirror)
+        (self.rot[key], self.edges[key], self.corners[key],
+                self.bounds[key]) = self._read(rotation % 4, mirror)
+
+    def get_transform_coords(self, rotation=0, mirror=False):
+        if (rotation % 4, mirror) not in self.rot:
+            self._load(rotation, mirror)
+        return self.rot[(rotation % 4, mirror)]
+
+    def get_edges(self, rotation=0, mirror=False):
+        if (rotation % 4, mirror) not in self.edges:
+            self._load(rotation, mirror)
+        return self.edges[(rotation % 4, mirror)]
+
+    def get_corners(self, rotation=0, mirror=False):
+        if (rotation % 4, mirror) not in self.corners:
+            self._load(rotation, mirror)
+        return self.corners[(rotation % 4, mirror)]
+
+    def get_bounds(self, rotation=0, mirror=False):
+        if (rotation % 4, mirror) not in self.bounds:
+            self._load(rotation, mirror)
+        return self.bounds[(rotation % 4, mirror)]
+
+"""
+Where each piece of a text library file is: piece id -> (offset, size) of the
+lines describing it. Indexes are cached next to their library in a sidecar
+file so opening a library only has to read the pieces that are used.
+"""
+class PieceIndex(object):
+    suffix = ".idx"
+    """Network order: magic, version, entry count"""
+    header_format = "!4sHI"
+    """Network order: piece id, offset and size of the piece's lines"""
+    entry_format = "!III"
+    magic = "BKPI"
+    version = 1
+
+    def __init__(self, entries):
+        self.entries = entries
+
+    """
+    Returns the index of the library file at path, loading its sidecar when
+    it is up to date and otherwise rebuilding (and trying to save) it. A
+    sidecar which cannot be read counts as out of date.
+    """
+    @classmethod
+    def get(cls, path, data):
+        sidecar = path + cls.suffix
+        try:
+            if os.path.getmtime(sidecar) >= os.path.getmtime(path):
+                return cls.load(sidecar)
+        except (OSError, IOError, ValueError, struct.error):
+            pass
+
+        index = cls.scan(data)
+        try:
+            index.save(sidecar)
+        except (OSError, IOError):
+            # Read-only installs just rebuild the index every time
+            pass
+        return index
+
+    """Builds an index by reading the meta line of every piece in data"""
+    @classmethod
+    def scan(cls, data):
+        entries = {}
+        at = 0
+        end = len(data)
+        while at < end:
+            eol = data.find('\n', at)
+            if eol == -1:
+                eol = end
+            meta = data[at:eol]
+            at = eol + 1
 
             pc_id = None
             size = None
             for field in meta.split(','):
-                name,val = field.split('=')
+                try:
+                    name,val = field.split('=')
+                except ValueError:
+                    continue
                 if name == 'id':
                     pc_id = int(val)
                 elif name == 'size':
                     size = int(val)
-                else:
-                    # Ignore unknown fields
-                    # logger.debug(...)?
-                    pass
             if (pc_id is None) or (size is None):
                 continue
 
-            pc = ""
+            start = at
             for x in xrange(size):
-                pc += l.readline()
+                eol = data.find('\n', at)
+                at = end if eol == -1 else eol + 1
+            entries[pc_id] = (start, at - start)
+        return cls(entries)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            raw = f.read()
+
+        magic, version, count = struct.unpack_from(cls.header_format, raw, 0)
+        if magic != cls.magic or version != cls.version:
+            raise IOError, "Not a piece index: " + path
+
+        entries = {}
+        at = struct.calcsize(cls.header_format)
+        size = struct.calcsize(cls.entry_format)
+        for n in xrange(count):
+            pc_id, offset, length = struct.unpack_from(cls.entry_format, raw,
+                    at + n * size)
+            entries[pc_id] = (offset, length)
+        return cls(entries)
+
+    """Writes the index to path, replacing any file there only once the
+    index is complete, so other processes never read half of it"""
+    def save(self, path):
+        temp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(temp_path, 'wb') as o:
+            o.write(struct.pack(self.header_format, self.magic, self.version,
+                len(self.entries)))
+            for pc_id in sorted(self.entries):
+                offset, length = self.entries[pc_id]
+                o.write(struct.pack(self.entry_format, pc_id, offset, length))
+        os.rename(temp_path, path)
+
+"""
+The pieces of a library file, parsed once per process and shared by every
+PieceLibrary using the same library, piece restriction and piece class.
+Catalogs must be treated as immutable.
+"""
+class PieceCatalog(object):
+    _catalogs = {}
+
+    """
+    Returns the shared catalog, parsing the library the first time. Pieces
+    built with extra constructor arguments (e.g. GUI pieces) are private to
+    their library, so those catalogs are not shared.
+    """
+    @classmethod
+    def get(cls, library, restrict_piece_ids_to=None, PieceClass=Piece,
+            PieceClassKwds=None):
+        if PieceClassKwds:
+            return cls(library, restrict_piece_ids_to, PieceClass, PieceClassKwds)
+
+        if restrict_piece_ids_to:
+            restrict_piece_ids_to = frozenset(restrict_piece_ids_to)
+        else:
+            restrict_piece_ids_to = None
+        key = (library, restrict_piece_ids_to, PieceClass)
+        try:
+            return cls._catalogs[key]
+        except KeyError:
+            catalog = cls(library, restrict_piece_ids_to, PieceClass)
+            cls._catalogs[key] = catalog
+            return catalog
+
+    """Suffix of compiled libraries, which live next to their source"""
+    compiled_suffix = ".compiled"
+    """Network order: magic, version, piece count"""
+    header_format = "!4sHI"
+    """Network order: piece id, offset of the piece's record"""
+    index_format = "!II"
+    magic = "BKPC"
+    version = 1
 
+    @staticmethod
+    def find_library(library):
+        for f in (
+                library,\
+                os.path.join('resources',library),\
+                os.path.join('resources','pieces',library),\
+                os.path.join('common','resources','pieces',library),\
+                ):
+            if os.path.isfile(f):
+                return f
+        raise IOError, "Failed to find piece library"
+
+    """Returns the compiled version of a library file if it is up to date"""
+    @classmethod
+    def find_compiled(cls, path):
+        compiled = path + cls.compiled_suffix
+        try:
+            if os.path.getmtime(compiled) >= os.path.getmtime(path):
+                return compiled
+        except OSError:
+            pass
+        return None
+
+    def __init__(self, library, restrict_piece_ids_to=None, PieceClass=Piece,
+            PieceClassKwds=None, use_compiled=True):
+        self.library = library
+        self.pieces = {}
+
+        path = self.find_library(library)
+        compiled = use_compiled and self.find_compiled(path)
+        if compiled and PieceClass is Piece and not PieceClassKwds:
+            self.load_compiled(compiled, restrict_piece_ids_to)
+        else:
+            self.parse(path, restrict_piece_ids_to, PieceClass, PieceClassKwds)
+
+        # Bit of each piece in a PieceLibrary's used_mask, and its inverse
+        self.ordered_ids = sorted(self.piece_ids)
+        self.index = dict((pc_id, i) for i, pc_id in enumerate(self.ordered_ids))
+        self._sizes = None
+
+    """Returns the number of squares of each piece, in ordered_ids order"""
+    def get_sizes(self):
+        if self._sizes is None:
+            self._sizes = tuple(len(self[pc_id]) for pc_id in self.ordered_ids)
+            self.total_squares = sum(self._sizes)
+        return self._sizes
+
+    """Returns the number of squares of all pieces together"""
+    def get_total_squares(self):
+        self.get_sizes()
+        return self.total_squares
+
+    """
+    Opens a text library through its PieceIndex. Pieces in
+    restrict_piece_ids_to are read straight away; without a restriction
+    every piece is parsed the first time it is looked up.
+    """
+    def parse(self, path, restrict_piece_ids_to, PieceClass, PieceClassKwds):
+        if PieceClassKwds is None:
+            PieceClassKwds = {}
+        self._PieceClass = PieceClass
+        self._PieceClassKwds = PieceClassKwds
+
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size:
+                self._source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._source = ""
+        self._index = PieceIndex.get(path, self._source)
+
+        if restrict_piece_ids_to:
+            self.piece_ids = frozenset(pc_id for pc_id in restrict_piece_ids_to
+                    if pc_id in self._index.entries)
+            for pc_id in self.piece_ids:
+                self.pieces[pc_id] = self.parse_piece(pc_id)
+        else:
+            self.piece_ids = frozenset(self._index.entries)
+
+    def parse_piece(self, pc_id):
+        offset, size = self._index.entries[pc_id]
+        return self._PieceClass(piece_id=pc_id,
+                from_str=self._source[offset:offset + size],
+                **self._PieceClassKwds)
+
+    def __getitem__(self, pc_id):
+        try:
+            return self.pieces[pc_id]
+        except KeyError:
+            if pc_id not in self.piece_ids:
+                raise
+            piece = self.parse_piece(pc_id)
+            self.pieces[pc_id] = piece
+            return piece
+
+    """
+    Memory-maps a compiled library, so processes loading the same file share
+    its pages, and builds CompiledPieces over it
+    """
+    def load_compiled(self, path, restrict_piece_ids_to):
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count = struct.unpack_from(self.header_format, data, 0)
+        if magic != self.magic or version != self.version:
+            raise IOError, "Not a compiled piece library: " + path
+
+        at = struct.calcsize(self.header_format)
+        size = struct.calcsize(self.index_format)
+        for n in xrange(count):
+            pc_id, offset = struct.unpack_from(self.index_format, data, at + n * size)
             if restrict_piece_ids_to and pc_id not in restrict_piece_ids_to:
                 continue
+            self.pieces[pc_id] = CompiledPiece(pc_id, data, offset)
+        self.piece_ids = frozenset(self.pieces)
+
+    """
+    Writes this catalog's pieces to path (by default next to the library
+    file) in the compiled format: a header, an index of (piece id, offset)
+    sorted by id, then per piece its block count followed by, for each of the
+    8 (rotation, mirror) orientations, its bounds, edge and corner counts and
+    then its blocks (root first), edges and corners as signed byte pairs.
+    """
+    def compile(self, path=None):
+        if path is None:
+            path = self.find_library(self.library) + self.compiled_suffix
+
+        point_key = lambda p: (p.x, p.y)
+        records = []
+        for pc_id in self.ordered_ids:
+            piece = self[pc_id]
+            record = struct.pack(CompiledPiece.header_format, len(piece))
+            for rotation in xrange(4):
+                for mirror in (False, True):
+                    coords = piece.get_transform_coords(rotation, mirror)
+                    edges = piece.get_edges(rotation, mirror)
+                    corners = piece.get_corners(rotation, mirror)
+                    record += struct.pack(CompiledPiece.orientation_format,
+                            *(piece.get_bounds(rotation, mirror) +
+                                (len(edges), len(corners))))
+                    values = []
+                    for p in coords + sorted(edges, key=point_key) +\
+                            sorted(corners, key=point_key):
+                        values.extend((p.x, p.y))
+                    record += struct.pack("!%db" % (len(values)), *values)
+            records.append((pc_id, record))
+
+        offset = struct.calcsize(self.header_format) +\
+                len(records) * struct.calcsize(self.index_format)
+        with open(path, 'wb') as o:
+            o.write(struct.pack(self.header_format, self.magic, self.version,
+                len(records)))
+            for pc_id, record in records:
+                o.write(struct.pack(self.index_format, pc_id, offset))
+                offset += len(record)
+            for pc_id, record in records:
+                o.write(record)
+        return path
+
+"""
+One player's view of a PieceCatalog: the shared pieces plus the set of
+pieces this player has used, kept as a bitmask (see PieceCatalog.index).
+"""
+class PieceLibrary(object):
+    PieceClass = Piece
+    PieceClassKwds = {}
 
-            self.pieces[pc_id] = self.PieceClass(piece_id=pc_id, from_str=pc, **self.PieceClassKwds)
+    def __init__(self, library, restrict_piece_ids_to=None):
+        self.library = library
+        self.catalog = PieceCatalog.get(library, restrict_piece_ids_to,
+                self.PieceClass, self.PieceClassKwds)
+        self.pieces = self.catalog.pieces
+        self.piece_ids = self.catalog.piece_ids
+        self.index = self.catalog.index
+        self.used_mask = 0
 
-        self.piece_ids = set(self.pieces.keys())
-        self.used_piece_ids = set()
+    """Returns a library sharing this one's pieces but not its used pieces"""
+    def copy(self):
+        return copy.copy(self)
 
     def __getitem__(self, pc_id):
-        return self.pieces[pc_id]
+        return self.catalog[pc_id]
 
     def __iter__(self):
         self._next = -1
@@ -432,17 +939,38 @@ class PieceLibrary(object):
 
     def play_move(self, move):
         if not move.is_skip():
-            self.used_piece_ids.add(move.piece_id)
+            self.used_mask |= 1 << self.index[move.piece_id]
 
     def unplay_move(self, move):
         if not move.is_skip():
-            self.used_piece_ids.remove(move.piece_id)
+            bit = 1 << self.index[move.piece_id]
+            if not self.used_mask & bit:
+                raise KeyError, move.piece_id
+            self.used_mask ^= bit
+
+    def is_remaining(self, pc_id):
+        try:
+            return not (self.used_mask >> self.index[pc_id]) & 1
+        except KeyError:
+            return False
+
+    @property
+    def used_piece_ids(self):
+        return self.get_used_piece_ids()
 
     def get_used_piece_ids(self):
-        return self.used_piece_ids
+        used = set()
+        mask = self.used_mask
+        while mask:
+            low = mask & -mask
+            used.add(self.catalog.ordered_ids[low.bit_length() - 1])
+            mask ^= low
+        return used
 
     def get_remaining_piece_ids(self):
-        return self.piece_ids - self.used_piece_ids
+        if not self.used_mask:
+            return set(self.piece_ids)
+        return self.piece_ids - self.get_used_piece_ids()
 
 
 class Block(object):
@@ -460,6 +988,81 @@ class Block(object):
         return struct.pack(Block.block_format, self.piece_id, self.player_id)
 
 
+"""
+Random 64-bit keys for one player's cells, indexed by x * cols + y. Each key
+is seeded from its index, so it does not depend on which cells were asked
+for first.
+"""
+class ZobristCells(dict):
+    def __init__(self, seed):
+        self.seed = seed
+
+    def __missing__(self, i):
+        key = random.Random(self.seed + (i,)).getrandbits(64)
+        self[i] = key
+        return key
+
+"""
+Random 64-bit keys for hashing Board positions, one per (player, cell), per
+value of Board.turn, per player's skip flag and per (player, used piece).
+Keys are drawn from a fixed seed, so every process agrees on them.
+"""
+class ZobristKeys(object):
+    seed = 0x426c6f6b7573
+
+    _keys = {}
+
+    @classmethod
+    def get(cls, shape, player_count):
+        key = (tuple(shape), player_count)
+        try:
+            return cls._keys[key]
+        except KeyError:
+            keys = cls(shape, player_count)
+            cls._keys[key] = keys
+            return keys
+
+    def __init__(self, shape, player_count):
+        self.rows = shape[0]
+        self.cols = shape[1]
+        self.player_count = player_count
+
+        rng = random.Random((self.seed, self.rows, self.cols, player_count))
+        # Cell keys are drawn when first used, so huge boards only pay for
+        # the cells which get played on
+        self.cells = [ZobristCells((self.seed, self.rows, self.cols, p))
+                for p in xrange(player_count)]
+        # Indexed by turn + 1, as the turn is -1 once the game is over
+        self.turns = [rng.getrandbits(64) for t in xrange(player_count + 1)]
+        self.skips = [rng.getrandbits(64) for p in xrange(player_count)]
+        self._pieces = {}
+
+    def cell(self, player_id, x, y):
+        return self.cells[player_id][x * self.cols + y]
+
+    def piece(self, player_id, piece_id):
+        try:
+            return self._pieces[(player_id, piece_id)]
+        except KeyError:
+            key = random.Random((self.seed, player_id, piece_id)).getrandbits(64)
+            self._pieces[(player_id, piece_id)] = key
+            return key
+
+"""
+A player's tallies as returned by Board.standings():
+
+score      -- Board.get_score(player_id)
+placed     -- Squares covered by the player's pieces
+remaining  -- Squares of the player's pieces still to be placed
+pieces     -- Number of pieces still to be placed
+bonus      -- Whether the player has placed all their pieces
+frontier   -- Number of anchors, the cells the player can build from. Only
+              a rough stand-in for the area still reachable by them, which
+              Board.reach_plane() works out in full.
+"""
+Standing = collections.namedtuple('Standing',
+        'player_id score placed remaining pieces bonus frontier')
+
 class Board(object):
     BlockClass = Block
     BlockClassKwds = {}
@@ -475,8 +1078,8 @@ class Board(object):
 
     def build_board(self):
         self.board = [
-                [self.BlockClass(**self.BlockClassKwds) for x in xrange(self.rows)]
-                      for y in xrange(self.cols)]
+                [self.BlockClass(**self.BlockClassKwds) for y in xrange(self.cols)]
+                      for x in xrange(self.rows)]
 
         # Hacky :/
         self._back_refs = {}
@@ -484,6 +1087,11 @@ class Board(object):
             for x in xrange(self.rows):
                 self._back_refs[self.board[x][y]] = Point(x,y)
 
+        # Empty cells diagonal to a player's pieces which they may play in
+        self.anchors = [set() for x in xrange(self.player_count)]
+        # Empty cells sharing an edge with a player's pieces
+        self.forbidden = [set() for x in xrange(self.player_count)]
+
     def build_piece_libraries(self):
         self.piece_library = {x : PieceLibrary(
             self.library,
@@ -508,13 +1116,9 @@ class Board(object):
         self.shape = shape
         self.rows = shape[0]
         self.cols = shape[1]
-        self.corners = (
-                Point(0,0),
-                Point(0,self.cols-1),
-                Point(self.rows-1, 0),
-                Point(self.rows-1, self.cols-1),
-                )
         self.player_count = player_count
+        # The cells first moves must cover
+        self.corners = self.start_points()
 
         self.build_piece_libraries()
         self.build_board()
@@ -522,11 +1126,49 @@ class Board(object):
         self.moves = [list() for x in xrange(player_count)]
         self.turn = 0
         self.skips = [False for x in xrange(player_count)]
+        # Every move played, oldest first, see do_move
+        self.journal = []
+
+        # Running tallies kept by do_move, see standings()
+        self.placed_squares = [0 for x in xrange(player_count)]
+        self.placed_pieces = [0 for x in xrange(player_count)]
+        # Size of the piece which completed a player's set, 0 until they do
+        self.final_size = [0 for x in xrange(player_count)]
+
+        self._planes = {}
+        # An InfluenceTracker once influence() has been asked for
+        self._influence = None
+
+        self.zobrist_keys = ZobristKeys.get(self.shape, self.player_count)
+        self._zobrist_deltas = {}
+        self.zobrist = self.compute_zobrist()
+
+    """
+    Returns the cells players start from: the four board corners, or with
+    more than four players one cell per player spread evenly around the edge
+    of the board, starting from (0,0) and going clockwise
+    """
+    def start_points(self):
+        rows, cols = self.rows, self.cols
+        if self.player_count <= 4:
+            return (Point(0,0), Point(0,cols-1), Point(rows-1,0),
+                    Point(rows-1,cols-1))
+
+        edge = [(0, y) for y in xrange(cols)] +\
+                [(x, cols-1) for x in xrange(1, rows)] +\
+                [(rows-1, y) for y in xrange(cols-2, -1, -1)] +\
+                [(x, 0) for x in xrange(rows-2, 0, -1)]
+        return tuple(Point(edge[i * len(edge) // self.player_count])
+                for i in xrange(self.player_count))
 
     def valid_key(self, key):
         if key.x not in xrange(self.rows) or key.y not in xrange(self.cols):
             raise IndexError
 
+    """Returns the move covering a cell, or None if the cell is empty"""
+    def cell_move(self, x, y):
+        return self.board[x][y].move
+
     def __getitem__(self, key):
         key = Point(key)
         self.valid_key(key)
@@ -552,21 +1194,78 @@ class Board(object):
     def get_remaining_piece_ids(self, player_id):
         return self.piece_library[player_id].get_remaining_piece_ids()
 
+    """
+    Minus the squares of a player's remaining pieces, or once they have all
+    been placed 15, plus 5 if the last one was the monomino
+    """
     def get_score(self, player_id):
-        r = self.piece_library[player_id].get_remaining_piece_ids()
-        s = 0
-        if len(r):
-            for pid in r:
-                s -= len(self.piece_library[player_id][pid])
-        else:
-            s += 15
-            for m in reversed(self.moves[player_id]):
-                if m.is_skip():
-                    continue
-                if len(self.piece_library[player_id][m.piece_id]) == 1:
-                    s += 5
-                break
-        return s
+        library = self.piece_library[player_id]
+        if self.placed_pieces[player_id] < len(library.piece_ids):
+            return self.placed_squares[player_id] - \
+                    library.catalog.get_total_squares()
+        if self.final_size[player_id] == 1:
+            return 20
+        return 15
+
+    """Returns the number of anchors a player has (see get_anchors)"""
+    def anchor_count(self, player_id):
+        if len(self.moves[player_id]) == 0:
+            return len(self.get_anchors(player_id))
+        return len(self.anchors[player_id])
+
+    """
+    Returns a Standing for each player, indexed by player id, from tallies
+    do_move keeps up to date (the anchor sets, or BitBoard.anchor_counts)
+    """
+    def standings(self):
+        standings = []
+        for p in xrange(self.player_count):
+            library = self.piece_library[p]
+            pieces = len(library.piece_ids) - self.placed_pieces[p]
+            standings.append(Standing(p, self.get_score(p),
+                self.placed_squares[p],
+                library.catalog.get_total_squares() - self.placed_squares[p],
+                pieces, pieces == 0, self.anchor_count(p)))
+        return standings
+
+    """
+    Scores many games at once with NumPy, giving the same values as get_score.
+
+    used       -- (games, players, pieces) booleans, True where the player
+                  has placed the piece at that index of the catalog's
+                  ordered_ids
+    sizes      -- The squares of each of those pieces (PieceCatalog.get_sizes)
+    last_sizes -- (games, players) size of the piece each player placed last,
+                  only looked at for players who placed every piece
+    Returns a (games, players) array of scores.
+    """
+    @staticmethod
+    def score_batch(used, sizes, last_sizes):
+        used = numpy.asarray(used, dtype=bool)
+        sizes = numpy.asarray(sizes, dtype=numpy.int32)
+        remaining = numpy.dot(~used, sizes)
+        bonus = numpy.where(numpy.asarray(last_sizes) == 1, 20, 15)
+        return numpy.where(used.all(axis=-1), bonus, -remaining)
+
+    """
+    Scores a sequence of boards sharing one library and player count with
+    score_batch, returning a (boards, players) array
+    """
+    @classmethod
+    def score_boards(cls, boards):
+        catalog = boards[0].piece_library[0].catalog
+        count = len(catalog.ordered_ids)
+        used = numpy.zeros((len(boards), boards[0].player_count, count), dtype=bool)
+        last_sizes = numpy.zeros(used.shape[:2], dtype=numpy.int32)
+        width = (count + 7) // 8 * 2
+        for g, board in enumerate(boards):
+            for p in xrange(board.player_count):
+                # Bit i of the mask is piece i, most significant byte first
+                raw = ('%0*x' % (width, board.piece_library[p].used_mask)).decode('hex')
+                bits = numpy.unpackbits(numpy.frombuffer(raw, dtype=numpy.uint8))
+                used[g, p] = bits[::-1][:count]
+                last_sizes[g, p] = board.final_size[p]
+        return cls.score_batch(used, catalog.get_sizes(), last_sizes)
 
     def is_valid_move(self, move, first_move=False, ignore_turn=False):
         if not first_move and len(self.moves[move.player_id]) == 0:
@@ -583,7 +1282,7 @@ class Board(object):
                     self.turn, move.player_id)
             return False
 
-        if not move.piece_id in self.get_remaining_piece_ids(move.player_id):
+        if not self.piece_library[move.player_id].is_remaining(move.piece_id):
             self._valid_reason = "Piece %d not in %d's remaining pieces" % (
                     move.piece_id, move.player_id)
             return False
@@ -635,43 +1334,518 @@ class Board(object):
         coords = [coord + move.position for coord in rot]
         return coords
 
-    def do_move(self, move, unplay=False):
-        if not unplay:
-            self.moves[move.player_id].append(move)
+    """
+    Plays a move, or with unplay takes back the last move played. Every
+    move is recorded in the journal as a tuple
 
-            if move.is_voluntary_skip():
-                self.skips[self.turn] = True
+        (move, turn, set_skip, zobrist, cells)
 
-            if all(self.skips):
-                self.turn = -1
-            else:
-                self.turn = (self.turn + 1) % self.player_count
-                while self.skips[self.turn]:
-                    self.turn = (self.turn + 1) % self.player_count
-        else:
-            if move != self.moves[move.player_id][-1]:
+    of the move, the turn and hash before it, whether it set its player's
+    skip flag and what place_piece returned for it, so undoing a move only
+    touches what the move changed.
+    """
+    def do_move(self, move, unplay=False):
+        self._planes = {}
+
+        if unplay:
+            if not self.journal or move is not self.journal[-1][0]:
                 raise KeyError, "Moves must be unplayed in reverse chrono order"
+            move, turn, set_skip, zobrist, cells = self.journal.pop()
+
             self.moves[move.player_id].pop(-1)
+            self.turn = turn
+            if set_skip:
+                self.skips[turn] = False
+            self.zobrist = zobrist
+
+            if not move.is_skip():
+                self.piece_library[move.player_id].unplay_move(move)
+                self.remove_piece(move, cells)
+                self.tally_piece(move, True)
+            if self._influence is not None:
+                self._influence.unplayed(move)
+            return
 
-            # Safe as unplayed move is known to be last move from above
-            self.turn = move.player_id
+        keys = self.zobrist_keys
+        turn = self.turn
+        zobrist = self.zobrist ^ keys.turns[turn + 1]
 
-            if move.is_voluntary_skip():
-                self.skips[self.turn] = False
+        self.moves[move.player_id].append(move)
 
-        if move.is_skip():
-            return
+        set_skip = move.is_voluntary_skip() and not self.skips[turn]
+        if set_skip:
+            zobrist ^= keys.skips[turn]
+            self.skips[turn] = True
 
-        if not unplay:
+        if all(self.skips):
+            self.turn = -1
+        else:
+            self.turn = (self.turn + 1) % self.player_count
+            while self.skips[self.turn]:
+                self.turn = (self.turn + 1) % self.player_count
+
+        zobrist ^= keys.turns[self.turn + 1]
+
+        cells = None
+        if not move.is_skip():
+            zobrist ^= self.zobrist_piece(move)
             self.piece_library[move.player_id].play_move(move)
+            cells = self.place_piece(move)
+            self.tally_piece(move)
+
+        self.journal.append((move, turn, set_skip, self.zobrist, cells))
+        self.zobrist = zobrist
+
+        if self._influence is not None:
+            self._influence.played(move)
+
+    """Returns a checkpoint which rollback_to() can later return the board to"""
+    def checkpoint(self):
+        return len(self.journal)
+
+    """
+    Takes back every move played since checkpoint() returned checkpoint, in
+    time proportional to what those moves changed
+    """
+    def rollback_to(self, checkpoint):
+        if not 0 <= checkpoint <= len(self.journal):
+            raise ValueError, "Checkpoint %d is not in the journal" % (checkpoint)
+        while len(self.journal) > checkpoint:
+            self.do_move(self.journal[-1][0], True)
+
+    """Internal - Updates the standings tallies for a placed or removed piece"""
+    def tally_piece(self, move, unplay=False):
+        p = move.player_id
+        library = self.piece_library[p]
+        size = len(library[move.piece_id])
+        if not unplay:
+            self.placed_squares[p] += size
+            self.placed_pieces[p] += 1
+            if self.placed_pieces[p] == len(library.piece_ids):
+                self.final_size[p] = size
         else:
-            self.piece_library[move.player_id].unplay_move(move)
+            self.placed_squares[p] -= size
+            self.placed_pieces[p] -= 1
+            self.final_size[p] = 0
 
+    """Returns the hash contribution of a (non-skip) move's piece and cells"""
+    def zobrist_piece(self, move):
+        key = (move.piece_id, move.rotation, move.mirror)
+        try:
+            deltas = self._zobrist_deltas[key]
+        except KeyError:
+            coords = self.piece_library[move.player_id][move.piece_id].\
+                    get_transform_coords(rotation=move.rotation, mirror=move.mirror)
+            deltas = tuple(c.x * self.cols + c.y for c in coords)
+            self._zobrist_deltas[key] = deltas
+
+        keys = self.zobrist_keys
+        cells = keys.cells[move.player_id]
+        zobrist = keys.piece(move.player_id, move.piece_id)
+        root = move.position.x * self.cols + move.position.y
+        for delta in deltas:
+            zobrist ^= cells[root + delta]
+        return zobrist
+
+    """
+    Hashes the current position from scratch: cell ownership, whose turn it
+    is, skip flags and used pieces. Board.zobrist is kept equal to this by
+    do_move, so this is only needed to check it or after changing the board
+    behind do_move's back.
+    """
+    def compute_zobrist(self):
+        keys = self.zobrist_keys
+        zobrist = keys.turns[self.turn + 1]
+        for player_id in xrange(self.player_count):
+            if self.skips[player_id]:
+                zobrist ^= keys.skips[player_id]
+            for move in self.moves[player_id]:
+                if not move.is_skip():
+                    zobrist ^= self.zobrist_piece(move)
+        return zobrist
+
+    """
+    Marks the cells covered by a (non-skip) move as occupied by it. Returns
+    the cells in whatever form remove_piece() takes them.
+    """
+    def place_piece(self, move):
+        coords = self.move_coords(move)
+        for coord in coords:
+            self[coord].move = move
+        self.update_frontier(move.player_id, coords)
+        return coords
+
+    """Clears the cells covered by a (non-skip) move"""
+    def remove_piece(self, move, cells=None):
+        if cells is None:
+            cells = self.move_coords(move)
+        for coord in cells:
+            self[coord].move = None
+        self.update_frontier(move.player_id, cells)
+
+    def _owner(self, x, y):
+        if 0 <= x < self.rows and 0 <= y < self.cols:
+            move = self.cell_move(x, y)
+            if move is not None:
+                return move.player_id
+        return None
+
+    def _update_cell_frontier(self, player_id, x, y):
+        if not (0 <= x < self.rows and 0 <= y < self.cols):
+            return
+        coord = Point(x, y)
+        anchors = self.anchors[player_id]
+        forbidden = self.forbidden[player_id]
+
+        if self.cell_move(x, y) is not None:
+            anchors.discard(coord)
+            forbidden.discard(coord)
+            return
+
+        for dx, dy in Piece.EDGE_COORDS:
+            if self._owner(x + dx, y + dy) == player_id:
+                anchors.discard(coord)
+                forbidden.add(coord)
+                return
+        forbidden.discard(coord)
+
+        for dx, dy in Piece.CORNER_COORDS:
+            if self._owner(x + dx, y + dy) == player_id:
+                anchors.add(coord)
+                return
+        anchors.discard(coord)
+
+    """
+    Internal - Re-evaluates the anchor and forbidden sets after player_id's
+    piece covering coords was placed or removed. Only the mover's sets can
+    change around the piece, other players only gain or lose its cells.
+    """
+    def update_frontier(self, player_id, coords):
+        cells = set((c.x, c.y) for c in coords)
+        around = set(cells)
+        for x, y in cells:
+            for dx, dy in Piece.EDGE_COORDS + Piece.CORNER_COORDS:
+                around.add((x + dx, y + dy))
+
+        for p in xrange(self.player_count):
+            for x, y in (around if p == player_id else cells):
+                self._update_cell_frontier(p, x, y)
+
+    """
+    Returns the empty cells a player's next piece may cover to satisfy the
+    corner rule: the free board corners before their first move, afterwards
+    cells diagonal to their pieces which do not share an edge with them
+    """
+    def get_anchors(self, player_id):
+        if len(self.moves[player_id]) == 0:
+            return set(c for c in self.corners if self[c].move is None)
+        return set(self.anchors[player_id])
+
+    """Returns the empty cells sharing an edge with a player's pieces"""
+    def get_forbidden(self, player_id):
+        return set(self.forbidden[player_id])
+
+    """
+    Checks only that a move lies on empty cells inside the board which do not
+    share an edge with the mover's pieces. Moves covering one of the mover's
+    anchors which pass this are legal (turn order aside).
+    """
+    def is_legal_placement(self, move):
+        forbidden = self.forbidden[move.player_id]
         for coord in self.move_coords(move):
-            if not unplay:
-                self[coord].move = move
-            else:
-                self[coord].move = None
+            try:
+                if self[coord].move is not None:
+                    return False
+            except IndexError:
+                return False
+            if coord in forbidden:
+                return False
+        return True
+
+    """
+    Generates every legal move for a player's remaining pieces, ignoring
+    whose turn it is. Only placements covering one of the player's anchors
+    are tried, so the cost follows the size of the frontier rather than the
+    board. Given a subset of the anchors, only the legal moves covering one
+    of those are generated. The board must not change while the generator
+    is running.
+    """
+    def legal_moves(self, player_id, anchors=None):
+        library = self.piece_library[player_id]
+        if anchors is None:
+            anchors = self.get_anchors(player_id)
+        for piece_id in sorted(library.get_remaining_piece_ids()):
+            piece = library[piece_id]
+            for rotation, mirror, key in piece.unique_orientations():
+                roots = set()
+                for c in piece.get_transform_coords(rotation, mirror):
+                    for a in anchors:
+                        root = (a.x - c.x, a.y - c.y)
+                        if root in roots:
+                            continue
+                        roots.add(root)
+                        move = Move(player_id, piece_id, rotation, mirror, root)
+                        if self.is_legal_placement(move):
+                            yield move
+
+    """
+    Returns a (rows, cols) NumPy array holding the id of the player covering
+    each cell, or -1 for empty cells
+    """
+    def owner_plane(self):
+        try:
+            return self._planes['owner']
+        except KeyError:
+            pass
+
+        plane = numpy.empty(self.shape, dtype=numpy.int8)
+        plane.fill(-1)
+        for player_moves in self.moves:
+            for move in player_moves:
+                if not move.is_skip():
+                    for c in self.move_coords(move):
+                        plane[c.x, c.y] = move.player_id
+
+        self._planes['owner'] = plane
+        return plane
+
+    """
+    Internal - Returns (blocked, anchors, pad): boolean planes of the cells a
+    player may not cover and the cells one of which they must cover, both
+    padded by pad cells on every side (blocked is True in the padding)
+    """
+    def _placement_planes(self, player_id):
+        try:
+            return self._planes[player_id]
+        except KeyError:
+            pass
+
+        owner = self.owner_plane()
+        own = owner == player_id
+        occupied = owner >= 0
+
+        if len(self.moves[player_id]) == 0:
+            touch = numpy.zeros(self.shape, dtype=bool)
+            for c in self.corners:
+                touch[c.x, c.y] = True
+            edges = numpy.zeros(self.shape, dtype=bool)
+        else:
+            edges = numpy.zeros(self.shape, dtype=bool)
+            edges[1:,:] |= own[:-1,:]
+            edges[:-1,:] |= own[1:,:]
+            edges[:,1:] |= own[:,:-1]
+            edges[:,:-1] |= own[:,1:]
+            touch = numpy.zeros(self.shape, dtype=bool)
+            touch[1:,1:] |= own[:-1,:-1]
+            touch[1:,:-1] |= own[:-1,1:]
+            touch[:-1,1:] |= own[1:,:-1]
+            touch[:-1,:-1] |= own[1:,1:]
+
+        pad = max(self.rows, self.cols)
+        blocked = numpy.ones((self.rows + 2*pad, self.cols + 2*pad), dtype=bool)
+        blocked[pad:pad+self.rows, pad:pad+self.cols] = occupied | edges
+        anchors = numpy.zeros(blocked.shape, dtype=bool)
+        anchors[pad:pad+self.rows, pad:pad+self.cols] = touch & ~occupied & ~edges
+
+        planes = (blocked, anchors, pad)
+        self._planes[player_id] = planes
+        return planes
+
+    """
+    Returns a (rows, cols) boolean NumPy array which is True at every root
+    position where the given piece orientation can legally be played by
+    player_id (ignoring whose turn it is). The map is the correlation of the
+    piece's footprint with the board's blocked and anchor planes, one
+    shifted slice per block of the piece.
+    """
+    def placement_map(self, player_id, piece_id, rotation=0, mirror=False):
+        legal = numpy.zeros(self.shape, dtype=bool)
+        if not self.piece_library[player_id].is_remaining(piece_id):
+            return legal
+
+        blocked, anchors, pad = self._placement_planes(player_id)
+        coords = self.piece_library[player_id][piece_id].get_transform_coords(
+                rotation=rotation, mirror=mirror)
+        for c in coords:
+            if abs(c.x) >= pad or abs(c.y) >= pad:
+                return legal
+
+        bad = numpy.zeros(self.shape, dtype=bool)
+        for c in coords:
+            window = (slice(pad + c.x, pad + c.x + self.rows),
+                    slice(pad + c.y, pad + c.y + self.cols))
+            bad |= blocked[window]
+            legal |= anchors[window]
+        legal &= ~bad
+        return legal
+
+    """
+    Returns the InfluenceTracker of this board, which from then on is kept
+    up to date by every move played or unplayed
+    """
+    def influence(self):
+        if self._influence is None:
+            self._influence = InfluenceTracker(self)
+        return self._influence
+
+    """Returns the number of legal placements a player has, ignoring turns"""
+    def mobility(self, player_id):
+        return len(self.influence().placements[player_id])
+
+    """
+    Returns a (rows, cols) int32 NumPy array counting, per cell, the legal
+    placements of a player which cover it. Non-zero cells are the ones the
+    player can reach with their next piece. The array is a read-only view
+    of the InfluenceTracker's, which follows every move played or
+    unplayed, so copy it to keep one position's.
+    """
+    def mobility_plane(self, player_id):
+        plane = self.influence().mobility[player_id].view()
+        plane.flags.writeable = False
+        return plane
+
+    """
+    Returns a (rows, cols) int8 NumPy array counting, per cell, the players
+    who can cover it with their next piece. Cells above 1 are contested.
+    """
+    def contested_plane(self):
+        try:
+            return self._planes['contested']
+        except KeyError:
+            pass
+
+        plane = numpy.zeros(self.shape, dtype=numpy.int8)
+        for p in xrange(self.player_count):
+            plane += self.mobility_plane(p) > 0
+        self._planes['contested'] = plane
+        return plane
+
+    """
+    Returns a (rows, cols) boolean NumPy array of the cells a player could
+    ever still cover: the empty cells not next to their own pieces which are
+    connected to one of their anchors (or to a cell reachable with their
+    next piece) through other such cells, edges and corners both counting.
+    """
+    def reach_plane(self, player_id):
+        key = ('reach', player_id)
+        try:
+            return self._planes[key]
+        except KeyError:
+            pass
+
+        blocked, anchors, pad = self._placement_planes(player_id)
+        free = ~blocked[pad-1:pad+self.rows+1, pad-1:pad+self.cols+1]
+        reach = numpy.zeros(free.shape, dtype=bool)
+        reach[1:-1,1:-1] = self.mobility_plane(player_id) > 0
+        reach[1:-1,1:-1] |= anchors[pad:pad+self.rows, pad:pad+self.cols]
+        while True:
+            grown = reach.copy()
+            grown[1:,:] |= reach[:-1,:]
+            grown[:-1,:] |= reach[1:,:]
+            grown[:,1:] |= grown[:,:-1]
+            grown[:,:-1] |= grown[:,1:]
+            grown &= free
+            if (grown == reach).all():
+                break
+            reach = grown
+        reach = reach[1:-1,1:-1]
+        self._planes[key] = reach
+        return reach
+
+    """
+    Returns the mutable state of the board (moves, turn, skips, used pieces,
+    cell contents, score tallies and journal) as an immutable value which
+    restore() accepts
+    """
+    def snapshot(self):
+        return (
+                tuple(tuple(m) for m in self.moves),
+                self.turn,
+                tuple(self.skips),
+                tuple(self.piece_library[p].used_mask
+                    for p in xrange(self.player_count)),
+                self.zobrist,
+                self.snapshot_cells(),
+                (tuple(self.placed_squares), tuple(self.placed_pieces),
+                    tuple(self.final_size)),
+                tuple(self.journal),
+                )
+
+    def restore(self, snapshot):
+        moves, turn, skips, used_masks, zobrist, cells, tallies, journal = snapshot
+        self.restore_cells(cells, moves)
+        self.moves = [list(m) for m in moves]
+        self.turn = turn
+        self.skips = list(skips)
+        self.placed_squares, self.placed_pieces, self.final_size = \
+                [list(t) for t in tallies]
+        self.journal = list(journal)
+        self._influence = None
+        for p in xrange(self.player_count):
+            self.piece_library[p].used_mask = used_masks[p]
+        self.zobrist = zobrist
+        self._planes = {}
+
+    def snapshot_cells(self):
+        return (tuple(set(a) for a in self.anchors),
+                tuple(set(f) for f in self.forbidden))
+
+    """
+    Internal - Restores the cell state from snapshot_cells(). moves are the
+    snapshot's moves, self.moves still holds the current ones.
+    """
+    def restore_cells(self, cells, moves):
+        for player_moves in self.moves:
+            for move in player_moves:
+                if not move.is_skip():
+                    for coord in self.move_coords(move):
+                        self[coord].move = None
+        for player_moves in moves:
+            for move in player_moves:
+                if not move.is_skip():
+                    for coord in self.move_coords(move):
+                        self[coord].move = move
+        anchors, forbidden = cells
+        self.anchors = [set(a) for a in anchors]
+        self.forbidden = [set(f) for f in forbidden]
+
+    """
+    Internal - Gives a shallow copy of a board cell storage of its own. The
+    contents are filled in by restore().
+    """
+    def detach_cells(self):
+        self.build_board()
+
+    """
+    Returns a small picklable description of this position, for sending to
+    other processes: how to build the board and the moves played so far as
+    packed Move codes, so boards over 64x64 can not be described this way.
+    from_compact() builds the board back.
+    """
+    def compact(self):
+        return (self.__class__, self.library, self.restrict_piece_ids_to,
+                tuple(self.shape), self.player_count,
+                tuple(entry[0].as_tuple() for entry in self.journal))
+
+    @staticmethod
+    def from_compact(compact, cls=None):
+        board_cls, library, restrict_piece_ids_to, shape, player_count, moves = compact
+        board = (cls or board_cls)(library, restrict_piece_ids_to, shape, player_count)
+        for move in moves:
+            board.play_move(Move.from_tuple(move))
+        return board
+
+    """
+    Returns an independent copy of this board. Pieces, placement tables and
+    hash keys are shared, only the mutable state is copied.
+    """
+    def clone(self):
+        board = copy.copy(self)
+        board.piece_library = dict((p, l.copy())
+                for p, l in self.piece_library.iteritems())
+        board.detach_cells()
+        board.restore(self.snapshot())
+        return board
 
     def play_move(self, move):
         self.do_move(move)
@@ -699,3 +1873,835 @@ class Board(object):
         self._valid_reason = "First move must be in a corner"
 
         return False
+
+
+
+"""
+The legal placements of every player, kept up to date as moves are played
+and unplayed (see Board.influence). Each player's placements are keyed by
+(piece_id, rotation, mirror, x, y) and indexed by the cells they cover and
+by piece, so a move only revisits the placements around it:
+
+  - Every player loses the placements covering the move's cells
+  - The mover loses the placements of the piece played, those next to it
+    and those left without an anchor, and gains the placements covering
+    their new anchors
+
+What each move changed is kept on a stack so unplaying it just reverses it.
+With NumPy, mobility holds per player a (rows, cols) int32 array counting
+the placements covering each cell, updated as placements come and go.
+"""
+class InfluenceTracker(object):
+    def __init__(self, board):
+        self.board = board
+        count = board.player_count
+        self.mobility = None
+        if numpy is not None:
+            self.mobility = [numpy.zeros(board.shape, dtype=numpy.int32)
+                    for p in xrange(count)]
+        self.placements = [dict() for p in xrange(count)]
+        self.by_cell = [dict() for p in xrange(count)]
+        self.by_piece = [dict() for p in xrange(count)]
+        self.anchors = [set((a.x, a.y) for a in board.get_anchors(p))
+                for p in xrange(count)]
+        # Per move played: None for skips, otherwise a list of
+        # (player_id, removed {key : cells}, added [key], anchors before)
+        self.changes = []
+
+        for p in xrange(count):
+            self._add(p, board.legal_moves(p))
+
+    def _insert(self, player_id, key, cells):
+        self.placements[player_id][key] = cells
+        by_cell = self.by_cell[player_id]
+        for cell in cells:
+            try:
+                by_cell[cell].add(key)
+            except KeyError:
+                by_cell[cell] = set([key])
+        if self.mobility is not None:
+            plane = self.mobility[player_id]
+            for cell in cells:
+                plane[cell] += 1
+        try:
+            self.by_piece[player_id][key[0]].add(key)
+        except KeyError:
+            self.by_piece[player_id][key[0]] = set([key])
+
+    def _delete(self, player_id, key):
+        cells = self.placements[player_id].pop(key)
+        by_cell = self.by_cell[player_id]
+        for cell in cells:
+            keys = by_cell[cell]
+            keys.discard(key)
+            if not keys:
+                del by_cell[cell]
+        if self.mobility is not None:
+            plane = self.mobility[player_id]
+            for cell in cells:
+                plane[cell] -= 1
+        self.by_piece[player_id][key[0]].discard(key)
+        return cells
+
+    def _add(self, player_id, moves):
+        added = []
+        placements = self.placements[player_id]
+        for move in moves:
+            key = (move.piece_id, move.rotation, move.mirror,
+                    move.position.x, move.position.y)
+            if key not in placements:
+                self._insert(player_id, key, tuple((c.x, c.y)
+                    for c in self.board.move_coords(move)))
+                added.append(key)
+        return added
+
+    def _remove(self, player_id, keys):
+        return dict((key, self._delete(player_id, key)) for key in keys)
+
+    def _keys_at(self, player_id, cells):
+        keys = set()
+        by_cell = self.by_cell[player_id]
+        for cell in cells:
+            keys.update(by_cell.get(cell, ()))
+        return keys
+
+    def played(self, move):
+        if move.is_skip():
+            self.changes.append(None)
+            return
+
+        board = self.board
+        mover = move.player_id
+        cells = set((c.x, c.y) for c in board.move_coords(move))
+        changes = []
+
+        for p in xrange(board.player_count):
+            if p != mover:
+                removed = self._remove(p, self._keys_at(p, cells))
+                changes.append((p, removed, [], self.anchors[p]))
+                self.anchors[p] = self.anchors[p] - cells
+
+        anchors = set((a.x, a.y) for a in board.get_anchors(mover))
+        lost = self.anchors[mover] - anchors
+        gained = anchors - self.anchors[mover]
+        changes.append((mover, None, None, self.anchors[mover]))
+        self.anchors[mover] = anchors
+
+        around = lost | cells
+        for x, y in cells:
+            for dx, dy in Piece.EDGE_COORDS:
+                around.add((x + dx, y + dy))
+        stale = self._keys_at(mover, around)
+        stale.update(self.by_piece[mover].get(move.piece_id, ()))
+        dead = []
+        for key in stale:
+            if key[0] == move.piece_id or\
+                    anchors.isdisjoint(self.placements[mover][key]) or\
+                    not board.is_legal_placement(Move(mover, key[0], key[1],
+                        key[2], key[3:])):
+                dead.append(key)
+        removed = self._remove(mover, dead)
+        added = self._add(mover, board.legal_moves(mover,
+            [Point(a) for a in gained]))
+        changes[-1] = (mover, removed, added, changes[-1][3])
+
+        self.changes.append(changes)
+
+    def unplayed(self, move):
+        changes = self.changes.pop()
+        if changes is None:
+            return
+        for p, removed, added, anchors in reversed(changes):
+            self._remove(p, added)
+            for key, cells in removed.iteritems():
+                self._insert(p, key, cells)
+            self.anchors[p] = anchors
+
+"""
+Every placement of every piece orientation of a library on a board of a given
+shape, as integer bitmasks in the BitBoard layout (see below).
+
+For each (piece_id, rotation, mirror) the table holds a tuple
+(occupied, edges, corners, offset, fits):
+
+occupied -- The blocks of the piece
+edges    -- Cells sharing an edge with the piece, which the mover may not own
+corners  -- Cells touching the piece diagonally, one of which the mover must own
+offset   -- The three masks above are placed for a root at bit b by shifting
+            them left by b + offset
+fits     -- Bit b is set if the piece fits on the board with its root at bit b
+
+Storing every root position separately would take gigabytes for the larger
+libraries, so a placement is one shift away instead. Entries are built when
+first looked up. A full table can be saved and later memory-mapped, in which
+case entries are decoded from the mapped file when first looked up.
+"""
+class PlacementTable(object):
+    """Network order: magic, version, rows, cols, mask bytes, piece count"""
+    header_format = "!4sHHHHI"
+    """Network order: piece id, rotation, mirror, offset"""
+    entry_format = "!IBBi"
+    magic = "BKPT"
+    version = 1
+
+    _tables = {}
+
+    def __init__(self, library, shape):
+        self.library = library
+        self.rows = shape[0]
+        self.cols = shape[1]
+        self.stride = self.cols + 1
+        self.mask_bytes = ((self.rows + 2) * self.stride + 7) // 8
+
+        self.entries = {}
+        self._map = None
+
+    """
+    Returns the shared table for a PieceLibrary and board shape, building it
+    (or loading it from cache_dir, if given and present) the first time
+    """
+    @classmethod
+    def get(cls, library, shape, cache_dir=None):
+        key = (library.library, frozenset(library.piece_ids), tuple(shape))
+        try:
+            return cls._tables[key]
+        except KeyError:
+            pass
+
+        table = None
+        if cache_dir is not None:
+            # Restricted libraries get their own file
+            ids = hashlib.md5(','.join(str(i) for i in
+                sorted(library.piece_ids))).hexdigest()[:8]
+            path = os.path.join(cache_dir, "%s-%s-%dx%d.placements" % (
+                os.path.basename(library.library), ids, shape[0], shape[1]))
+            try:
+                table = cls.load(path, library)
+                if table.rows != shape[0] or table.cols != shape[1]:
+                    raise IOError, "Placement table of another shape: " + path
+            except (IOError, ValueError, struct.error):
+                table = cls(library, shape)
+                table.save(path)
+        if table is None:
+            table = cls(library, shape)
+
+        cls._tables[key] = table
+        return table
+
+    def bit(self, x, y):
+        return (x + 1) * self.stride + y + 1
+
+    def build_entry(self, piece, rotation, mirror):
+        coords = piece.get_transform_coords(rotation=rotation, mirror=mirror)
+        min_x, min_y, max_x, max_y = piece.get_bounds(rotation, mirror)
+
+        # Shift everything so the lowest edge/corner cell lands on bit 0
+        def to_mask(points):
+            mask = 0
+            for p in points:
+                mask |= 1 << ((p.x - min_x + 1) * self.stride + (p.y - min_y + 1))
+            return mask
+
+        occupied = to_mask(coords)
+        edges = to_mask(piece.get_edges(rotation=rotation, mirror=mirror))
+        corners = to_mask(piece.get_corners(rotation=rotation, mirror=mirror))
+        offset = (min_x - 1) * self.stride + (min_y - 1)
+
+        fits = 0
+        if max_y - min_y < self.cols:
+            row = ((1 << (self.cols - (max_y - min_y))) - 1) << (1 - min_y)
+            for x in xrange(-min_x, self.rows - max_x):
+                fits |= row << ((x + 1) * self.stride)
+
+        return (occupied, edges, corners, offset, fits)
+
+    def entry(self, piece_id, rotation, mirror):
+        key = (piece_id, rotation, mirror)
+        try:
+            return self.entries[key]
+        except KeyError:
+            pass
+
+        rotation %= 4
+        mirror = bool(mirror)
+        try:
+            e = self.entries[(piece_id, rotation, mirror)]
+        except KeyError:
+            if self._map is not None:
+                e = self.read_entry(piece_id, rotation, mirror)
+            else:
+                e = self.build_entry(self.library[piece_id], rotation, mirror)
+            self.entries[(piece_id, rotation, mirror)] = e
+        self.entries[key] = e
+        return e
+
+    def _entry_size(self):
+        return struct.calcsize(self.entry_format) + 4 * self.mask_bytes
+
+    def _pack_mask(self, mask):
+        h = "%x" % (mask)
+        return ("0" * (2 * self.mask_bytes - len(h)) + h).decode('hex')
+
+    def _unpack_mask(self, s):
+        return long(s.encode('hex'), 16)
+
+    """Writes every entry of the table to path, replacing any file there
+    only once the table is complete"""
+    def save(self, path):
+        piece_ids = sorted(self.library.piece_ids)
+        temp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(temp_path, 'wb') as o:
+            o.write(struct.pack(self.header_format, self.magic, self.version,
+                self.rows, self.cols, self.mask_bytes, len(piece_ids)))
+            for piece_id in piece_ids:
+                for rotation in xrange(4):
+                    for mirror in (False, True):
+                        occupied, edges, corners, offset, fits =\
+                                self.entry(piece_id, rotation, mirror)
+                        o.write(struct.pack(self.entry_format,
+                            piece_id, rotation, mirror, offset))
+                        for mask in (occupied, edges, corners, fits):
+                            o.write(self._pack_mask(mask))
+        os.rename(temp_path, path)
+
+    """Memory-maps a table written by save() for the same pieces as
+    library. Raises IOError, ValueError or struct.error on any other file."""
+    @classmethod
+    def load(cls, path, library):
+        with open(path, 'rb') as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header_size = struct.calcsize(cls.header_format)
+        magic, version, rows, cols, mask_bytes, count = struct.unpack(
+                cls.header_format, m[:header_size])
+        if magic != cls.magic or version != cls.version:
+            raise IOError, "Not a placement table: " + path
+
+        table = cls(library, (rows, cols))
+        if mask_bytes != table.mask_bytes:
+            raise IOError, "Corrupt placement table: " + path
+        table._map = m
+        table._offsets = {}
+
+        entry_size = table._entry_size()
+        if len(m) != header_size + count * 8 * entry_size:
+            raise IOError, "Truncated placement table: " + path
+        for n in xrange(count):
+            at = header_size + n * 8 * entry_size
+            piece_id = struct.unpack("!I", m[at:at+4])[0]
+            table._offsets[piece_id] = at
+        if set(table._offsets) != set(library.piece_ids):
+            raise IOError, "Placement table of other pieces: " + path
+        return table
+
+    def read_entry(self, piece_id, rotation, mirror):
+        entry_size = self._entry_size()
+        at = self._offsets[piece_id] + (rotation * 2 + mirror) * entry_size
+        at += struct.calcsize(self.entry_format)
+        offset = struct.unpack("!i", self._map[at-4:at])[0]
+        masks = [self._unpack_mask(self._map[
+            at + n * self.mask_bytes:at + (n + 1) * self.mask_bytes])
+            for n in xrange(4)]
+        return (masks[0], masks[1], masks[2], offset, masks[3])
+
+
+"""
+A Board which keeps its state as one integer bitmask per player instead of a
+grid of Block objects. Cell (x,y) lives at bit (x+1)*stride + y+1, where
+stride is cols+1: bit 0 of every row and the first and last rows are padding
+which is never set, so shifting a mask by one cell in any direction can never
+wrap onto a real cell and edge checks need no bounds tests.
+
+Moves are checked against the shared PlacementTable for the board's library
+and shape, so validity checks, playing and unplaying moves are mask ANDs and
+shifts. Cells read through __getitem__ are returned as fresh Block objects, so
+code which only looks at board[coord].move keeps working, but that lookup is
+slow and should stay out of inner loops.
+"""
+class BitBoard(Board):
+    """Directory to load placement tables from / save them to, if set"""
+    placement_cache_dir = None
+
+    def build_board(self):
+        self.stride = self.cols + 1
+
+        self.board_mask = 0
+        row = ((1 << self.cols) - 1) << 1
+        for x in xrange(self.rows):
+            self.board_mask |= row << ((x + 1) * self.stride)
+
+        self.start_mask = 0
+        for c in self.corners:
+            self.start_mask |= 1 << self.bit(c.x, c.y)
+
+        self.occupied_mask = 0
+        # Cells held by each player
+        self.own_masks = [0] * self.player_count
+        # Tallies behind anchor_count, kept up to date by place_piece and
+        # remove_piece: the corners still free, and per player the anchors
+        # around their pieces
+        self.free_corners = len(self.corners)
+        self.anchor_counts = [0] * self.player_count
+
+        self.placements = PlacementTable.get(self.piece_library[0], self.shape,
+                self.placement_cache_dir)
+
+    def bit(self, x, y):
+        return (x + 1) * self.stride + y + 1
+
+    def coord(self, bit):
+        return Point(bit // self.stride - 1, bit % self.stride - 1)
+
+    def dilate_edges(self, mask):
+        s = self.stride
+        return (mask << 1) | (mask >> 1) | (mask << s) | (mask >> s)
+
+    def dilate_corners(self, mask):
+        s = self.stride
+        return (mask << (s + 1)) | (mask << (s - 1)) |\
+                (mask >> (s - 1)) | (mask >> (s + 1))
+
+    def mask_coords(self, mask):
+        coords = []
+        while mask:
+            low = mask & -mask
+            coords.append(self.coord(low.bit_length() - 1))
+            mask ^= low
+        return coords
+
+    def anchor_mask(self, player_id):
+        if len(self.moves[player_id]) == 0:
+            return self.start_mask & ~self.occupied_mask
+        own = self.own_masks[player_id]
+        return self.dilate_corners(own) & ~self.dilate_edges(own) &\
+                ~self.occupied_mask & self.board_mask
+
+    def forbidden_mask(self, player_id):
+        return self.dilate_edges(self.own_masks[player_id]) &\
+                ~self.occupied_mask & self.board_mask
+
+    # Anchors and forbidden cells follow from the own masks in a few shifts,
+    # so they are derived when asked for rather than kept up to date. Only
+    # their number is tallied, as standings() asks for it at every position.
+    def get_anchors(self, player_id):
+        return set(self.mask_coords(self.anchor_mask(player_id)))
+
+    def get_forbidden(self, player_id):
+        return set(self.mask_coords(self.forbidden_mask(player_id)))
+
+    def anchor_count(self, player_id):
+        if len(self.moves[player_id]) == 0:
+            return self.free_corners
+        return self.anchor_counts[player_id]
+
+    """
+    Internal - Places a move's cells on the masks. Returns how many corners
+    it took and the change to each player's anchor count. Whether a cell is
+    an anchor only depends on the cells next to it, so only the anchors
+    next to the move change, and those only depend on the cells up to two
+    rows away. They are counted on the masks cut down to those rows, so the
+    cost follows the size of the move rather than the board.
+    """
+    def _set_piece(self, move, mask):
+        s = self.stride
+        lo = max(0, (mask & -mask).bit_length() - 1 - 2 * s - 2)
+        keep = (1 << (mask.bit_length() + 2 * s + 2 - lo)) - 1
+        local = mask >> lo
+        window = local | self.dilate_edges(local) | self.dilate_corners(local)
+        corners = bin(local & (self.start_mask >> lo)).count('1')
+        board = (self.board_mask >> lo) & keep
+        occupied = (self.occupied_mask >> lo) & keep
+
+        self.occupied_mask |= mask
+        self.own_masks[move.player_id] |= mask
+        self.free_corners -= corners
+
+        deltas = []
+        for p, own in enumerate(self.own_masks):
+            own = (own >> lo) & keep
+            if p == move.player_id:
+                before = own & ~local
+            elif not own & window:
+                # Without pieces next to the move, no anchors there either
+                deltas.append(0)
+                continue
+            else:
+                before = own
+            old = self.dilate_corners(before) & ~self.dilate_edges(before) &\
+                    ~occupied & board & window
+            new = self.dilate_corners(own) & ~self.dilate_edges(own) &\
+                    ~(occupied | local) & board & window
+            delta = bin(new).count('1') - bin(old).count('1')
+            self.anchor_counts[p] += delta
+            deltas.append(delta)
+        return corners, deltas
+
+    """Returns the mask covered by a move, or None if it leaves the board"""
+    def move_mask(self, move):
+        try:
+            occupied, edges, corners, offset, fits = self.placements.entries[
+                    (move.piece_id, move.rotation, move.mirror)]
+        except KeyError:
+            occupied, edges, corners, offset, fits = self.placements.entry(
+                    move.piece_id, move.rotation, move.mirror)
+        y = move.position.y
+        b = (move.position.x + 1) * self.stride + y + 1
+        if b < 0 or not (0 <= y < self.cols and (fits >> b) & 1):
+            return None
+        return occupied << (b + offset)
+
+    def valid_key(self, key):
+        if not (0 <= key[0] < self.rows and 0 <= key[1] < self.cols):
+            raise IndexError
+
+    """Returns the move covering a cell, or None if the cell is empty"""
+    def cell_move(self, x, y):
+        b = 1 << self.bit(x, y)
+        if not b & self.occupied_mask:
+            return None
+        for player_id in xrange(self.player_count):
+            if self.own_masks[player_id] & b:
+                for move in self.moves[player_id]:
+                    if not move.is_skip() and self.move_mask(move) & b:
+                        return move
+
+    def __getitem__(self, key):
+        self.valid_key(key)
+        return self.BlockClass(move=self.cell_move(key[0], key[1]),
+                **self.BlockClassKwds)
+
+    def __setitem__(self, key, val):
+        raise TypeError, "BitBoard cells can only be changed by playing moves"
+
+    def index(self, elem):
+        raise TypeError, "BitBoard cells are not stored as Block objects"
+
+    # Most candidate moves are rejected, so the reason is only formatted when
+    # someone asks for it
+    def _get_valid_reason(self):
+        return self._reason[0] % self._reason[1:]
+
+    def _set_valid_reason(self, reason):
+        self._reason = ("%s", reason)
+
+    _valid_reason = property(_get_valid_reason, _set_valid_reason)
+
+    def is_valid_move(self, move, first_move=False, ignore_turn=False):
+        player_id = move.player_id
+
+        if not first_move and len(self.moves[player_id]) == 0:
+            return self.is_valid_first_move(move)
+
+        if move.piece_id < 0:
+            self._valid_reason = "Skip Succeeded"
+            return True
+
+        if player_id != self.turn:
+            self._reason = ("Current turn %d, move id %d", self.turn, player_id)
+            return False
+
+        library = self.piece_library[player_id]
+        try:
+            used = (library.used_mask >> library.index[move.piece_id]) & 1
+        except KeyError:
+            used = True
+        if used:
+            self._reason = ("Piece %d not in %d's remaining pieces",
+                    move.piece_id, player_id)
+            return False
+
+        try:
+            occupied, edges, corners, offset, fits = self.placements.entries[
+                    (move.piece_id, move.rotation, move.mirror)]
+        except KeyError:
+            occupied, edges, corners, offset, fits = self.placements.entry(
+                    move.piece_id, move.rotation, move.mirror)
+
+        # Only the row of the root needs checking, roots in other rows fall
+        # into the padding (or below bit 0) and miss the fits mask
+        y = move.position.y
+        b = (move.position.x + 1) * self.stride + y + 1
+        if b < 0 or not (0 <= y < self.cols and (fits >> b) & 1):
+            self._reason = ("Move %s leaves the board area", move)
+            return False
+
+        b += offset
+        if (occupied << b) & self.occupied_mask:
+            self._reason = ("Move %s covers an occupied cell", move)
+            return False
+
+        own = self.own_masks[player_id]
+        if (edges << b) & own:
+            self._reason = ("Move %s neighbors one of its own pieces", move)
+            return False
+
+        if first_move or (corners << b) & own:
+            self._valid_reason = "Move Succeeded"
+            return True
+
+        self._valid_reason = "Move touches no corners"
+        return False
+
+    def is_valid_first_move(self, move):
+        if not self.is_valid_move(move, True):
+            return False
+
+        if move.is_skip():
+            return True
+
+        if self.move_mask(move) & self.start_mask:
+            return True
+
+        self._valid_reason = "First move must be in a corner"
+
+        return False
+
+    def owner_plane(self):
+        try:
+            return self._planes['owner']
+        except KeyError:
+            pass
+
+        plane = numpy.empty(self.shape, dtype=numpy.int8)
+        plane.fill(-1)
+        for player_id in xrange(self.player_count):
+            for c in self.mask_coords(self.own_masks[player_id]):
+                plane[c.x, c.y] = player_id
+
+        self._planes['owner'] = plane
+        return plane
+
+    def snapshot_cells(self):
+        return (self.occupied_mask, tuple(self.own_masks), self.free_corners,
+                tuple(self.anchor_counts))
+
+    def restore_cells(self, cells, moves):
+        self.occupied_mask = cells[0]
+        self.own_masks = list(cells[1])
+        self.free_corners = cells[2]
+        self.anchor_counts = list(cells[3])
+
+    # Masks are immutable and restore() replaces the own_masks list
+    def detach_cells(self):
+        pass
+
+    def is_legal_placement(self, move):
+        mask = self.move_mask(move)
+        return mask is not None and not mask & self.occupied_mask and\
+                not mask & self.forbidden_mask(move.player_id)
+
+    def legal_moves(self, player_id, anchors=None):
+        library = self.piece_library[player_id]
+        occupied_mask = self.occupied_mask
+        own = self.own_masks[player_id]
+        stride = self.stride
+        cols = self.cols
+        if anchors is None:
+            anchors = self.mask_coords(self.anchor_mask(player_id))
+        anchors = [(c.x, c.y) for c in anchors]
+
+        for piece_id in sorted(library.get_remaining_piece_ids()):
+            piece = library[piece_id]
+            for rotation, mirror, key in piece.unique_orientations():
+                occupied, edges, corners, offset, fits =\
+                        self.placements.entry(piece_id, rotation, mirror)
+                roots = set()
+                for c in piece.get_transform_coords(rotation, mirror):
+                    for ax, ay in anchors:
+                        y = ay - c.y
+                        if not 0 <= y < cols:
+                            continue
+                        b = (ax - c.x + 1) * stride + y + 1
+                        if b in roots or b < 0 or not (fits >> b) & 1:
+                            continue
+                        roots.add(b)
+                        # Covering an anchor takes care of the corner rule
+                        if (occupied << (b + offset)) & occupied_mask or\
+                                (edges << (b + offset)) & own:
+                            continue
+                        yield Move(player_id, piece_id, rotation, mirror,
+                                (ax - c.x, y))
+
+    def place_piece(self, move):
+        mask = self.move_mask(move)
+        return (mask,) + self._set_piece(move, mask)
+
+    def remove_piece(self, move, cells):
+        mask, corners, deltas = cells
+        self.occupied_mask &= ~mask
+        self.own_masks[move.player_id] &= ~mask
+        self.free_corners += corners
+        for p, delta in enumerate(deltas):
+            self.anchor_counts[p] -= delta
+
+
+"""
+A Board for large shapes which only stores what is on it. Cells live in
+square chunks of 2**CHUNK_BITS cells a side, allocated when a piece first
+lands in them and dropped once they are empty again, and the anchor and
+forbidden sets are kept up to date as on Board. Nothing is sized by the
+board's area, so the cost of every operation follows the number of occupied
+cells and the size of the frontier.
+"""
+class SparseBoard(Board):
+    CHUNK_BITS = 4
+
+    def build_board(self):
+        # (x >> CHUNK_BITS, y >> CHUNK_BITS) -> [occupied cells, cell moves]
+        self.chunks = {}
+
+        # Empty cells diagonal to a player's pieces which they may play in
+        self.anchors = [set() for x in xrange(self.player_count)]
+        # Empty cells sharing an edge with a player's pieces
+        self.forbidden = [set() for x in xrange(self.player_count)]
+
+    def valid_key(self, key):
+        if not (0 <= key[0] < self.rows and 0 <= key[1] < self.cols):
+            raise IndexError
+
+    def cell_move(self, x, y):
+        bits = self.CHUNK_BITS
+        try:
+            cells = self.chunks[(x >> bits, y >> bits)][1]
+        except KeyError:
+            return None
+        low = (1 << bits) - 1
+        return cells[((x & low) << bits) | (y & low)]
+
+    def set_cell(self, x, y, move):
+        bits = self.CHUNK_BITS
+        key = (x >> bits, y >> bits)
+        try:
+            chunk = self.chunks[key]
+        except KeyError:
+            if move is None:
+                return
+            chunk = self.chunks[key] = [0, [None] * (1 << (2 * bits))]
+
+        low = (1 << bits) - 1
+        i = ((x & low) << bits) | (y & low)
+        chunk[0] += (move is not None) - (chunk[1][i] is not None)
+        chunk[1][i] = move
+        if chunk[0] == 0:
+            del self.chunks[key]
+
+    def __getitem__(self, key):
+        self.valid_key(key)
+        return self.BlockClass(move=self.cell_move(key[0], key[1]),
+                **self.BlockClassKwds)
+
+    def __setitem__(self, key, val):
+        raise TypeError, "SparseBoard cells can only be changed by playing moves"
+
+    def index(self, elem):
+        raise TypeError, "SparseBoard cells are not stored as Block objects"
+
+    def is_legal_placement(self, move):
+        forbidden = self.forbidden[move.player_id]
+        for c in self.move_coords(move):
+            if not (0 <= c.x < self.rows and 0 <= c.y < self.cols) or\
+                    c in forbidden or self.cell_move(c.x, c.y) is not None:
+                return False
+        return True
+
+    def is_valid_move(self, move, first_move=False, ignore_turn=False):
+        if not first_move and len(self.moves[move.player_id]) == 0:
+            return self.is_valid_first_move(move)
+
+        if move.is_skip():
+            self._valid_reason = "Skip Succeeded"
+            return True
+
+        if move.player_id != self.turn:
+            self._valid_reason = "Current turn %d, move id %d" % (
+                    self.turn, move.player_id)
+            return False
+
+        if not self.piece_library[move.player_id].is_remaining(move.piece_id):
+            self._valid_reason = "Piece %d not in %d's remaining pieces" % (
+                    move.piece_id, move.player_id)
+            return False
+
+        if not self.is_legal_placement(move):
+            self._valid_reason = "Move %s is off the board, on an occupied "\
+                    "cell or next to one of its own pieces" % (move)
+            return False
+
+        # Legal placements covering an anchor touch a corner of their own
+        anchors = self.anchors[move.player_id]
+        if first_move or any(c in anchors for c in self.move_coords(move)):
+            self._valid_reason = "Move Succeeded"
+            return True
+
+        self._valid_reason = "Move touches no corners"
+        return False
+
+    # Board.legal_moves with is_legal_placement inlined
+    def legal_moves(self, player_id, anchors=None):
+        library = self.piece_library[player_id]
+        if anchors is None:
+            anchors = self.get_anchors(player_id)
+        anchors = [(a.x, a.y) for a in anchors]
+        forbidden = self.forbidden[player_id]
+        rows, cols = self.rows, self.cols
+        cell_move = self.cell_move
+        for piece_id in sorted(library.get_remaining_piece_ids()):
+            piece = library[piece_id]
+            for rotation, mirror, key in piece.unique_orientations():
+                coords = [(c.x, c.y) for c in
+                        piece.get_transform_coords(rotation, mirror)]
+                roots = set()
+                for cx, cy in coords:
+                    for ax, ay in anchors:
+                        root = (ax - cx, ay - cy)
+                        if root in roots:
+                            continue
+                        roots.add(root)
+                        for dx, dy in coords:
+                            x = root[0] + dx
+                            y = root[1] + dy
+                            if not (0 <= x < rows and 0 <= y < cols) or\
+                                    (x, y) in forbidden or\
+                                    cell_move(x, y) is not None:
+                                break
+                        else:
+                            yield Move(player_id, piece_id, rotation, mirror, root)
+
+    def place_piece(self, move):
+        coords = self.move_coords(move)
+        for c in coords:
+            self.set_cell(c.x, c.y, move)
+        self.update_frontier(move.player_id, coords)
+        return coords
+
+    def remove_piece(self, move, cells=None):
+        if cells is None:
+            cells = self.move_coords(move)
+        for c in cells:
+            self.set_cell(c.x, c.y, None)
+        self.update_frontier(move.player_id, cells)
+
+    def restore_cells(self, cells, moves):
+        self.chunks = {}
+        for player_moves in moves:
+            for move in player_moves:
+                if not move.is_skip():
+                    for c in self.move_coords(move):
+                        self.set_cell(c.x, c.y, move)
+        anchors, forbidden = cells
+        self.anchors = [set(a) for a in anchors]
+        self.forbidden = [set(f) for f in forbidden]
+
+
+"""
+Builds the fastest board for a game: a BitBoard, or a SparseBoard for large
+shapes. Takes the same arguments as Board, so it can be passed wherever a
+board constructor is expected.
+"""
+def new_board(library, restrict_piece_ids_to=None, shape=DEFAULT_BOARD_SHAPE,
+        player_count=DEFAULT_PLAYER_COUNT):
+    if shape[0] * shape[1] >= SPARSE_BOARD_CELLS:
+        cls = SparseBoard
+    else:
+        cls = BitBoard
+    return cls(library, restrict_piece_ids_to, shape, player_count)
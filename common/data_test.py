@@ -1,9 +1,49 @@
 ﻿# vim: ts=4 et sw=4 sts=4
 
+import os
+import random
+import shutil
+import tempfile
 import unittest
 
 from common.data import *
 
+class MoveTests(unittest.TestCase):
+    def assertSameMove(self, a, b):
+        self.assertEqual((a.player_id, a.piece_id, a.rotation, a.mirror, a.position),
+                (b.player_id, b.piece_id, b.rotation, b.mirror, b.position))
+
+    def test_encode(self):
+        for move in (
+                Move(0, 0),
+                Move(3, 7594, 3, True, (19,0)),
+                Move(15, Move.MAX_PIECE_ID, 2, False, (63,63)),
+                Move(255, 21, 1, True, (99,65535)),
+                Move.skip(2),
+                Move.dropped_skip(1),
+                Move.illegal(3),
+                Move.timeout(0),
+                ):
+            code = move.encode()
+            self.assertTrue(0 <= code < 1 << 64)
+            self.assertSameMove(Move.decode(code), move)
+            self.assertSameMove(Move.unpack(move.pack()), move)
+            self.assertEqual(len(move.pack()), 8)
+        self.assertTrue(Move.decode(Move.skip(1).encode()).is_voluntary_skip())
+
+    def test_encode_out_of_range(self):
+        for move in (
+                Move(256, 0),
+                Move(0, Move.MAX_PIECE_ID + 1),
+                Move(0, 0, position=(1 << 16,0)),
+                Move(0, 0, position=(0,-1)),
+                ):
+            self.assertRaises(ValueError, move.encode)
+
+    def test_slots(self):
+        self.assertRaises(AttributeError, setattr, Move(0, 0), 'extra', 1)
+        self.assertRaises(AttributeError, setattr, Point(0, 0), 'extra', 1)
+
 class PieceTests(unittest.TestCase):
     def test_create_from_string(self):
         text = """
@@ -48,5 +88,482 @@ XX
         self.assertEqual(piece.get_transform_coords(4), [(0,0),(1,0),(1,1),(1,2),(2,2)])
         self.assertEqual(piece.get_transform_coords(4), [(0,0),(1,0),(1,1),(1,2),(2,2)])
 
+    def test_transformed_edges_and_corners(self):
+        piece = Piece(0, 'OX.\n.X.\n.XX')
+        for rotation in xrange(4):
+            for mirror in (False, True):
+                coords = piece.get_transform_coords(rotation, mirror)
+                edges = piece.get_edges(rotation, mirror)
+                corners = piece.get_corners(rotation, mirror)
+                self.assertFalse(set(coords) & set(edges))
+                self.assertFalse(set(coords) & set(corners))
+                self.assertFalse(set(edges) & set(corners))
+                self.assertEqual(len(edges), 10)
+
+    def test_unique_orientations(self):
+        library = PieceLibrary('original')
+        # The 21 standard pieces have 91 distinct orientations
+        self.assertEqual(sum(len(p.unique_orientations()) for p in library), 91)
+
+        monomino = Piece(0, 'O')
+        self.assertEqual(monomino.unique_orientations(), [(0, False, ((0,0),))])
+        self.assertEqual(monomino.orientation_index(3, True), 0)
+
+        piece = Piece(0, 'OX\nX.')
+        keys = [key for rotation, mirror, key in piece.unique_orientations()]
+        self.assertEqual(len(keys), 4)
+        for rotation in xrange(4):
+            for mirror in (False, True):
+                self.assertEqual(keys[piece.orientation_index(rotation, mirror)],
+                        piece.shape_key(rotation, mirror))
+
+class PieceLibraryTests(unittest.TestCase):
+    def test_shared_catalog(self):
+        a = PieceLibrary('original')
+        b = PieceLibrary('original')
+        self.assertIs(a.catalog, b.catalog)
+        self.assertIs(a[3], b[3])
+        self.assertIsNot(PieceLibrary('original', [1,2,3]).catalog, a.catalog)
+        self.assertIs(PieceLibrary('original', [3,2,1]).catalog,
+                PieceLibrary('original', set([1,2,3])).catalog)
+
+    def test_used_pieces(self):
+        a = PieceLibrary('original')
+        b = a.copy()
+        a.play_move(Move(0, 3))
+        a.play_move(Move(0, 20))
+        a.play_move(Move.skip(0))
+        self.assertEqual(a.get_used_piece_ids(), set([3, 20]))
+        self.assertEqual(a.get_remaining_piece_ids(), set(range(21)) - set([3, 20]))
+        self.assertFalse(a.is_remaining(3))
+        self.assertFalse(a.is_remaining(21))
+        self.assertEqual(b.get_used_piece_ids(), set())
+        a.unplay_move(Move(0, 3))
+        self.assertEqual(a.used_piece_ids, set([20]))
+        self.assertRaises(KeyError, a.unplay_move, Move(0, 3))
+
+    def test_indexed_catalog(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'original')
+        try:
+            with open(path, 'w') as o:
+                o.write(open(PieceCatalog.find_library('original')).read())
+
+            catalog = PieceCatalog(path, [4, 20])
+            self.assertTrue(os.path.exists(path + PieceIndex.suffix))
+            self.assertEqual(set(catalog.pieces), set([4, 20]))
+            self.assertRaises(KeyError, catalog.__getitem__, 5)
+
+            catalog = PieceCatalog(path)
+            self.assertEqual(catalog.piece_ids, frozenset(range(21)))
+            self.assertEqual(catalog.pieces, {})
+            self.assertEqual(catalog[12].coords, Piece(12,
+                from_str="..O.\n.XX.\n.X..\n.X..\n").coords)
+            self.assertEqual(set(catalog.pieces), set([12]))
+
+            # A half-written sidecar is rescanned
+            with open(path + PieceIndex.suffix, 'r+b') as f:
+                f.truncate(20)
+            index = PieceIndex.get(path, open(path).read())
+            self.assertEqual(set(index.entries), set(range(21)))
+            self.assertEqual(len(os.listdir(directory)), 2)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_compiled_catalog(self):
+        source = PieceCatalog('original', use_compiled=False)
+        path = tempfile.mktemp()
+        try:
+            source.compile(path)
+            compiled = PieceCatalog('original')
+            compiled.pieces = {}
+            compiled.load_compiled(path, [2, 20])
+        finally:
+            os.remove(path)
+
+        self.assertEqual(set(compiled.pieces.keys()), set([2, 20]))
+        for pc_id, piece in compiled.pieces.items():
+            original = source[pc_id]
+            self.assertEqual(piece.coords, original.coords)
+            self.assertEqual(piece.shape, original.shape)
+            for rotation in xrange(4):
+                for mirror in (False, True):
+                    self.assertEqual(piece.get_transform_coords(rotation, mirror),
+                            original.get_transform_coords(rotation, mirror))
+                    self.assertEqual(set(piece.get_edges(rotation, mirror)),
+                            set(original.get_edges(rotation, mirror)))
+                    self.assertEqual(set(piece.get_corners(rotation, mirror)),
+                            set(original.get_corners(rotation, mirror)))
+                    self.assertEqual(piece.get_bounds(rotation, mirror),
+                            original.get_bounds(rotation, mirror))
+
+class PlacementTableTests(unittest.TestCase):
+    def test_save_and_load(self):
+        library = PieceLibrary('original')
+        table = PlacementTable(library, (7,9))
+        path = tempfile.mktemp()
+        try:
+            table.save(path)
+            loaded = PlacementTable.load(path, library)
+            for piece_id in library.piece_ids:
+                for rotation in xrange(4):
+                    for mirror in (False, True):
+                        self.assertEqual(
+                                table.entry(piece_id, rotation, mirror),
+                                loaded.entry(piece_id, rotation, mirror))
+        finally:
+            os.remove(path)
+
+    def test_cache_dir(self):
+        directory = tempfile.mkdtemp()
+        try:
+            restricted = PieceLibrary('original', [0, 1, 2])
+            PlacementTable.get(restricted, (6,6), directory)
+            PlacementTable._tables.clear()
+            library = PieceLibrary('original')
+            table = PlacementTable.get(library, (6,6), directory)
+            self.assertEqual(table.entry(20, 1, True),
+                    PlacementTable(library, (6,6)).entry(20, 1, True))
+            self.assertEqual(len(os.listdir(directory)), 2)
+
+            # A truncated file is rebuilt
+            PlacementTable._tables.clear()
+            for name in os.listdir(directory):
+                with open(os.path.join(directory, name), 'r+b') as f:
+                    f.truncate(10)
+            table = PlacementTable.get(library, (6,6), directory)
+            self.assertEqual(table.entry(20, 1, True),
+                    PlacementTable(library, (6,6)).entry(20, 1, True))
+        finally:
+            PlacementTable._tables.clear()
+            shutil.rmtree(directory)
+
+    def test_fits(self):
+        board = BitBoard('original', shape=(5,5))
+        # The 5-long I piece runs down from its root
+        self.assertTrue(board.move_mask(Move(0, 0, 0, False, (0,0))))
+        self.assertIsNone(board.move_mask(Move(0, 0, 0, False, (0,1))))
+        self.assertIsNone(board.move_mask(Move(0, 0, 0, False, (5,0))))
+        self.assertIsNone(board.move_mask(Move(0, 0, 0, False, (1,-1))))
+        self.assertEqual(board.move_mask(Move(0, 4, 0, False, (4,4))),
+                1 << board.bit(4,4))
+
 class BoardTests(unittest.TestCase):
-    pass
+    def random_moves(self, board, rng, count):
+        player_id = board.turn
+        piece_ids = list(board.get_remaining_piece_ids(player_id))
+        return [Move(player_id, rng.choice(piece_ids), rng.randrange(4),
+                    rng.random() < .5,
+                    (rng.randrange(-2, board.rows+2), rng.randrange(-2, board.cols+2)))
+                for x in xrange(count)]
+
+    def play_same_game(self, boards, plies, seed=0):
+        rng = random.Random(seed)
+        played = []
+        for x in xrange(plies):
+            if boards[0].turn < 0:
+                break
+            valid = None
+            for move in self.random_moves(boards[0], rng, 500):
+                results = [b.is_valid_move(move) for b in boards]
+                self.assertEqual(len(set(results)), 1, str(move))
+                if results[0] and valid is None:
+                    valid = move
+            if valid is None:
+                valid = Move.skip(boards[0].turn)
+            for b in boards:
+                b.play_move(valid)
+            played.append(valid)
+        return played
+
+    def test_bitboard_matches_board(self):
+        boards = [Board('original'), BitBoard('original'), SparseBoard('original')]
+        self.play_same_game(boards, 40)
+        for x in xrange(boards[0].rows):
+            for y in xrange(boards[0].cols):
+                self.assertIs(boards[0][(x,y)].move, boards[1][(x,y)].move)
+                self.assertIs(boards[0][(x,y)].move, boards[2][(x,y)].move)
+
+    def test_bitboard_unplay(self):
+        board = BitBoard('original')
+        played = self.play_same_game([board], 12)
+        self.assertTrue(board.occupied_mask)
+        for move in reversed(played):
+            board.unplay_move(move)
+        self.assertEqual(board.occupied_mask, 0)
+        self.assertEqual(board.own_masks, [0] * board.player_count)
+        self.assertEqual(board.turn, 0)
+
+    def test_bitboard_anchor_count(self):
+        def counts(board):
+            return [bin(board.anchor_mask(p)).count('1')
+                    for p in xrange(board.player_count)]
+
+        board = BitBoard('original', shape=(14,14))
+        # A player whose first move is a skip has no anchors at all
+        played = [Move.timeout(0)]
+        board.play_move(played[0])
+        played += self.play_same_game([board], 40, seed=3)
+        self.assertEqual(counts(board), [board.anchor_count(p)
+            for p in xrange(board.player_count)])
+        for move in reversed(played):
+            board.unplay_move(move)
+            self.assertEqual(counts(board), [board.anchor_count(p)
+                for p in xrange(board.player_count)])
+        self.assertEqual(board.anchor_counts, [0] * board.player_count)
+
+    def test_bitboard_first_move_in_corner(self):
+        board = BitBoard('original')
+        self.assertFalse(board.is_valid_move(Move(0, 4, position=(5,5))))
+        self.assertTrue(board.is_valid_move(Move(0, 4, position=(0,0))))
+        self.assertFalse(board.is_valid_move(Move(0, 0, position=(19,17))))
+
+    def move_keys(self, board, moves):
+        keys = set()
+        for m in moves:
+            keys.add((m.piece_id, frozenset(board.move_coords(m))))
+        return keys
+
+    def brute_force_moves(self, board, player_id):
+        for piece_id in board.get_remaining_piece_ids(player_id):
+            for rotation in xrange(4):
+                for mirror in (False, True):
+                    for x in xrange(board.rows):
+                        for y in xrange(board.cols):
+                            move = Move(player_id, piece_id, rotation, mirror, (x,y))
+                            if board.is_valid_move(move):
+                                yield move
+
+    def test_legal_moves(self):
+        boards = [cls('original', shape=(10,10))
+                for cls in (Board, BitBoard, SparseBoard)]
+        rng = random.Random(3)
+        played = []
+        for ply in xrange(16):
+            player_id = boards[1].turn
+            if player_id < 0:
+                break
+            expected = self.move_keys(boards[1],
+                    self.brute_force_moves(boards[1], player_id))
+            for board in boards:
+                moves = list(board.legal_moves(player_id))
+                self.assertEqual(len(moves), len(self.move_keys(board, moves)))
+                self.assertEqual(self.move_keys(board, moves), expected)
+            self.assertEqual(boards[0].get_anchors(player_id),
+                    boards[1].get_anchors(player_id))
+            self.assertEqual(boards[0].get_forbidden(player_id),
+                    boards[1].get_forbidden(player_id))
+            if moves:
+                move = rng.choice(moves)
+            else:
+                move = Move.skip(player_id)
+            for board in boards:
+                board.play_move(move)
+            played.append(move)
+
+        for board in (boards[0], boards[2]):
+            for move in reversed(played):
+                board.unplay_move(move)
+            self.assertEqual(board.anchors, [set()] * 4)
+            self.assertEqual(board.forbidden, [set()] * 4)
+        self.assertEqual(boards[2].chunks, {})
+
+    def test_many_players(self):
+        board = Board('original', shape=(20,20), player_count=8)
+        self.assertEqual(board.corners, ((0,0), (0,9), (0,19), (9,19),
+            (19,19), (19,10), (19,0), (10,0)))
+        self.assertEqual(len(board.get_anchors(5)), 8)
+        self.assertIsInstance(new_board('original'), BitBoard)
+        self.assertIsInstance(new_board('original', shape=(100,120),
+            player_count=16), SparseBoard)
+
+        boards = [cls('original', shape=(40,40), player_count=12)
+                for cls in (BitBoard, SparseBoard)]
+        rng = random.Random(4)
+        for ply in xrange(60):
+            player_id = boards[0].turn
+            moves = [list(board.legal_moves(player_id)) for board in boards]
+            self.assertEqual(self.move_keys(boards[0], moves[0]),
+                    self.move_keys(boards[1], moves[1]))
+            move = rng.choice(moves[0])
+            for board in boards:
+                self.assertTrue(board.is_valid_move(move))
+                board.play_move(move)
+        self.assertEqual([s.score for s in boards[0].standings()],
+                [s.score for s in boards[1].standings()])
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_placement_map(self):
+        boards = [Board('original', shape=(9,11)), BitBoard('original', shape=(9,11))]
+        rng = random.Random(4)
+        for ply in xrange(12):
+            player_id = boards[1].turn
+            for piece_id in (0, 4, 9, 17):
+                for rotation, mirror in ((0, False), (1, True), (3, False)):
+                    expected = numpy.zeros((9,11), dtype=bool)
+                    if piece_id in boards[1].get_remaining_piece_ids(player_id):
+                        for x in xrange(9):
+                            for y in xrange(11):
+                                expected[x,y] = boards[1].is_valid_move(
+                                        Move(player_id, piece_id, rotation, mirror, (x,y)))
+                    for board in boards:
+                        self.assertTrue((board.placement_map(
+                            player_id, piece_id, rotation, mirror) == expected).all())
+            moves = list(boards[1].legal_moves(player_id))
+            move = rng.choice(moves) if moves else Move.skip(player_id)
+            for board in boards:
+                board.play_move(move)
+
+    def test_zobrist(self):
+        for cls in (Board, BitBoard, SparseBoard):
+            board = cls('original', shape=(10,10))
+            empty = board.zobrist
+            played = self.play_same_game([board], 30, seed=2)
+            self.assertEqual(board.zobrist, board.compute_zobrist())
+            self.assertNotEqual(board.zobrist, empty)
+            for move in reversed(played):
+                board.unplay_move(move)
+                self.assertEqual(board.zobrist, board.compute_zobrist())
+            self.assertEqual(board.zobrist, empty)
+
+    def test_zobrist_transposition(self):
+        a = BitBoard('original', player_count=2)
+        b = BitBoard('original', player_count=2)
+        for board, order in ((a, (0, 1)), (b, (1, 0))):
+            firsts = (Move(0, 4, position=(0,0)), Move(0, 3, position=(0,18)))
+            board.play_move(firsts[order[0]])
+            board.play_move(Move(1, 4, position=(19,19)))
+            board.play_move(firsts[order[1]])
+        self.assertEqual(a.zobrist, b.zobrist)
+        self.assertEqual(a.zobrist, a.compute_zobrist())
+
+    def reference_score(self, board, player_id):
+        library = board.piece_library[player_id]
+        remaining = library.get_remaining_piece_ids()
+        if remaining:
+            return -sum(len(library[pc_id]) for pc_id in remaining)
+        placed = [m for m in board.moves[player_id] if not m.is_skip()]
+        return 20 if len(library[placed[-1].piece_id]) == 1 else 15
+
+    def test_standings(self):
+        finished = []
+        for cls in (Board, BitBoard, SparseBoard):
+            for seed in xrange(4):
+                rng = random.Random(seed)
+                board = cls('tiny', shape=(6,6))
+                played = []
+                while board.turn >= 0:
+                    moves = list(board.legal_moves(board.turn))
+                    move = rng.choice(moves) if moves else Move.skip(board.turn)
+                    board.play_move(move)
+                    played.append(move)
+                    for s in board.standings():
+                        self.assertEqual(s.score,
+                                self.reference_score(board, s.player_id))
+                        self.assertEqual(s.placed + s.remaining, 6)
+                        self.assertEqual(s.frontier,
+                                len(board.get_anchors(s.player_id)))
+                finished.append(board.clone())
+                for move in reversed(played):
+                    board.unplay_move(move)
+                self.assertEqual([s.score for s in board.standings()], [-6] * 4)
+
+        self.assertIn(20, [s.score for b in finished for s in b.standings()])
+        if numpy is not None:
+            self.assertEqual(Board.score_boards(finished).tolist(),
+                    [[s.score for s in b.standings()] for b in finished])
+
+    def test_checkpoint_and_rollback(self):
+        for cls in (Board, BitBoard, SparseBoard):
+            rng = random.Random(8)
+            board = cls('tiny', shape=(6,6))
+            snapshots = [board.snapshot()]
+            while board.turn >= 0:
+                moves = list(board.legal_moves(board.turn))
+                move = rng.choice(moves) if moves else Move.skip(board.turn)
+                board.play_move(move)
+                snapshots.append(board.snapshot())
+            self.assertEqual(board.checkpoint(), len(snapshots) - 1)
+
+            # Only the last move played can be taken back
+            self.assertRaises(KeyError, board.unplay_move, board.journal[-2][0])
+            for checkpoint in sorted(rng.sample(xrange(len(snapshots)), 4),
+                    reverse=True):
+                board.rollback_to(checkpoint)
+                self.assertEqual(board.snapshot(), snapshots[checkpoint])
+                self.assertEqual(board.zobrist, board.compute_zobrist())
+            self.assertRaises(ValueError, board.rollback_to, len(snapshots))
+
+    def test_influence(self):
+        def placements(board, player_id):
+            return set((m.piece_id, m.rotation, m.mirror, m.position.x,
+                m.position.y) for m in board.legal_moves(player_id))
+
+        for cls in (Board, BitBoard, SparseBoard):
+            board = cls('original', shape=(12,12))
+            tracker = board.influence()
+            self.play_same_game([board], 30, seed=9)
+            for checkpoint in (None, 12, 4):
+                if checkpoint is not None:
+                    board.rollback_to(checkpoint)
+                for p in xrange(board.player_count):
+                    self.assertEqual(set(tracker.placements[p]),
+                            placements(board, p))
+                    self.assertEqual(board.mobility(p), len(tracker.placements[p]))
+                    if numpy is not None:
+                        plane = board.mobility_plane(p)
+                        counts = numpy.zeros(board.shape, dtype=numpy.int32)
+                        for cells in tracker.placements[p].itervalues():
+                            for cell in cells:
+                                counts[cell] += 1
+                        self.assertTrue((plane == counts).all())
+                        self.assertFalse((plane.astype(bool) &
+                            ~board.reach_plane(p)).any())
+
+            if numpy is not None:
+                contested = board.contested_plane()
+                self.assertTrue(contested.max() > 1)
+                self.assertTrue((contested == sum(board.mobility_plane(p) > 0
+                    for p in xrange(board.player_count))).all())
+
+    def test_compact(self):
+        board = BitBoard('original', shape=(14,14))
+        self.play_same_game([board], 20, seed=10)
+        for cls in (None, SparseBoard):
+            copy = Board.from_compact(board.compact(), cls)
+            self.assertIsInstance(copy, cls or BitBoard)
+            self.assertEqual((copy.zobrist, copy.turn, copy.skips),
+                    (board.zobrist, board.turn, board.skips))
+            self.assertEqual(copy.compact()[1:], board.compact()[1:])
+
+        # A board needing more than a byte per coordinate
+        board = SparseBoard('original', shape=(70,70), player_count=18)
+        self.play_same_game([board], 20, seed=11)
+        copy = Board.from_compact(board.compact())
+        self.assertEqual((copy.zobrist, copy.turn), (board.zobrist, board.turn))
+
+    def test_snapshot_and_clone(self):
+        for cls in (Board, BitBoard, SparseBoard):
+            board = cls('original', shape=(10,10))
+            self.play_same_game([board], 10, seed=6)
+            snapshot = board.snapshot()
+            state = (board.zobrist, board.turn, list(board.skips),
+                    self.move_keys(board, board.legal_moves(board.turn)))
+
+            clone = board.clone()
+            played = self.play_same_game([board], 10, seed=7)
+            self.assertNotEqual(board.zobrist, state[0])
+            self.assertEqual(clone.zobrist, state[0])
+            self.assertEqual(clone.compute_zobrist(), state[0])
+
+            board.restore(snapshot)
+            for b in (board, clone):
+                self.assertEqual((b.zobrist, b.turn, b.skips,
+                    self.move_keys(b, b.legal_moves(b.turn))), state)
+                self.assertEqual(b.compute_zobrist(), b.zobrist)
+
+            # The clone is unaffected when the original replays the same moves
+            for move in played:
+                board.play_move(move)
+            self.assertEqual(clone.zobrist, state[0])
+            self.assertIs(clone.piece_library[0].pieces, board.piece_library[0].pieces)
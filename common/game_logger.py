@@ -3,12 +3,13 @@
 from common.data import PieceLibrary,Move
 
 class GameLogger(object):
-    def __init__(self, board, play=True, display=False, db=None):
+    def __init__(self, board, play=True, display=False, db=None,
+            filename='game.log'):
         self.board = board
         self.play = play
         self.display = display
 
-        self.o = open('game.log', 'w')
+        self.o = open(filename, 'w')
         self.o.write('#Version=0.12\n')
         self.o.write('#num_players=%d,rows=%d,cols=%d,library=%s\n' % (
             board.player_count,
@@ -35,6 +36,9 @@ class GameLogger(object):
 
         self.o.flush()
 
+    def close(self):
+        self.o.close()
+
 class GameParser(object):
     def __init__(self, logfile):
         self.l = open(logfile)
@@ -4,6 +4,8 @@
 # underlying Block class to allow for re-drawing? Things are starting to
 # duplicate a lot
 
+import colorsys
+
 import gi
 gi.require_version('Gtk', '3.0')
 from gi.repository import GObject
@@ -44,6 +46,35 @@ class BlockGui(Block):
             3 : 'green',
             }
 
+    """
+    Returns the name of a player's color. Players past the fourth get the
+    white block tinted with a hue of their own, made the first time it is
+    needed.
+    """
+    @classmethod
+    def player_color(cls, player_id):
+        try:
+            return cls.id_to_color[player_id]
+        except KeyError:
+            pass
+
+        # Golden ratio steps keep neighboring ids' hues far apart
+        hue = (player_id * 0.618033988749895) % 1.0
+        r, g, b = [int(v * 255) for v in colorsys.hsv_to_rgb(hue, 0.8, 0.9)]
+
+        white = cls.pixbufs['white']
+        width, height = white.get_width(), white.get_height()
+        tint = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8, width, height)
+        tint.fill((r << 24) | (g << 16) | (b << 8) | 0xff)
+        pixbuf = white.copy()
+        tint.composite(pixbuf, 0, 0, width, height, 0, 0, 1, 1,
+                GdkPixbuf.InterpType.NEAREST, 160)
+
+        name = 'player%d' % (player_id)
+        cls.pixbufs[name] = pixbuf
+        cls.id_to_color[player_id] = name
+        return name
+
     def __init__(self,
             color=None,
             player_id=None,
@@ -56,8 +87,8 @@ class BlockGui(Block):
         self.image = Gtk.Image()
 
         if player_id is not None:
-            if player_id not in BlockGui.id_to_color.keys():
-                raise TypeError, "Player ID must be one of: " + str(BlockGui.id_to_color.keys())
+            if player_id < 0:
+                raise TypeError, "Player ID must be >= 0"
         self.player_id = player_id
         self.watched_attrs.append('player_id')
         if color is not None:
@@ -104,13 +135,13 @@ class BlockGui(Block):
                 self.move.player_id
                 return self.pixbufs['black']
             except AttributeError:
-                return self.pixbufs[self.id_to_color[self.attempt_play_id]]
+                return self.pixbufs[self.player_color(self.attempt_play_id)]
         if self.player_id is not None:
-            return self.pixbufs[self.id_to_color[self.player_id]]
+            return self.pixbufs[self.player_color(self.player_id)]
         if self.color is not None:
             return self.pixbufs[self.color]
         try:
-            return self.pixbufs[self.id_to_color[self.move.player_id]]
+            return self.pixbufs[self.player_color(self.move.player_id)]
         except AttributeError:
             return self.pixbufs['empty']
 
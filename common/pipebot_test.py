@@ -0,0 +1,104 @@
+# vim: ts=4 et sw=4 sts=4
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'client'))
+
+from bots.pipebot import PipeBot
+from common.data import Move,new_board
+
+"""
+An engine answering go <request> with piece <request> of player 0 at
+(<moves seen>, 70). 'slow' waits before answering the first go, 'full'
+waits for all the time the go gives it, 'die' exits on the first go.
+"""
+STUB_ENGINE = """
+import sys, time
+mode = sys.argv[1]
+moves = 0
+while True:
+    words = sys.stdin.readline().split()
+    if not words or words[0] == 'quit':
+        break
+    if words[0] == 'move':
+        moves += 1
+    elif words[0] == 'go':
+        if mode == 'die':
+            break
+        if mode == 'slow' and words[1] == '1':
+            time.sleep(0.3)
+        elif mode == 'full':
+            time.sleep(int(words[2]) / 1000.0)
+        sys.stdout.write('play %s 0 %s 0 0 %d 70\\n' % (
+            words[1], words[1], moves))
+        sys.stdout.flush()
+"""
+
+class PipeBotTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.engine = os.path.join(self.dir, 'engine.py')
+        with open(self.engine, 'w') as o:
+            o.write(STUB_ENGINE)
+
+    def tearDown(self):
+        PipeBot.close_engines()
+        shutil.rmtree(self.dir)
+
+    def new_bot(self, mode):
+        class StubBot(PipeBot):
+            engine_command = [sys.executable, self.engine, mode]
+            move_time = 0.2
+        return StubBot(player_id=0,
+                board=new_board('tiny', shape=(6,6), player_count=2))
+
+    def test_reply(self):
+        bot = self.new_bot('fast')
+        bot.report_move(Move(0, 1, 0, False, (0,0)))
+        bot.report_move(Move(1, 1, 0, False, (5,5)))
+        move = bot.get_move()
+        self.assertEqual((move.player_id, move.piece_id, move.mirror),
+                (0, 1, False))
+        self.assertEqual((move.position.x, move.position.y), (2, 70))
+
+    def test_timeout_and_late_reply(self):
+        bot = self.new_bot('slow')
+        self.assertEqual(bot.get_move().piece_id, Move.TIMEOUT)
+        # The late reply to the first go is not taken for the second
+        bot.move_time = 5.0
+        self.assertEqual(bot.get_move().piece_id, 2)
+
+    def test_full_budget(self):
+        # The go leaves room for the reply to come back in time
+        bot = self.new_bot('full')
+        self.assertEqual(bot.get_move().piece_id, 1)
+        self.assertEqual(bot.get_move().piece_id, 2)
+
+    def test_dead_engine(self):
+        bot = self.new_bot('die')
+        self.assertEqual(bot.get_move().piece_id, Move.DROPPED_SKIP)
+
+        # A new game gets a new engine
+        engine = bot.engine
+        bot.close()
+        self.assertIsNot(self.new_bot('die').engine, engine)
+
+    def test_engine_kept_between_games(self):
+        bot = self.new_bot('fast')
+        bot.report_move(Move.skip(0))
+        bot.report_move(Move.skip(1))
+        self.assertEqual(bot.board.turn, -1)
+
+        # The engine is free once the game is over, though bot lives on
+        following = self.new_bot('fast')
+        self.assertIs(following.engine, bot.engine)
+        self.assertFalse(bot.send('go 0 0'))
+        self.assertEqual(following.get_move().piece_id, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,344 @@
+# vim: ts=4 et sw=4 sts=4
+
+import itertools
+import time
+
+from common.data import Move
+
+"""
+Returns a value per player for a position, higher being better for them:
+their score plus the number of anchors they have
+"""
+def evaluate_standings(board):
+    return [s.score + s.frontier for s in board.standings()]
+
+"""Returns every player's score as Board.get_score gives it"""
+def final_scores(board):
+    return [board.get_score(p) for p in xrange(board.player_count)]
+
+"""
+A fixed number of slots holding search results by position. A position
+goes in the slot its key hashes to and replaces what is there only if that
+was searched less deep or during an earlier search (depth-preferred).
+
+Entries are tuples (key, depth, flag, value, move, generation), move being
+the best move's (piece_id, rotation, mirror, x, y) or None.
+"""
+class TranspositionTable(object):
+    EXACT = 0
+    LOWER = 1
+    UPPER = 2
+
+    def __init__(self, capacity=1 << 16):
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.generation = 0
+        self.hits = 0
+        self.stores = 0
+
+    """Starts a new search, making every entry so far replaceable"""
+    def new_search(self):
+        self.generation += 1
+
+    def clear(self):
+        self.slots = [None] * self.capacity
+
+    def lookup(self, key):
+        entry = self.slots[hash(key) % self.capacity]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        return None
+
+    def store(self, key, depth, flag, value, move):
+        i = hash(key) % self.capacity
+        old = self.slots[i]
+        if old is None or old[0] == key or old[5] != self.generation or\
+                depth >= old[1]:
+            self.slots[i] = (key, depth, flag, value, move, self.generation)
+            self.stores += 1
+
+class SearchTimeout(Exception):
+    pass
+
+"""
+Deterministic multi-player search with iterative deepening, for any board
+shape and player count.
+
+mode     -- 'paranoid': alpha-beta where the other players are assumed to
+            play against the searching player, who maximizes their value
+            minus the mean of the others' values. 'maxn': every player
+            maximizes their own value.
+evaluate -- Function of a board returning a value per player
+table    -- The TranspositionTable to use, kept between searches
+width    -- If set, only the width best ordered moves are searched at each
+            node (the transposition table's move is always among them)
+"""
+class AlphaBetaSearch(object):
+    PARANOID = 'paranoid'
+    MAXN = 'maxn'
+
+    # Nodes searched between looks at the clock
+    check_every = 16
+
+    def __init__(self, mode=PARANOID, evaluate=evaluate_standings, table=None,
+            width=None):
+        if mode not in (self.PARANOID, self.MAXN):
+            raise ValueError, "Unknown search mode " + str(mode)
+        self.mode = mode
+        self.evaluate = evaluate
+        if table is None:
+            table = TranspositionTable()
+        self.table = table
+        self.width = width
+        self.nodes = 0
+        self.deadline = None
+
+    @staticmethod
+    def move_key(move):
+        return (move.piece_id, move.rotation, bool(move.mirror),
+                move.position.x, move.position.y)
+
+    """
+    Returns the moves of the player to move, best first by a quick guess:
+    the table's move, then moves covering more of the other players'
+    anchors, then bigger pieces
+    """
+    def ordered_moves(self, board, table_move=None):
+        player_id = board.turn
+        moves = list(board.legal_moves(player_id))
+        if not moves:
+            return [Move.skip(player_id)]
+
+        # How many of the other players have an anchor on each cell, gathered
+        # once for the node rather than for every move
+        anchored = {}
+        for p in xrange(board.player_count):
+            if p != player_id:
+                for c in board.get_anchors(p):
+                    c = (c.x, c.y)
+                    anchored[c] = anchored.get(c, 0) + 1
+        library = board.piece_library[player_id]
+        def order(move):
+            key = self.move_key(move)
+            cells = library[move.piece_id].get_transform_coords(
+                    move.rotation, move.mirror)
+            captured = 0
+            if anchored:
+                x, y = key[3], key[4]
+                for c in cells:
+                    captured += anchored.get((c.x + x, c.y + y), 0)
+            return (key != table_move, -captured, -len(cells), key)
+        moves.sort(key=order)
+
+        if self.width is not None:
+            moves = moves[:self.width]
+        return moves
+
+    def tick(self):
+        self.nodes += 1
+        if self.deadline is not None and self.nodes % self.check_every == 0 and\
+                time.time() > self.deadline:
+            raise SearchTimeout
+
+    def paranoid_value(self, board):
+        values = self.evaluate(board)
+        others = [v for p, v in enumerate(values) if p != self.root_player]
+        if not others:
+            return values[self.root_player]
+        return values[self.root_player] - float(sum(others)) / len(others)
+
+    """
+    Returns (value, best move) of the position for the searching player,
+    exact if it lies strictly between alpha and beta, otherwise a bound on
+    the side it fell
+    """
+    def paranoid(self, board, depth, alpha, beta):
+        self.tick()
+        if depth <= 0 or board.turn < 0:
+            return self.paranoid_value(board), None
+
+        key = (board.zobrist, self.root_player)
+        entry = self.table.lookup(key)
+        table_move = None
+        if entry is not None:
+            table_move = entry[4]
+            if entry[1] >= depth:
+                flag, value = entry[2], entry[3]
+                if flag == TranspositionTable.EXACT or\
+                        (flag == TranspositionTable.LOWER and value >= beta) or\
+                        (flag == TranspositionTable.UPPER and value <= alpha):
+                    return value, table_move
+
+        maximizing = board.turn == self.root_player
+        original_alpha, original_beta = alpha, beta
+        best_value = None
+        best_move = None
+        for move in self.ordered_moves(board, table_move):
+            board.play_move(move)
+            try:
+                value = self.paranoid(board, depth - 1, alpha, beta)[0]
+            finally:
+                board.unplay_move(move)
+
+            if best_value is None or (value > best_value if maximizing else
+                    value < best_value):
+                best_value = value
+                best_move = self.move_key(move)
+            if maximizing:
+                alpha = max(alpha, value)
+            else:
+                beta = min(beta, value)
+            if alpha >= beta:
+                break
+
+        if best_value <= original_alpha:
+            flag = TranspositionTable.UPPER
+        elif best_value >= original_beta:
+            flag = TranspositionTable.LOWER
+        else:
+            flag = TranspositionTable.EXACT
+        self.table.store(key, depth, flag, best_value, best_move)
+        return best_value, best_move
+
+    """Returns (values, best move) of the position when every player
+    maximizes their own value"""
+    def maxn(self, board, depth):
+        self.tick()
+        if depth <= 0 or board.turn < 0:
+            return self.evaluate(board), None
+
+        key = (board.zobrist, None)
+        entry = self.table.lookup(key)
+        table_move = None
+        if entry is not None:
+            if entry[1] >= depth:
+                return entry[3], entry[4]
+            table_move = entry[4]
+
+        player_id = board.turn
+        best_values = None
+        best_move = None
+        for move in self.ordered_moves(board, table_move):
+            board.play_move(move)
+            try:
+                values = self.maxn(board, depth - 1)[0]
+            finally:
+                board.unplay_move(move)
+            if best_values is None or values[player_id] > best_values[player_id]:
+                best_values = values
+                best_move = self.move_key(move)
+
+        self.table.store(key, depth, TranspositionTable.EXACT, best_values,
+                best_move)
+        return best_values, best_move
+
+    """
+    Searches the position for the player to move with iterative deepening,
+    one ply deeper at a time until max_depth or the deadline (a time.time()
+    value). Returns (move, value, depth) from the deepest finished search;
+    depth 1 is searched whatever the deadline.
+    """
+    def search(self, board, max_depth=None, deadline=None):
+        self.root_player = board.turn
+        self.deadline = deadline
+        self.nodes = 0
+        self.table.new_search()
+
+        result = (None, None, 0)
+        depth = 0
+        while max_depth is None or depth < max_depth:
+            depth += 1
+            # The first ply is always searched, so there is always a move
+            self.deadline = deadline if depth > 1 else None
+            try:
+                move, value = self.search_depth(board, depth)
+            except SearchTimeout:
+                break
+            result = (move, value, depth)
+
+            # Nothing changes past the end of the game
+            if board.turn < 0 or depth >= self.depth_limit(board):
+                break
+        return result
+
+    """Returns (move, value) for the best move found by a search of depth
+    plies, which must finish"""
+    def search_depth(self, board, depth):
+        if self.mode == self.PARANOID:
+            value, key = self.paranoid(board, depth, float('-inf'), float('inf'))
+        else:
+            values, key = self.maxn(board, depth)
+            value = values[self.root_player]
+
+        if key is None:
+            return Move.skip(self.root_player), value
+        piece_id, rotation, mirror, x, y = key
+        return Move(self.root_player, piece_id, rotation, mirror, (x, y)), value
+
+    """Returns the most plies which can still be played (all pieces left)"""
+    def depth_limit(self, board):
+        return sum(len(board.get_remaining_piece_ids(p))
+                for p in xrange(board.player_count) if not board.skips[p]) or 1
+
+"""A TranspositionTable which keeps every entry, for searches which must
+not forget any position"""
+class MemoTable(TranspositionTable):
+    def __init__(self):
+        super(MemoTable, self).__init__(0)
+        self.entries = {}
+
+    def clear(self):
+        self.entries = {}
+
+    def lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+        return entry
+
+    def store(self, key, depth, flag, value, move):
+        self.entries[key] = (key, depth, flag, value, move, self.generation)
+        self.stores += 1
+
+"""
+Solves endgames: searches every line to the end of the game, remembering
+every position, so values are exact final scores (Board.get_score, bonuses
+included). In 'maxn' mode the value is the searching player's final score
+when every player maximizes their own; in 'paranoid' mode it is their
+final score minus the mean of the others' when the others play against
+them. Only worth running once few placements are left, see
+remaining_placements.
+"""
+class EndgameSolver(AlphaBetaSearch):
+    # Deeper than any game, so only the end of the game stops the search
+    END = 1 << 30
+
+    def __init__(self, mode=AlphaBetaSearch.MAXN):
+        super(EndgameSolver, self).__init__(mode, evaluate=final_scores,
+                table=MemoTable())
+
+    """
+    Returns the number of legal placements left to every player still
+    playing, counting no further than limit
+    """
+    @staticmethod
+    def remaining_placements(board, limit=None):
+        moves = itertools.chain(*[board.legal_moves(p)
+            for p in xrange(board.player_count) if not board.skips[p]])
+        if limit is not None:
+            moves = itertools.islice(moves, limit + 1)
+        return sum(1 for m in moves)
+
+    """
+    Solves the position for the player to move. Returns (move, value), or
+    None if the deadline (a time.time() value) passed first.
+    """
+    def solve(self, board, deadline=None):
+        self.root_player = board.turn
+        self.deadline = deadline
+        self.nodes = 0
+        try:
+            return self.search_depth(board, self.END)
+        except SearchTimeout:
+            return None
@@ -0,0 +1,88 @@
+# vim: ts=4 et sw=4 sts=4
+
+import unittest
+
+from common.data import *
+from common.search import *
+
+class TranspositionTableTests(unittest.TestCase):
+    def test_depth_preferred(self):
+        table = TranspositionTable(1)
+        table.store('a', 3, TranspositionTable.EXACT, 1.0, None)
+        table.store('b', 2, TranspositionTable.EXACT, 2.0, None)
+        self.assertEqual(table.lookup('a')[3], 1.0)
+        self.assertEqual(table.lookup('b'), None)
+
+        # Deeper results and results of a later search replace it
+        table.store('b', 4, TranspositionTable.EXACT, 2.0, None)
+        self.assertEqual(table.lookup('b')[3], 2.0)
+        table.new_search()
+        table.store('c', 1, TranspositionTable.EXACT, 3.0, None)
+        self.assertEqual(table.lookup('c')[3], 3.0)
+        self.assertEqual(table.lookup('b'), None)
+
+class AlphaBetaSearchTests(unittest.TestCase):
+    def minimax(self, board, root_player, depth, evaluate=evaluate_standings):
+        if depth == 0 or board.turn < 0:
+            values = evaluate(board)
+            others = [v for p, v in enumerate(values) if p != root_player]
+            return values[root_player] - float(sum(others)) / len(others)
+        moves = list(board.legal_moves(board.turn)) or [Move.skip(board.turn)]
+        values = []
+        for move in moves:
+            board.play_move(move)
+            values.append(self.minimax(board, root_player, depth - 1,
+                evaluate))
+            board.unplay_move(move)
+        if board.turn == root_player:
+            return max(values)
+        return min(values)
+
+    def test_paranoid_matches_minimax(self):
+        for cls in (Board, BitBoard, SparseBoard):
+            board = cls('tiny', shape=(6,6))
+            board.play_move(Move(0, 0, position=(0,0)))
+            board.play_move(Move(1, 1, position=(0,4)))
+            for depth in (1, 2, 3):
+                search = AlphaBetaSearch()
+                move, value, reached = search.search(board, max_depth=depth)
+                self.assertEqual(reached, depth)
+                self.assertAlmostEqual(value,
+                        self.minimax(board, board.turn, depth))
+                self.assertTrue(board.is_valid_move(move))
+
+    def test_deterministic(self):
+        for mode in (AlphaBetaSearch.PARANOID, AlphaBetaSearch.MAXN):
+            board = Board('tiny', shape=(6,6))
+            results = [AlphaBetaSearch(mode).search(board, max_depth=2)
+                    for i in xrange(2)]
+            self.assertEqual(AlphaBetaSearch.move_key(results[0][0]),
+                    AlphaBetaSearch.move_key(results[1][0]))
+            self.assertEqual(results[0][1], results[1][1])
+            self.assertTrue(board.is_valid_move(results[0][0]))
+
+    def test_endgame_solver(self):
+        board = Board('tiny', shape=(6,6))
+        for move in (Move(0, 2, 0, False, (0,0)), Move(1, 0, 0, False, (5,4)),
+                Move(2, 1, 0, False, (5,0)), Move(3, 1, 0, False, (0,5))):
+            board.play_move(move)
+        for i in xrange(2):
+            board.play_move(next(board.legal_moves(board.turn)))
+        self.assertEqual(EndgameSolver.remaining_placements(board, 3), 4)
+
+        solver = EndgameSolver(AlphaBetaSearch.PARANOID)
+        move, value = solver.solve(board)
+        self.assertAlmostEqual(value,
+                self.minimax(board, board.turn, 100, final_scores))
+
+        # Following the solver's moves reaches the score it promised
+        solver = EndgameSolver()
+        player_id = board.turn
+        move, value = solver.solve(board)
+        while board.turn >= 0:
+            board.play_move(solver.solve(board)[0])
+        self.assertEqual(board.get_score(player_id), value)
+        self.assertTrue(value in (15, 20))
+
+if __name__ == '__main__':
+    unittest.main()
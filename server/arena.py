@@ -0,0 +1,249 @@
+# vim: ts=4 et sw=4 sts=4
+
+"""Plays bots against each other in-process and rates them.
+
+Usage: python server/arena.py [options] bot [bot ...]
+
+Bots are named by module and class under client/, e.g.
+bots.dummybot.DummyBot. Seats are filled with the bots in turn, rotating by
+one seat every game, so each bot gets every seat. Games are played without
+sockets by a pool of worker processes, following the same rules as
+controller.BasicGame, and can be logged in the game.log format."""
+
+import argparse
+import collections
+import importlib
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'client'))
+
+from common.bot import Bot
+from common.data import Move,new_board
+from common.data import DEFAULT_BOARD_SHAPE,DEFAULT_PLAYER_COUNT
+from common.game_logger import GameLogger
+
+_bot_classes = {}
+
+"""Returns the bot class named by module.Class"""
+def load_bot(name):
+    try:
+        return _bot_classes[name]
+    except KeyError:
+        module, cls = name.rsplit('.', 1)
+        bot_class = getattr(importlib.import_module(module), cls)
+        _bot_classes[name] = bot_class
+        return bot_class
+
+"""
+Plays one game between the named bots, the bot in seat i being player i.
+Returns every player's final score. With a log path the game is written
+there by a GameLogger. With a time_control of (base, increment) seconds
+the players have clocks as in controller.BasicGame; bots run in this
+process and cannot be interrupted, so a move which comes too late is
+replaced by Move.timeout once it does, and that player's game ends.
+"""
+def play_game(seats, library='original', shape=DEFAULT_BOARD_SHAPE,
+        log_path=None, time_control=None):
+    player_count = len(seats)
+    board = new_board(library, shape=shape, player_count=player_count)
+    bots = [load_bot(name)(player_id=p, board=board.clone())
+            for p, name in enumerate(seats)]
+    logger = None
+    if log_path is not None:
+        logger = GameLogger(board, play=False, filename=log_path)
+
+    skips = [False] * player_count
+    clocks = None
+    if time_control is not None:
+        clocks = [float(time_control[0])] * player_count
+    player_id = 0
+    try:
+        while not all(skips):
+            if not skips[player_id]:
+                bot = bots[player_id]
+                if len(board.get_remaining_piece_ids(player_id)) == 0:
+                    move = Move.skip(player_id)
+                elif clocks is not None and clocks[player_id] <= 0:
+                    move = Move.skip(player_id)
+                else:
+                    start = time.time()
+                    deadline = None
+                    if clocks is not None:
+                        deadline = start + clocks[player_id]
+                    try:
+                        move = bot.get_move(deadline)
+                    except Exception:
+                        traceback.print_exc()
+                        move = Move.dropped_skip(player_id)
+                    if clocks is not None:
+                        clocks[player_id] -= time.time() - start
+                        if clocks[player_id] < 0:
+                            bot.report_status(Bot.STATUS_SKIPPED, "Out of time")
+                            move = Move.timeout(player_id)
+                            clocks[player_id] = 0.0
+                        else:
+                            clocks[player_id] += time_control[1]
+                    if not board.is_valid_move(move):
+                        bot.report_status(Bot.STATUS_SKIPPED, "Illegal Move")
+                        move = Move.illegal(player_id)
+
+                if move.is_voluntary_skip():
+                    skips[player_id] = True
+                board.play_move(move)
+                if logger is not None:
+                    logger.add_move(move)
+                for b in bots:
+                    b.report_move(move)
+            player_id = (player_id + 1) % player_count
+    finally:
+        if logger is not None:
+            logger.close()
+        for bot in bots:
+            if hasattr(bot, 'close'):
+                bot.close()
+
+    return [board.get_score(p) for p in xrange(player_count)]
+
+"""Internal - Runs play_game in a worker process"""
+def _play_game(args):
+    game, seats, library, shape, log_path, time_control, quiet = args
+    if quiet and sys.stdout is sys.__stdout__:
+        sys.stdout = open(os.devnull, 'w')
+    return game, seats, play_game(seats, library, shape, log_path,
+            time_control)
+
+"""
+Elo ratings from multi-player games, each game counting as a game between
+every pair of different bots in it, won by the higher score. A game moves
+a bot's rating by at most k.
+
+A bot in several seats of a game plays it once: its wins are its seats'
+shares of the win, and its score is the mean over the seats it held.
+"""
+class EloRatings(object):
+    def __init__(self, k=16, initial=1500):
+        self.k = k
+        self.initial = initial
+        self.ratings = collections.defaultdict(lambda: float(self.initial))
+        # name -> [games, wins, total score, seats]
+        self.stats = collections.defaultdict(lambda: [0, 0.0, 0, 0])
+
+    def expected(self, a, b):
+        return 1.0 / (1.0 + 10 ** ((self.ratings[b] - self.ratings[a]) / 400.0))
+
+    """Rates a game from the bot in each seat and the seats' scores"""
+    def add_game(self, seats, scores):
+        best = max(scores)
+        winners = scores.count(best)
+        for name in set(seats):
+            stats = self.stats[name]
+            stats[0] += 1
+            for seat, score in zip(seats, scores):
+                if seat == name:
+                    stats[1] += 1.0 / winners if score == best else 0.0
+                    stats[2] += score
+                    stats[3] += 1
+
+        pairs = [(i, j) for i in xrange(len(seats))
+                for j in xrange(i + 1, len(seats)) if seats[i] != seats[j]]
+        if not pairs:
+            return
+        k = float(self.k) / (len(seats) - 1)
+        deltas = collections.defaultdict(float)
+        for i, j in pairs:
+            a, b = seats[i], seats[j]
+            if scores[i] > scores[j]:
+                actual = 1.0
+            elif scores[i] < scores[j]:
+                actual = 0.0
+            else:
+                actual = 0.5
+            delta = k * (actual - self.expected(a, b))
+            deltas[a] += delta
+            deltas[b] -= delta
+        for name, delta in deltas.iteritems():
+            self.ratings[name] += delta
+
+    def __str__(self):
+        lines = ["%-40s %7s %6s %6s %7s" % ('bot', 'elo', 'games', 'wins',
+            'score')]
+        for name in sorted(self.stats, key=lambda n: -self.ratings[n]):
+            games, wins, score, seats = self.stats[name]
+            lines.append("%-40s %7.1f %6d %6.1f %7.2f" % (name,
+                self.ratings[name], games, wins, float(score) / seats))
+        return '\n'.join(lines)
+
+"""
+Plays games between the named bots with a pool of workers, rating them as
+the results come in. Logs go to log_dir/game-N.log if log_dir is set.
+Returns the EloRatings.
+"""
+def run_arena(bots, games, player_count=DEFAULT_PLAYER_COUNT,
+        library='original', shape=DEFAULT_BOARD_SHAPE, workers=None,
+        log_dir=None, quiet=True, time_control=None):
+    if log_dir is not None and not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+
+    jobs = []
+    for game in xrange(games):
+        seats = tuple(bots[(game + s) % len(bots)] for s in xrange(player_count))
+        log_path = None
+        if log_dir is not None:
+            log_path = os.path.join(log_dir, 'game-%d.log' % (game,))
+        jobs.append((game, seats, library, shape, log_path, time_control,
+            quiet))
+
+    ratings = EloRatings()
+    if workers == 1:
+        results = (_play_game(job[:-1] + (False,)) for job in jobs)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(workers)
+        # Ordered, so the ratings do not depend on which games finish first
+        results = pool.imap(_play_game, jobs, chunksize=4)
+    try:
+        for game, seats, scores in results:
+            ratings.add_game(seats, scores)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return ratings
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Plays bots against each "
+            "other and rates them")
+    parser.add_argument('bots', nargs='+', metavar='bot',
+            help="Bot class as module.Class, e.g. bots.dummybot.DummyBot")
+    parser.add_argument('-n', '--games', type=int, default=100)
+    parser.add_argument('-p', '--players', type=int,
+            default=DEFAULT_PLAYER_COUNT)
+    parser.add_argument('-l', '--library', default='original')
+    parser.add_argument('-s', '--shape', type=int, nargs=2,
+            default=DEFAULT_BOARD_SHAPE, metavar=('ROWS', 'COLS'))
+    parser.add_argument('-w', '--workers', type=int, default=None,
+            help="Worker processes, by default one per core")
+    parser.add_argument('-o', '--log-dir', default=None,
+            help="Directory to write every game's log to")
+    parser.add_argument('-t', '--time-control', type=float, nargs=2,
+            default=None, metavar=('BASE', 'INCREMENT'),
+            help="Give every player a clock of BASE seconds, plus INCREMENT "
+            "per move")
+    args = parser.parse_args()
+
+    time_control = None
+    if args.time_control is not None:
+        time_control = tuple(args.time_control)
+    start = time.time()
+    ratings = run_arena(args.bots, args.games, args.players, args.library,
+            tuple(args.shape), args.workers, args.log_dir,
+            time_control=time_control)
+    elapsed = time.time() - start
+    print ratings
+    print "%d games in %.1fs (%.0f games/minute)" % (args.games, elapsed,
+            args.games * 60.0 / elapsed)
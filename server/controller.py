@@ -1,10 +1,14 @@
 # vim: ts=4 et sw=4 sts=4
 
 import random
+import socket
+import sys
 import threading
+import time
 
 from common.communication import Message
-from common.data import Board,Move
+from common.data import Move,new_board
+from common.data import DEFAULT_BOARD_SHAPE,DEFAULT_PLAYER_COUNT
 from common.bot import Bot
 from common.game_logger import GameLogger
 
@@ -30,21 +34,40 @@ class Game(object):
         except NameError:
             raise self.InitializationError, "Game subclass must define a board"
 
+"""
+Plays one game between players connecting to the server.
+
+time_control -- Optionally (base, increment) in seconds: every player's
+                clock starts at base and gains increment with each move
+                made in time. A clock runs while the server waits for
+                that player's move. The TURN message carries the seconds
+                left on the clock.
+
+Running out of time ends a player's game: the late move is timed out
+(Move.timeout) and, the clock staying empty, the player is skipped
+(Move.skip) on their next turn. An illegal move only loses the turn.
+"""
 class BasicGame(Game):
-    def __init__(self, port=None):
+    def __init__(self, port=None, player_count=DEFAULT_PLAYER_COUNT,
+            shape=DEFAULT_BOARD_SHAPE, library='original', time_control=None):
+        self.player_count = player_count
+        self.time_control = time_control
+        self.clocks = None
+        if time_control is not None:
+            self.clocks = [float(time_control[0])] * player_count
         self.arrival_sem = threading.Semaphore(0)
         self.go_sem = []
-        self.socks = [0,0,0,0]
-        self.skips = [0,0,0,0]
+        self.socks = [0] * player_count
+        self.skips = [0] * player_count
         self.done = False
 
-        for i in xrange(4):
+        for i in xrange(player_count):
             self.go_sem.append(threading.Semaphore(0))
 
-        self.board = Board('original')
+        self.board = new_board(library, shape=shape, player_count=player_count)
         self.game_logger = GameLogger(self.board, display=True)
 
-        super(BasicGame, self).__init__()
+        super(BasicGame, self).__init__(port)
 
     def player(self, player_id):
         l = threading.local()
@@ -75,12 +98,16 @@ class BasicGame(Game):
             if not self.skips[player_id]:
                 if len(self.board.get_remaining_piece_ids(player_id)) == 0:
                     move = Move.skip(player_id)
+                elif self.clocks is not None and self.clocks[player_id] <= 0:
+                    move = Move.skip(player_id)
                 else:
                     try:
-                        Message.serialized(l.sock, Message.TYPE_CONTROL, "TURN")
-
-                        m = Message(l.sock, Message.TYPE_MOVE)
-                        move = m.message_object
+                        move = self.request_move(l.sock, player_id)
+                    except socket.timeout:
+                        Message.serialized(l.sock, Message.TYPE_STATUS,\
+                                [Bot.STATUS_SKIPPED, "Out of time"])
+                        print 'TIMEOUT: player %d' % (player_id,)
+                        move = Move.timeout(player_id)
                     except IOError:
                         move = Move.dropped_skip(player_id)
 
@@ -93,13 +120,13 @@ class BasicGame(Game):
                     else:
                         l.is_first_move = False
 
-                if move.is_skip():
+                if move.is_voluntary_skip():
                     self.skips[player_id] = True
 
-                    if sum(self.skips) == 4:
+                    if sum(self.skips) == self.player_count:
                         self.game_logger.add_move(move)
                         print "=================="
-                        print "4 skips. Game Over"
+                        print "%d skips. Game Over" % (self.player_count)
                         for s in self.socks:
                             Message.serialized(s, Message.TYPE_MOVE, move, suppress_err=True)
                         self.done = True
@@ -112,21 +139,38 @@ class BasicGame(Game):
                 for s in self.socks:
                     Message.serialized(s, Message.TYPE_MOVE, move, suppress_err=True)
 
-            self.go_sem[(player_id+1) % 4].release()
+            self.go_sem[(player_id+1) % self.player_count].release()
 
         Message.serialized(l.sock, Message.TYPE_STATUS,\
                 [Bot.STATUS_GAME_OVER, "This game has ended"])
 
+    """Sends a player the TURN and returns the move they answer with. With
+    clocks, raises socket.timeout if the player's clock runs out first."""
+    def request_move(self, sock, player_id):
+        if self.clocks is None:
+            Message.serialized(sock, Message.TYPE_CONTROL, "TURN")
+            return Message(sock, Message.TYPE_MOVE).message_object
+
+        start = time.time()
+        remaining = self.clocks[player_id]
+        Message.serialized(sock, Message.TYPE_CONTROL, ["TURN", remaining])
+        try:
+            m = Message(sock, Message.TYPE_MOVE, deadline=start + remaining)
+        except socket.timeout:
+            self.clocks[player_id] = 0.0
+            raise
+        self.clocks[player_id] = max(0.0, remaining - (time.time() - start)) +\
+                self.time_control[1]
+        return m.message_object
+
     def play_game(self):
-        players = [0,1,2,3]
+        players = range(self.player_count)
         random.shuffle(players)
 
         t = []
 
-        t.append(threading.Thread(target=self.player, args=(players[0],)))
-        t.append(threading.Thread(target=self.player, args=(players[1],)))
-        t.append(threading.Thread(target=self.player, args=(players[2],)))
-        t.append(threading.Thread(target=self.player, args=(players[3],)))
+        for player_id in players:
+            t.append(threading.Thread(target=self.player, args=(player_id,)))
 
         for thread in t:
             thread.start()
@@ -141,5 +185,13 @@ class BasicGame(Game):
             print "THREAD DEAD"
 
 if __name__ == '__main__':
-    g = BasicGame()
+    # controller.py [player_count [rows cols [base_seconds increment_seconds]]]
+    kwds = {}
+    if len(sys.argv) > 1:
+        kwds['player_count'] = int(sys.argv[1])
+    if len(sys.argv) > 3:
+        kwds['shape'] = (int(sys.argv[2]), int(sys.argv[3]))
+    if len(sys.argv) > 5:
+        kwds['time_control'] = (float(sys.argv[4]), float(sys.argv[5]))
+    g = BasicGame(**kwds)
     g.play_game()